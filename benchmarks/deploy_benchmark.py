@@ -0,0 +1,403 @@
+"""
+Deploy benchmark for opsworkstool.
+
+Generates a project with a synthetic cookbook tree and runs the whole
+deploy pipeline against in-memory S3, CloudFormation and SSM stand-ins.
+Every run happens in a fresh interpreter and deploys twice: "cold" builds,
+uploads and creates the stacks, "unchanged" repeats the deploy with nothing
+changed.
+
+--pipeline picks the deploy path that is measured. "change-set", the
+default, deploys with --content-digest and --change-set, so the unchanged
+deploy reuses the bundle and leaves the stacks alone. "default" deploys with
+no options: zip, upload, then a stackility create/update followed by stack
+polling, every time. Wall time, CPU time, peak RSS and the API calls made by each deploy
+step are written as JSON; --compare checks them against an earlier result.
+With --vendor the project gets a Berksfile of that many cookbooks and deploys
+with --vendor, resolved by the fake_berks.py stand-in.
+
+Usage:
+    python benchmarks/deploy_benchmark.py [--files 2000] [--file-size 4]
+        [--stages dev,qa] [--runs 3] [--output result.json]
+        [--compare baseline.json] [--tolerance 0.10] [--vendor 5]
+        [--pipeline change-set|default]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_BERKS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_berks.py')
+REGION = 'us-east-1'
+SCENARIOS = ('cold', 'unchanged')
+PIPELINES = ('change-set', 'default')
+WORDS = (
+    'package', 'service', 'template', 'directory', 'owner', 'group', 'mode',
+    'action', 'notifies', 'variables', 'source', 'node', 'default', 'attribute',
+    'include_recipe', 'execute', 'command', 'not_if', 'only_if', 'cookbook_file'
+)
+
+TEMPLATE = {
+    'AWSTemplateFormatVersion': '2010-09-09',
+    'Description': 'opsworkstool deploy benchmark',
+    'Parameters': {
+        'RecipeS3Url': {'Type': 'String'},
+        'InstanceType': {'Type': 'String', 'Default': 't3.micro'}
+    },
+    'Resources': {
+        'Stack': {
+            'Type': 'AWS::OpsWorks::Stack',
+            'Properties': {
+                'Name': {'Ref': 'AWS::StackName'},
+                'UseCustomCookbooks': True,
+                'CustomCookbooksSource': {'Type': 's3', 'Url': {'Ref': 'RecipeS3Url'}}
+            }
+        },
+        'Layer': {
+            'Type': 'AWS::OpsWorks::Layer',
+            'Properties': {'StackId': {'Ref': 'Stack'}, 'Type': 'custom'}
+        },
+        'Instance': {
+            'Type': 'AWS::OpsWorks::Instance',
+            'Properties': {
+                'StackId': {'Ref': 'Stack'},
+                'LayerIds': [{'Ref': 'Layer'}],
+                'InstanceType': {'Ref': 'InstanceType'}
+            }
+        }
+    }
+}
+
+
+def vendor_cache(project):
+    return os.path.join(os.path.dirname(project), 'berks-cache')
+
+
+def make_project(root, files, file_size, cookbooks, stages, seed, vendor=0):
+    """
+    Lay out an opsworkstool project with files spread over cookbooks and the
+    usual recipes/attributes/templates/files directories, plus a Berksfile
+    of vendor dependencies when vendor is not 0.
+    """
+    rng = random.Random(seed)
+    name = os.path.basename(root)
+    os.makedirs(os.path.join(root, 'config'))
+    with open(os.path.join(root, '.opsworkstool'), 'w') as f:
+        json.dump({'name': name}, f)
+    with open(os.path.join(root, 'template.json'), 'w') as f:
+        json.dump(TEMPLATE, f, indent=2)
+    with open(os.path.join(root, 'config', 'config.ini'), 'w') as f:
+        for stage in stages:
+            f.write('[{}]\nbucket=bench-{}\nrecipes3url=x\n\n'.format(stage, stage))
+        if vendor:
+            f.write('[vendor]\ncommand="{}" "{}" {{target}}\ncache_directory={}\n'.format(
+                sys.executable,
+                FAKE_BERKS,
+                vendor_cache(root)
+            ))
+
+    kinds = ('recipes', 'attributes', 'templates/default', 'files/default')
+    for i in range(files):
+        directory = os.path.join(
+            root,
+            'recipe',
+            'cookbook{:03d}'.format(i % cookbooks),
+            kinds[i % len(kinds)]
+        )
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        lines = []
+        size = 0
+        while size < file_size * 1024:
+            line = ' '.join(rng.choice(WORDS) for _ in range(8)) + '\n'
+            lines.append(line)
+            size += len(line)
+        with open(os.path.join(directory, 'file{:05d}.rb'.format(i)), 'w') as f:
+            f.write(''.join(lines))
+
+    if vendor:
+        with open(os.path.join(root, 'recipe', 'Berksfile'), 'w') as f:
+            f.write('source "https://supermarket.getchef.com"\n\n')
+            f.write("cookbook 'cookbook000', path: './cookbook000'\n")
+            for i in range(vendor):
+                f.write("cookbook 'dependency{:03d}'\n".format(i))
+        with open(os.path.join(root, 'recipe', 'cookbook000', 'metadata.rb'), 'w') as f:
+            f.write("name 'cookbook000'\n")
+            for i in range(vendor):
+                f.write("depends 'dependency{:03d}'\n".format(i))
+
+
+def peak_rss_kb():
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux kilobytes
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def use_stand_ins_for_stackility(clients):
+    """
+    stackility makes its own boto3 session; point it at the stand-ins.
+    """
+    from stackility import CloudStackUtility
+
+    def init_clients(self):
+        self._s3 = clients['s3']
+        self._cloudFormation = clients['cloudformation']
+        self._ssm = clients['ssm']
+        return True
+
+    CloudStackUtility._init_boto3_clients = init_clients
+
+
+def run_worker(project, work_directory, stages, latency, result_file, vendor=False, pipeline=PIPELINES[0]):
+    """
+    One benchmark run, in this interpreter: register the stand-ins and
+    deploy the project once per scenario.
+    """
+    import logging
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, PROJECT_ROOT)
+    from stand_ins import S3StandIn, CloudFormationStandIn, SSMStandIn
+    from opsworkstool import utility
+    from opsworkstool import stack_poller
+    from opsworkstool.opsworks_deployer import OpsworksDeployer
+
+    logging.getLogger().setLevel(logging.WARNING)
+    stack_poller.MINIMUM_DELAY = 0.0
+
+    s3 = S3StandIn(region_name=REGION, latency=latency)
+    clients = {
+        's3': s3,
+        'cloudformation': CloudFormationStandIn(s3=s3, region_name=REGION, latency=latency),
+        'ssm': SSMStandIn(region_name=REGION, latency=latency)
+    }
+    for service, client in clients.items():
+        utility.register_client(None, REGION, service, client)
+    use_stand_ins_for_stackility(clients)
+
+    results = []
+    for scenario in SCENARIOS:
+        profile_file = os.path.join(work_directory, '{}-profile.json'.format(scenario))
+        config_block = {
+            'work_directory': work_directory,
+            'profile': None,
+            'region': REGION,
+            'template_directory': os.path.join(PROJECT_ROOT, 'opsworkstool', 'template'),
+            'debug': False,
+            'stage': stages[0],
+            'stages': stages,
+            'cwd': project,
+            'content_digest': pipeline == 'change-set',
+            'change_set': pipeline == 'change-set',
+            'vendor_cookbooks': vendor,
+            'profile_output': profile_file
+        }
+        before = dict((s, dict(c.calls)) for s, c in clients.items())
+        wall = time.time()
+        cpu = time.process_time()
+        deployed = OpsworksDeployer(config_block).deploy_opsworks()
+        cpu = time.process_time() - cpu
+        wall = time.time() - wall
+
+        api_calls = {}
+        for service, client in clients.items():
+            for operation, count in client.calls.items():
+                made = count - before[service].get(operation, 0)
+                if made:
+                    api_calls['{}.{}'.format(service, operation)] = made
+
+        with open(profile_file, 'r') as f:
+            profile = json.load(f)
+
+        results.append({
+            'scenario': scenario,
+            'deployed': bool(deployed),
+            'wall_seconds': round(wall, 4),
+            'cpu_seconds': round(cpu, 4),
+            'api_calls': api_calls,
+            'steps': profile['steps']
+        })
+
+    with open(result_file, 'w') as f:
+        json.dump({'peak_rss_kb': peak_rss_kb(), 'scenarios': results}, f)
+
+
+def run_once(args, project):
+    work_directory = tempfile.mkdtemp(prefix='opsworkstool-bench-work-')
+    result_file = os.path.join(work_directory, 'result.json')
+    for sidecar in ('.opsworkstool-state.json', '.opsworkstool-index.json', 'recipe/Berksfile.lock'):
+        if os.path.exists(os.path.join(project, sidecar)):
+            os.remove(os.path.join(project, sidecar))
+    shutil.rmtree(vendor_cache(project), ignore_errors=True)
+
+    try:
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            '--worker', project,
+            '--work-directory', work_directory,
+            '--stages', args.stages,
+            '--latency', str(args.latency),
+            '--result-file', result_file
+        ]
+        if args.vendor:
+            command.append('--vendor-cookbooks')
+        command.extend(['--pipeline', args.pipeline])
+        output = None if args.verbose else subprocess.DEVNULL
+        subprocess.check_call(command, stdout=output, stderr=output)
+        with open(result_file, 'r') as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def summarize(runs):
+    summary = {}
+    for scenario in SCENARIOS:
+        rows = [s for run in runs for s in run['scenarios'] if s['scenario'] == scenario]
+        summary[scenario] = {
+            'deployed': all(r['deployed'] for r in rows),
+            'median_wall_seconds': median([r['wall_seconds'] for r in rows]),
+            'median_cpu_seconds': median([r['cpu_seconds'] for r in rows]),
+            'api_calls': rows[-1]['api_calls']
+        }
+    summary['median_peak_rss_kb'] = median([run['peak_rss_kb'] for run in runs])
+    return summary
+
+
+def compare(summary, baseline_file, tolerance, pipeline):
+    """
+    Returns:
+        the list of regressions against the baseline result
+    """
+    with open(baseline_file, 'r') as f:
+        result = json.load(f)
+    baseline = result['summary']
+    baseline_pipeline = result.get('parameters', {}).get('pipeline', PIPELINES[0])
+    if baseline_pipeline != pipeline:
+        print('\nwarning: {} measured the {} pipeline, this run {}'.format(baseline_file, baseline_pipeline, pipeline))
+
+    regressions = []
+    print('\ncompared with {}:'.format(baseline_file))
+    for scenario in SCENARIOS:
+        for metric in ('median_wall_seconds', 'median_cpu_seconds'):
+            old = baseline.get(scenario, {}).get(metric, None)
+            new = summary[scenario][metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            print('\t{:<10}{:<22}{:>9.4f} -> {:>9.4f} ({:+.1%})'.format(scenario, metric, old, new, change))
+            if change > tolerance:
+                regressions.append('{} {}'.format(scenario, metric))
+
+        old_calls = sum(baseline.get(scenario, {}).get('api_calls', {}).values())
+        new_calls = sum(summary[scenario]['api_calls'].values())
+        print('\t{:<10}{:<22}{:>9} -> {:>9}'.format(scenario, 'api_calls', old_calls, new_calls))
+        if new_calls > old_calls:
+            regressions.append('{} api_calls'.format(scenario))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=2000, help='files in the cookbook tree')
+    parser.add_argument('--file-size', type=int, default=4, help='KB per file')
+    parser.add_argument('--cookbooks', type=int, default=20)
+    parser.add_argument('--stages', default='dev,qa')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds added to every stand-in API call')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the result JSON here')
+    parser.add_argument('--compare', help='an earlier result JSON to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='allowed slow down against --compare, 0.10 is 10%%')
+    parser.add_argument('--vendor', type=int, default=0,
+                        help='cookbooks vendored by the fake_berks.py stand-in, 0 for none')
+    parser.add_argument('--pipeline', choices=PIPELINES, default=PIPELINES[0],
+                        help='deploy path measured, see the top of this file')
+    parser.add_argument('--verbose', action='store_true', help='show the deploy output')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--work-directory', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    parser.add_argument('--vendor-cookbooks', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    if args.worker:
+        run_worker(args.worker, args.work_directory, stages, args.latency, args.result_file,
+                   args.vendor_cookbooks, args.pipeline)
+        return 0
+
+    scratch = tempfile.mkdtemp(prefix='opsworkstool-bench-')
+    try:
+        project = os.path.join(scratch, 'benchmark')
+        started = time.time()
+        make_project(project, args.files, args.file_size, args.cookbooks, stages, args.seed, args.vendor)
+        print('generated {} files of {} KB in {:.2f}s'.format(args.files, args.file_size, time.time() - started))
+
+        runs = []
+        for i in range(args.runs):
+            runs.append(run_once(args, project))
+            print('run {}: {}'.format(i + 1, ', '.join(
+                '{} {:.3f}s'.format(s['scenario'], s['wall_seconds']) for s in runs[-1]['scenarios']
+            )))
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    sys.path.insert(0, PROJECT_ROOT)
+    import opsworkstool
+    result = {
+        'opsworkstool': opsworkstool.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'parameters': {
+            'files': args.files,
+            'file_size_kb': args.file_size,
+            'cookbooks': args.cookbooks,
+            'stages': stages,
+            'runs': args.runs,
+            'latency': args.latency,
+            'vendor': args.vendor,
+            'pipeline': args.pipeline
+        },
+        'summary': summarize(runs),
+        'runs': runs
+    }
+    print(json.dumps(result['summary'], indent=2))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    failed = False
+    for scenario in SCENARIOS:
+        if not result['summary'][scenario]['deployed']:
+            print('{} deploy failed'.format(scenario))
+            failed = True
+
+    if args.compare:
+        regressions = compare(result['summary'], args.compare, args.tolerance, args.pipeline)
+        if regressions:
+            print('regressions: {}'.format(', '.join(regressions)))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+"""
+Stand-in for `berks vendor` so --vendor can be exercised without Berkshelf
+or a network.
+
+Every cookbook named in the Berksfile without a path: is "resolved" into the
+target directory as a small cookbook, and a Berksfile.lock is written the
+first time round, as berks does. Plug it in through config.ini:
+
+    [vendor]
+    command=python benchmarks/fake_berks.py {target}
+
+Usage:
+    python benchmarks/fake_berks.py TARGET [--files 20] [--delay 0.0]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+
+COOKBOOK = re.compile(r'''^\s*cookbook\s+['"]([^'"]+)['"](.*)$''', re.MULTILINE)
+
+
+def remote_cookbooks(berksfile):
+    return sorted(
+        name for name, rest in COOKBOOK.findall(berksfile)
+        if 'path:' not in rest and ':path' not in rest
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('target', help='directory to vendor into')
+    parser.add_argument('--files', type=int, default=20, help='recipe files per cookbook')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='seconds spent "resolving", standing in for the network')
+    args = parser.parse_args()
+
+    with open('Berksfile', 'r') as f:
+        cookbooks = remote_cookbooks(f.read())
+
+    if args.delay:
+        time.sleep(args.delay)
+
+    for cookbook in cookbooks:
+        recipes = os.path.join(args.target, cookbook, 'recipes')
+        os.makedirs(recipes)
+        with open(os.path.join(args.target, cookbook, 'metadata.rb'), 'w') as f:
+            f.write("name '{}'\nversion '1.0.0'\n".format(cookbook))
+        for i in range(args.files):
+            with open(os.path.join(recipes, 'recipe{:03d}.rb'.format(i)), 'w') as f:
+                f.write("# vendored {} recipe {}\nlog 'recipe {}'\n".format(cookbook, i, i))
+
+    if not os.path.exists('Berksfile.lock'):
+        with open('Berksfile.lock', 'w') as f:
+            f.write('DEPENDENCIES\n')
+            for cookbook in cookbooks:
+                f.write('  {}\n'.format(cookbook))
+            f.write('\nGRAPH\n')
+            for cookbook in cookbooks:
+                f.write('  {} (1.0.0)\n'.format(cookbook))
+
+    print('vendored {} cookbook(s) into {}'.format(len(cookbooks), args.target))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
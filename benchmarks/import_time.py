@@ -0,0 +1,92 @@
+"""
+Import time guard for the opsworkstool CLI.
+
+Starts fresh interpreters that import the CLI and print --help/--version and
+fails when that pulls in any of the heavy dependencies or takes longer than
+the allowed budget.
+
+Usage:
+    python benchmarks/import_time.py [--runs 5] [--budget 0.5]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ('boto3', 'botocore', 'git', 'pip', 'stackility', 'mako')
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK_MODULES = '''
+import sys
+import opsworkstool
+import opsworkstool.command
+print(",".join(m for m in {} if m in sys.modules))
+'''.format(repr(HEAVY_MODULES))
+
+RUN_CLI = '''
+import sys
+from opsworkstool.command import cli
+sys.argv = ["opsworkstool", "{}"]
+try:
+    cli()
+except SystemExit:
+    pass
+'''
+
+
+def run_python(code):
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        p for p in (PROJECT_ROOT, env.get('PYTHONPATH', '')) if p
+    )
+    started = time.time()
+    output = subprocess.check_output(
+        [sys.executable, '-c', code],
+        env=env,
+        stderr=subprocess.STDOUT
+    )
+    return time.time() - started, output.decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=0.5,
+                        help='seconds allowed for the median cold start')
+    args = parser.parse_args()
+
+    loaded = run_python(CHECK_MODULES)[1]
+    loaded = [m for m in loaded.strip().split(',') if m]
+
+    report = {'heavy_modules_loaded': loaded}
+    for flag in ('--help', '--version'):
+        timings = sorted(run_python(RUN_CLI.format(flag))[0] for _ in range(args.runs))
+        report[flag] = {
+            'median_seconds': timings[len(timings) // 2],
+            'min_seconds': timings[0],
+            'max_seconds': timings[-1]
+        }
+
+    print(json.dumps(report, indent=2))
+
+    failed = False
+    if loaded:
+        print('heavy modules imported by the CLI: {}'.format(', '.join(loaded)))
+        failed = True
+
+    for flag in ('--help', '--version'):
+        if report[flag]['median_seconds'] > args.budget:
+            print('{} took {:.3f}s, budget is {:.3f}s'.format(
+                flag,
+                report[flag]['median_seconds'],
+                args.budget
+            ))
+            failed = True
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
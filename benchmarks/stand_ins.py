@@ -0,0 +1,344 @@
+"""
+In-memory stand-ins for the S3, CloudFormation and SSM clients.
+
+They answer the calls opsworkstool makes with the same response shapes as
+boto3, keep a count of every call, and fire a botocore style before-call
+event so the deploy profiler can charge each call to the step making it.
+Register them with opsworkstool.utility.register_client() before the
+deployer asks for its clients.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+
+from botocore.exceptions import ClientError
+
+
+def client_error(operation, code, message):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class _ServiceModel(object):
+    def __init__(self, service_name):
+        self.service_name = service_name
+
+
+class _OperationModel(object):
+    def __init__(self, service_name, name):
+        self.name = name
+        self.service_model = _ServiceModel(service_name)
+
+
+class _Events(object):
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, event_name, handler, unique_id=None):
+        self._handlers[unique_id or id(handler)] = handler
+
+    def emit(self, service_name, operation):
+        for handler in list(self._handlers.values()):
+            handler(model=_OperationModel(service_name, operation))
+
+
+class _Meta(object):
+    def __init__(self, region_name):
+        self.events = _Events()
+        self.region_name = region_name
+
+
+class StandIn(object):
+    """
+    Base for the stand-ins: call counting, events and a fixed latency that
+    can be added to every call to play the part of the network.
+    """
+    service_name = None
+
+    def __init__(self, region_name='us-east-1', latency=0.0):
+        self.meta = _Meta(region_name)
+        self.calls = Counter()
+        self._latency = latency
+        self._lock = threading.RLock()
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls[operation] += 1
+        self.meta.events.emit(self.service_name, operation)
+        if self._latency:
+            time.sleep(self._latency)
+
+
+class S3StandIn(StandIn):
+    service_name = 's3'
+
+    def __init__(self, **kwargs):
+        StandIn.__init__(self, **kwargs)
+        self.objects = {}
+        self._uploads = {}
+
+    def head_object(self, Bucket, Key):
+        self._call('HeadObject')
+        if (Bucket, Key) not in self.objects:
+            raise client_error('HeadObject', '404', 'Not Found')
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def put_object(self, Bucket, Key, Body):
+        self._call('PutObject')
+        data = Body.read() if hasattr(Body, 'read') else Body
+        self.objects[(Bucket, Key)] = data
+        return {'ETag': '"{}"'.format(uuid.uuid4().hex)}
+
+    def upload_file(self, Filename, Bucket, Key):
+        self._call('PutObject')
+        with open(Filename, 'rb') as f:
+            self.objects[(Bucket, Key)] = f.read()
+
+    def object_at(self, url):
+        """
+        The body of an object given as https://s3.amazonaws.com/bucket/key
+        or https://bucket.s3.amazonaws.com/key
+        """
+        host, path = url.split('://', 1)[1].split('/', 1)
+        if host == 's3.amazonaws.com':
+            bucket, key = path.split('/', 1)
+        else:
+            bucket, key = host.split('.s3.', 1)[0], path
+        return self.objects[(bucket, key)]
+
+    def create_multipart_upload(self, Bucket, Key):
+        self._call('CreateMultipartUpload')
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self._call('UploadPart')
+        etag = '"{}"'.format(uuid.uuid4().hex)
+        with self._lock:
+            self._uploads[UploadId][PartNumber] = (etag, Body)
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self._call('CompleteMultipartUpload')
+        parts = self._uploads.pop(UploadId)
+        self.objects[(Bucket, Key)] = b''.join(
+            parts[part['PartNumber']][1] for part in MultipartUpload['Parts']
+        )
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self._call('AbortMultipartUpload')
+        self._uploads.pop(UploadId, None)
+        return {}
+
+
+class CloudFormationStandIn(StandIn):
+    """
+    Stacks are created and updated directly or through change sets and
+    finish the moment the operation is started. Templates given by URL are
+    read from the S3 stand-in passed as s3.
+    """
+    service_name = 'cloudformation'
+
+    def __init__(self, s3=None, **kwargs):
+        StandIn.__init__(self, **kwargs)
+        self.stacks = {}
+        self._change_sets = {}
+        self._s3 = s3
+
+    def _template(self, kwargs):
+        if kwargs.get('TemplateURL'):
+            return json.loads(self._s3.object_at(kwargs['TemplateURL']).decode('utf-8'))
+        return json.loads(kwargs.get('TemplateBody') or '{}')
+
+    def create_stack(self, StackName, **kwargs):
+        self._call('CreateStack')
+        if StackName in self.stacks:
+            raise client_error('CreateStack', 'AlreadyExistsException', 'Stack [{}] already exists'.format(StackName))
+        self.stacks[StackName] = {'status': 'CREATE_IN_PROGRESS', 'tags': {}, 'template': {}, 'parameters': {}, 'events': []}
+        self._apply(StackName, 'CREATE', kwargs)
+        return {'StackId': StackName}
+
+    def update_stack(self, StackName, **kwargs):
+        self._call('UpdateStack')
+        stack = self._stack('UpdateStack', StackName)
+        template = self._template(kwargs)
+        parameters = dict((p['ParameterKey'], p['ParameterValue']) for p in kwargs.get('Parameters', []))
+        if not self._changes(stack, template, parameters):
+            raise client_error('UpdateStack', 'ValidationError', 'No updates are to be performed.')
+        self._apply(StackName, 'UPDATE', kwargs)
+        return {'StackId': StackName}
+
+    def _apply(self, stack_name, verb, kwargs):
+        template = self._template(kwargs)
+        parameters = dict((p['ParameterKey'], p['ParameterValue']) for p in kwargs.get('Parameters', []))
+        stack = self.stacks[stack_name]
+        changes = self._changes(stack, template, parameters)
+        stack['template'] = template
+        stack['parameters'] = parameters
+        stack['tags'] = dict((t['Key'], t['Value']) for t in kwargs.get('Tags', []))
+        stack['status'] = '{}_COMPLETE'.format(verb)
+        self._add_events(stack_name, stack, changes, verb)
+
+    def _stack(self, operation, name):
+        stack = self.stacks.get(name, None)
+        if stack is None:
+            raise client_error(operation, 'ValidationError', 'Stack with id {} does not exist'.format(name))
+        return stack
+
+    def describe_stacks(self, StackName):
+        self._call('DescribeStacks')
+        stack = self._stack('DescribeStacks', StackName)
+        return {'Stacks': [{
+            'StackName': StackName,
+            'StackStatus': stack['status'],
+            'Tags': [{'Key': k, 'Value': v} for k, v in sorted(stack['tags'].items())]
+        }]}
+
+    def delete_stack(self, StackName):
+        self._call('DeleteStack')
+        self.stacks.pop(StackName, None)
+        return {}
+
+    def describe_stack_events(self, StackName, NextToken=None):
+        self._call('DescribeStackEvents')
+        stack = self._stack('DescribeStackEvents', StackName)
+        return {'StackEvents': list(stack['events'])}
+
+    def describe_stack_resources(self, StackName):
+        self._call('DescribeStackResources')
+        stack = self._stack('DescribeStackResources', StackName)
+        return {'StackResources': [
+            {
+                'LogicalResourceId': name,
+                'PhysicalResourceId': '{}-{}'.format(StackName, name),
+                'ResourceType': resource['Type'],
+                'ResourceStatus': 'CREATE_COMPLETE'
+            }
+            for name, resource in sorted(stack['template'].get('Resources', {}).items())
+        ]}
+
+    def create_change_set(self, StackName, ChangeSetName, ChangeSetType, **kwargs):
+        self._call('CreateChangeSet')
+        if ChangeSetType == 'CREATE':
+            self.stacks.setdefault(StackName, {
+                'status': 'REVIEW_IN_PROGRESS',
+                'tags': {},
+                'template': {},
+                'parameters': {},
+                'events': []
+            })
+        stack = self._stack('CreateChangeSet', StackName)
+
+        template = self._template(kwargs)
+        parameters = dict((p['ParameterKey'], p['ParameterValue']) for p in kwargs.get('Parameters', []))
+        change_set_id = 'arn:aws:cloudformation:{}:123456789012:changeSet/{}/{}'.format(
+            self.meta.region_name,
+            ChangeSetName,
+            uuid.uuid4()
+        )
+        self._change_sets[change_set_id] = {
+            'stack_name': StackName,
+            'type': ChangeSetType,
+            'template': template,
+            'parameters': parameters,
+            'tags': dict((t['Key'], t['Value']) for t in kwargs.get('Tags', [])),
+            'changes': self._changes(stack, template, parameters)
+        }
+        return {'Id': change_set_id, 'StackId': StackName}
+
+    def _changes(self, stack, template, parameters):
+        old = stack['template'].get('Resources', {})
+        new = template.get('Resources', {})
+        parameters_changed = parameters != stack['parameters']
+        changes = []
+        for name in sorted(set(old) | set(new)):
+            if name not in old:
+                action = 'Add'
+            elif name not in new:
+                action = 'Remove'
+            elif old[name] != new[name] or parameters_changed:
+                action = 'Modify'
+            else:
+                continue
+
+            changes.append({'Type': 'Resource', 'ResourceChange': {
+                'Action': action,
+                'LogicalResourceId': name,
+                'ResourceType': (new.get(name) or old.get(name))['Type'],
+                'Replacement': 'False' if action == 'Modify' else None
+            }})
+        return changes
+
+    def describe_change_set(self, ChangeSetName, NextToken=None):
+        self._call('DescribeChangeSet')
+        change_set = self._change_sets[ChangeSetName]
+        if not change_set['changes']:
+            return {
+                'Status': 'FAILED',
+                'StatusReason': "The submitted information didn't contain changes. "
+                                "Submit different information to create a change set."
+            }
+        return {'Status': 'CREATE_COMPLETE', 'Changes': change_set['changes']}
+
+    def delete_change_set(self, ChangeSetName):
+        self._call('DeleteChangeSet')
+        self._change_sets.pop(ChangeSetName, None)
+        return {}
+
+    def execute_change_set(self, ChangeSetName):
+        self._call('ExecuteChangeSet')
+        change_set = self._change_sets.pop(ChangeSetName)
+        stack = self.stacks[change_set['stack_name']]
+        verb = 'CREATE' if change_set['type'] == 'CREATE' else 'UPDATE'
+        stack['template'] = change_set['template']
+        stack['parameters'] = change_set['parameters']
+        stack['tags'] = change_set['tags']
+        stack['status'] = '{}_COMPLETE'.format(verb)
+        self._add_events(change_set['stack_name'], stack, change_set['changes'], verb)
+        return {}
+
+    def _add_events(self, stack_name, stack, changes, verb):
+        events = []
+        for change in changes:
+            resource = change['ResourceChange']
+            events.append(self._event(stack_name, resource['LogicalResourceId'],
+                                      resource['ResourceType'], '{}_COMPLETE'.format(verb)))
+        events.append(self._event(stack_name, stack_name, 'AWS::CloudFormation::Stack', stack['status']))
+        events.reverse()
+        stack['events'] = events + stack['events']
+
+    def _event(self, stack_name, logical_id, resource_type, status):
+        return {
+            'EventId': uuid.uuid4().hex,
+            'StackName': stack_name,
+            'LogicalResourceId': logical_id,
+            'PhysicalResourceId': '{}-{}'.format(stack_name, logical_id),
+            'ResourceType': resource_type,
+            'ResourceStatus': status,
+            'Timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        }
+
+
+class SSMStandIn(StandIn):
+    service_name = 'ssm'
+
+    def __init__(self, parameters=None, **kwargs):
+        StandIn.__init__(self, **kwargs)
+        self.parameters = dict(parameters or {})
+
+    def get_parameter(self, Name, WithDecryption=False):
+        self._call('GetParameter')
+        if Name not in self.parameters:
+            raise client_error('GetParameter', 'ParameterNotFound', Name)
+        return {'Parameter': {'Name': Name, 'Value': self.parameters[Name], 'Version': 1}}
+
+    def get_parameters(self, Names, WithDecryption=False):
+        self._call('GetParameters')
+        return {
+            'Parameters': [{'Name': n, 'Value': self.parameters[n]} for n in Names if n in self.parameters],
+            'InvalidParameters': [n for n in Names if n not in self.parameters]
+        }
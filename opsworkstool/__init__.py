@@ -1,6 +1,14 @@
-from opsworkstool.opsworks_creator import OpsworksCreator #noqa
-from opsworkstool.opsworks_deployer import OpsworksDeployer #noqa
 from datetime import datetime
+import importlib
+
+# The public classes pull in boto3, GitPython, stackility and friends. They
+# are resolved on first access so the CLI can print --help without them.
+_LAZY_ATTRIBUTES = {
+    'OpsworksCreator': 'opsworkstool.opsworks_creator',
+    'OpsworksDeployer': 'opsworkstool.opsworks_deployer'
+}
+
+__all__ = ['OpsworksCreator', 'OpsworksDeployer']
 
 __title__ = 'opsworkstool'
 __version__ = '0.0.2'
@@ -41,3 +49,13 @@ finibus turpis, id consequat quam pellentesque volutpat. Aenean diam ex,
 tincidunt et lorem non, bibendum consequat nunc.
 '''
 
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name, None)
+    if module_name is None:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,125 @@
+"""
+An asyncio layer over the blocking boto3 clients.
+
+Every AWS call made through here runs on one process wide pool of threads,
+so the size of that pool is a global limit on the number of AWS calls in
+flight no matter how many event loops, stages or projects are going at
+once. Coroutines await the calls, which lets the lookups of discovery, SSM
+parameters, stack polling and the parts of a multipart upload overlap.
+
+The layer is used per operation, not for the deploy as a whole: each of
+those operations is entered from blocking code through run(), which gives it
+a short lived event loop of its own. Stages and fleet projects still run on
+their own threads, and AWS calls made outside this module, e.g. stackility's
+or a change set's, are not limited by the pool.
+
+Do not call run() from code that is itself running on the pool; it would
+wait on the pool from inside the pool.
+"""
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from opsworkstool import profiler
+
+DEFAULT_CONCURRENCY = 16
+
+_executor = None
+_concurrency = DEFAULT_CONCURRENCY
+_executor_lock = threading.Lock()
+
+
+def configure(concurrency):
+    """
+    Set the global limit on AWS calls in flight.
+
+    Args:
+        concurrency - threads in the shared pool
+    """
+    global _concurrency, _executor
+    with _executor_lock:
+        _concurrency = max(1, int(concurrency))
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_concurrency,
+                thread_name_prefix='aws'
+            )
+        return _executor
+
+
+async def call(function, *args, **kwargs):
+    """
+    Run a blocking function on the shared pool and wait for it. The
+    calls are charged to the deploy profiler step that awaits them.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(),
+        profiler.bind(functools.partial(function, *args, **kwargs))
+    )
+
+
+def run(coroutine):
+    """
+    Run a coroutine to completion from blocking code, in a fresh event loop.
+    """
+    return asyncio.run(coroutine)
+
+
+class AsyncClient(object):
+    """
+    Awaitable version of a boto3 client: client.describe_stacks(...) becomes
+    await AsyncClient(client).describe_stacks(...). Attributes that are not
+    methods are handed back as they are.
+    """
+    def __init__(self, client):
+        """
+        AsyncClient init method.
+
+        Args:
+            client - a boto3 client, or anything that looks like one
+
+        Returns:
+           not a damn thing
+        """
+        self.client = client
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def method(*args, **kwargs):
+            return await call(attribute, *args, **kwargs)
+
+        return method
+
+    async def paginate(self, operation, result_key, **kwargs):
+        """
+        Page through an operation on the pool.
+
+        Args:
+            operation - e.g. 'list_roles'
+            result_key - the list to collect from every page, e.g. 'Roles'
+            kwargs - arguments to the operation
+
+        Returns:
+            the items of every page
+        """
+        def collect():
+            items = []
+            for page in self.client.get_paginator(operation).paginate(**kwargs):
+                items.extend(page.get(result_key, []))
+            return items
+
+        return await call(collect)
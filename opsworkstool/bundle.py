@@ -0,0 +1,345 @@
+import binascii
+import logging
+import os
+import stat
+import sys
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from opsworkstool import profiler
+
+try:
+    import zlib
+    compression = zipfile.ZIP_DEFLATED
+except:
+    zlib = None
+    compression = zipfile.ZIP_STORED
+
+ZIP_MODES = {
+    zipfile.ZIP_DEFLATED: 'deflated',
+    zipfile.ZIP_STORED:   'stored'
+}
+
+BUNDLE_SECTION = 'bundle'
+COPY_BLOCK_SIZE = 1024 * 1024
+REPRODUCIBLE_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+STORED_EXTENSIONS = (
+    '.gz', '.tgz', '.tar', '.bz2', '.xz', '.zip', '.jar', '.war', '.whl',
+    '.png', '.jpg', '.jpeg', '.gif', '.ico', '.webp'
+)
+DEFAULT_WORKERS = os.cpu_count() or 1
+# members bigger than this are streamed in order rather than held in memory
+LARGE_MEMBER_SIZE = 64 * 1024 * 1024
+# the most member bytes the parallel build holds in memory at once
+MAX_IN_FLIGHT_BYTES = 256 * 1024 * 1024
+# _write_compressed() drives ZipFile internals that are the same on these
+# Python versions; anywhere else the bundle is built serially
+PRECOMPRESSED_PYTHON_VERSIONS = ((3, 6), (3, 13))
+PRECOMPRESSED_ZIPFILE_ATTRIBUTES = ('fp', 'start_dir', '_writecheck', '_didModify', 'filelist', 'NameToInfo')
+
+
+def precompressed_writes_supported(zf):
+    """
+    Whether members compressed off the main thread can be written straight
+    into zf.
+    """
+    low, high = PRECOMPRESSED_PYTHON_VERSIONS
+    if not low <= sys.version_info[:2] <= high:
+        return False
+
+    return all(hasattr(zf, name) for name in PRECOMPRESSED_ZIPFILE_ATTRIBUTES)
+
+
+def read_bundle_settings(ini_data, overrides=None):
+    """
+    Build the bundle settings from the [bundle] section of config.ini and any
+    command line overrides.
+
+    Args:
+        ini_data - the dictionary made from config/config.ini
+        overrides - dictionary of command line values, None means not given
+
+    Returns:
+        a dictionary suitable for BundleBuilder(**settings)
+    """
+    section = (ini_data or {}).get(BUNDLE_SECTION, {})
+    overrides = overrides or {}
+
+    def pick(name):
+        value = overrides.get(name, None)
+        if value is None:
+            value = section.get(name, None)
+        if value == '':
+            return None
+        return value
+
+    settings = {}
+
+    reproducible = pick('reproducible')
+    if isinstance(reproducible, bool):
+        settings['reproducible'] = reproducible
+    elif reproducible is not None:
+        settings['reproducible'] = reproducible.lower() in ('true', 'yes', '1', 'on')
+
+    compression_level = pick('compression_level')
+    if compression_level is not None:
+        settings['compression_level'] = int(compression_level)
+
+    workers = pick('workers')
+    if workers is not None:
+        settings['workers'] = max(1, int(workers))
+
+    stored_extensions = pick('stored_extensions')
+    if stored_extensions is not None:
+        settings['stored_extensions'] = tuple(
+            ext.strip().lower() for ext in stored_extensions.split(',') if ext.strip()
+        )
+
+    return settings
+
+
+class BundleBuilder(object):
+    """
+    Build the recipe bundle by streaming files straight from the source tree
+    into the archive. Nothing is copied to a scratch directory first and the
+    current working directory is left alone.
+
+    In reproducible mode entries are sorted and timestamps and permissions
+    are normalized so the same input always produces the same bytes.
+
+    With more than one worker the members are compressed on a pool of
+    threads (zlib drops the GIL while it works) and written into the
+    archive in the same order, and with the same bytes, as the serial build.
+    """
+    _compression = compression
+    _compression_level = None
+    _reproducible = False
+    _stored_extensions = STORED_EXTENSIONS
+    _workers = DEFAULT_WORKERS
+
+    def __init__(self, **kwargs):
+        """
+        BundleBuilder init method.
+
+        Args:
+            compression - zipfile compression type, defaults to deflated
+                          when zlib is around
+            compression_level - zlib level 0-9, None for the zlib default
+            reproducible - sort entries and normalize timestamps/permissions
+            stored_extensions - file extensions written without compression
+            workers - members compressed at once, defaults to the CPU count
+
+        Returns:
+           not a damn thing
+        """
+        self._compression = kwargs.get('compression', compression)
+        self._compression_level = kwargs.get('compression_level', None)
+        self._reproducible = kwargs.get('reproducible', False)
+        self._stored_extensions = tuple(kwargs.get('stored_extensions', STORED_EXTENSIONS))
+        self._workers = kwargs.get('workers', DEFAULT_WORKERS)
+        self.file_count = 0
+        self.bytes_read = 0
+
+    def find_files(self, source_dir):
+        """
+        Find everything under source_dir that belongs in the bundle.
+
+        Args:
+            source_dir - root of the tree to bundle
+
+        Returns:
+            a list of (path on disk, name in the archive) tuples
+        """
+        tree = []
+        for folder, subs, files in os.walk(source_dir):
+            for file_name in files:
+                path = os.path.join(folder, file_name)
+                arcname = os.path.relpath(path, source_dir).replace(os.sep, '/')
+                tree.append((path, arcname))
+
+        return tree
+
+    def build(self, source_dir, package_name, files=None):
+        """
+        Write the files under source_dir into package_name.
+
+        Args:
+            source_dir - root of the tree to bundle
+            package_name - the zip file to create
+            files - (path, arcname) tuples already found, e.g. from a
+                    FileIndex, None to walk source_dir
+
+        Returns:
+            the number of files written
+        """
+        logging.info('adding files with compression mode={} level={} reproducible={} workers={}'.format(
+            ZIP_MODES[self._compression],
+            self._compression_level,
+            self._reproducible,
+            self._workers
+        ))
+        self.file_count = 0
+        self.bytes_read = 0
+
+        if files is None:
+            files = self.find_files(source_dir)
+        else:
+            files = list(files)
+        if self._reproducible:
+            files.sort(key=lambda f: f[1])
+
+        with zipfile.ZipFile(package_name, mode='w') as zf:
+            parallel = self._workers > 1 and len(files) > 1
+            if parallel and not precompressed_writes_supported(zf):
+                logging.info('parallel bundling is not supported on this Python, building serially')
+                parallel = False
+
+            if parallel:
+                self._build_parallel(zf, files)
+            else:
+                for path, arcname in files:
+                    self._write_member(zf, path, arcname)
+
+        return self.file_count
+
+    def _write_member(self, zf, path, arcname):
+        compress_type = self.compression_for(arcname)
+        if self._reproducible:
+            self._write_normalized(zf, path, arcname, compress_type)
+        else:
+            zf.write(
+                path,
+                arcname,
+                compress_type=compress_type,
+                compresslevel=self._compression_level
+            )
+        self.file_count += 1
+        self.bytes_read += os.path.getsize(path)
+
+    def _build_parallel(self, zf, files):
+        # a bounded window of members is in flight so memory stays flat no
+        # matter how slow the first member in the queue is; it is bounded by
+        # count and by the bytes held, but always lets one member through
+        window = self._workers * 4
+        pending = deque()
+        in_flight = 0
+        remaining = iter(files)
+        item = next(remaining, None)
+        compress = profiler.bind(self._compress_member)
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            while True:
+                while item is not None and len(pending) < window:
+                    held = self._held_bytes(item[0])
+                    if pending and in_flight + held > MAX_IN_FLIGHT_BYTES:
+                        break
+                    pending.append((item, held, pool.submit(compress, *item)))
+                    in_flight += held
+                    item = next(remaining, None)
+
+                if not pending:
+                    break
+
+                (path, arcname), held, future = pending.popleft()
+                in_flight -= held
+                zinfo, data = future.result()
+                if data is None:
+                    self._write_member(zf, path, arcname)
+                else:
+                    self._write_compressed(zf, zinfo, data)
+                    self.file_count += 1
+                    self.bytes_read += zinfo.file_size
+
+    def _held_bytes(self, path):
+        # what _compress_member() keeps in memory for the member; large
+        # members are streamed when their turn comes and hold nothing
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return 0
+        return size if size <= LARGE_MEMBER_SIZE else 0
+
+    def _zip_info(self, path, arcname, compress_type):
+        if self._reproducible:
+            zinfo = zipfile.ZipInfo(arcname, date_time=REPRODUCIBLE_DATE_TIME)
+            zinfo.create_system = 3
+            info = os.stat(path)
+            zinfo.file_size = info.st_size
+            if info.st_mode & stat.S_IXUSR:
+                zinfo.external_attr = (stat.S_IFREG | 0o755) << 16
+            else:
+                zinfo.external_attr = (stat.S_IFREG | 0o644) << 16
+        else:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+
+        zinfo.compress_type = compress_type
+        zinfo._compresslevel = self._compression_level
+        return zinfo
+
+    def _compress_member(self, path, arcname):
+        """
+        Read and compress one member off the main thread.
+
+        Returns:
+            (ZipInfo, compressed bytes), the bytes are None for a member too
+            big to hold in memory
+        """
+        compress_type = self.compression_for(arcname)
+        zinfo = self._zip_info(path, arcname, compress_type)
+        if zinfo.file_size > LARGE_MEMBER_SIZE:
+            return zinfo, None
+
+        with open(path, 'rb') as src:
+            raw = src.read()
+
+        zinfo.file_size = len(raw)
+        zinfo.CRC = binascii.crc32(raw) & 0xffffffff
+        if compress_type == zipfile.ZIP_DEFLATED:
+            level = self._compression_level
+            compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                zlib.DEFLATED,
+                -15
+            )
+            data = compressor.compress(raw) + compressor.flush()
+        else:
+            data = raw
+
+        zinfo.compress_size = len(data)
+        return zinfo, data
+
+    def _write_compressed(self, zf, zinfo, data):
+        # the same steps ZipFile.open(zinfo, 'w') goes through, with the
+        # sizes and CRC already known so the header is written once
+        zinfo.flag_bits = 0x00
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        zf.fp.seek(zf.start_dir)
+        zinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zinfo)
+        zf._didModify = True
+        zf.fp.write(zinfo.FileHeader(zip64))
+        zf.fp.write(data)
+        zf.filelist.append(zinfo)
+        zf.NameToInfo[zinfo.filename] = zinfo
+        zf.start_dir = zf.fp.tell()
+
+    def compression_for(self, arcname):
+        """
+        Already compressed assets are stored, everything else gets the
+        builder's compression.
+        """
+        if arcname.lower().endswith(self._stored_extensions):
+            return zipfile.ZIP_STORED
+
+        return self._compression
+
+    def _write_normalized(self, zf, path, arcname, compress_type):
+        # ZipFile.open() ignores the archive level for explicit ZipInfo
+        # entries, _zip_info() carries it on the entry
+        zinfo = self._zip_info(path, arcname, compress_type)
+        with open(path, 'rb') as src, zf.open(zinfo, mode='w') as dst:
+            for block in iter(lambda: src.read(COPY_BLOCK_SIZE), b''):
+                dst.write(block)
@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+DEFAULT_CACHE_DIRECTORY = os.path.join(os.path.expanduser('~'), '.opsworkstool', 'cache')
+DEFAULT_TTL = 24 * 60 * 60
+
+
+class DiskCache(object):
+    """
+    A tiny JSON cache on local disk. Every key is its own file, entries older
+    than the TTL are ignored and writes go through a temporary file that is
+    renamed into place so a reader never sees half an entry.
+    """
+    _directory = None
+    _ttl = DEFAULT_TTL
+
+    def __init__(self, name, **kwargs):
+        """
+        DiskCache init method.
+
+        Args:
+            name - namespace for the entries, a sub directory of the cache
+            directory - cache root, defaults to ~/.opsworkstool/cache
+            ttl - seconds an entry stays good, None means forever
+
+        Returns:
+           not a damn thing
+        """
+        root = kwargs.get('directory', None) or DEFAULT_CACHE_DIRECTORY
+        self._directory = os.path.join(root, name)
+        self._ttl = kwargs.get('ttl', DEFAULT_TTL)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return os.path.join(self._directory, '{}.json'.format(digest))
+
+    def get(self, key):
+        """
+        Args:
+            key - the cache key
+
+        Returns:
+            the cached value or None if missing, expired or unreadable
+        """
+        try:
+            with open(self._path(key), 'r') as f:
+                entry = json.load(f)
+
+            if entry.get('key') != key:
+                return None
+
+            if self._ttl is not None and time.time() - entry.get('created', 0) > self._ttl:
+                logging.info('cache entry {} has expired'.format(key))
+                return None
+
+            return entry.get('value', None)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        """
+        Args:
+            key - the cache key
+            value - anything json can serialize
+
+        Returns:
+            True if the entry was written, otherwise False
+        """
+        tmp_name = None
+        try:
+            if not os.path.isdir(self._directory):
+                os.makedirs(self._directory)
+
+            fd, tmp_name = tempfile.mkstemp(dir=self._directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'created': time.time(), 'value': value}, f)
+
+            os.replace(tmp_name, self._path(key))
+            return True
+        except Exception as wtf:
+            logging.warning('could not write cache entry {}: {}'.format(key, wtf))
+            if tmp_name and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return False
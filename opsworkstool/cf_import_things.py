@@ -24,3 +24,30 @@ sg_parameter_section = """  securityGroupIds:
     Type: CommaDelimitedList"""
 sg_parameter_spec = 'Ref: securityGroupIds'
 imported_sg_spec = '- Fn::ImportValue: {}'
+
+'''
+The same pieces as template fragments for TemplateModel
+'''
+role_parameter_fragment = {
+    'Parameters': {
+        'role': {'Description': 'name of the role', 'Type': 'String'}
+    }
+}
+subnets_parameter_fragment = {
+    'Parameters': {
+        'subnetIds': {'Description': 'list of subnets', 'Type': 'CommaDelimitedList'}
+    }
+}
+sg_parameter_fragment = {
+    'Parameters': {
+        'securityGroupIds': {'Description': 'list of security groups', 'Type': 'CommaDelimitedList'}
+    }
+}
+
+
+def imported_value(export_name):
+    return {'Fn::ImportValue': export_name}
+
+
+def imported_values(export_names):
+    return [imported_value(export_name) for export_name in export_names]
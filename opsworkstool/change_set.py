@@ -0,0 +1,404 @@
+import getpass
+import hashlib
+import json
+import logging
+import sys
+import time
+import traceback
+
+from opsworkstool.stack_poller import StackPoller
+
+DIGEST_TAG = 'opsworkstool:digest'
+CODE_VERSION_TAG = 'CODE_VERSION_SD'
+CAPABILITIES = ['CAPABILITY_IAM', 'CAPABILITY_NAMED_IAM', 'CAPABILITY_AUTO_EXPAND']
+MAXIMUM_TEMPLATE_BODY = 51200
+CHANGE_SET_POLL_INTERVAL = 2
+CHANGE_SET_TIMEOUT = 300
+STACK_DELETE_TIMEOUT = 1800
+HEALTHY_STATES = (
+    'CREATE_COMPLETE',
+    'UPDATE_COMPLETE',
+    'UPDATE_ROLLBACK_COMPLETE',
+    'IMPORT_COMPLETE'
+)
+# a stack that never got created has to be deleted before it can be created
+# again, the same states stackility deletes before an upsert
+DELETABLE_STATES = (
+    'ROLLBACK_COMPLETE',
+)
+NO_CHANGE_REASONS = (
+    "didn't contain changes",
+    'No updates are to be performed'
+)
+
+
+class ChangeSetDeployer(object):
+    """
+    Deploy a stack through a CloudFormation change set. A digest of the
+    template and parameters is stored as a stack tag; when the deployed stack
+    already carries the same digest the stack operation is skipped
+    altogether. Otherwise the change set's resource level changes are
+    printed before it is executed.
+
+    Parameter values of the form [ssm:name] and [ask] are resolved, and the
+    template and parameters are archived to S3, as stackility does for an
+    upsert.
+    """
+    ASK = '[ask]'
+    SSM = '[ssm:'
+    _cf_client = None
+    _s3_client = None
+    _ssm_client = None
+    _stack_name = None
+    _model = None
+    _parameters = None
+    _tags = None
+    _bucket = None
+    _template_prefix = None
+    _code_version = None
+
+    def __init__(self, cf_client, stack_name, model, parameters, **kwargs):
+        """
+        ChangeSetDeployer init method.
+
+        Args:
+            cf_client - a boto3 CloudFormation client
+            stack_name - name of the stack of interest
+            model - the TemplateModel to deploy
+            parameters - dictionary of parameter values, matched to the
+                         template parameters without regard to case
+            tags - dictionary of stack tags
+            code_version - stored in the CODE_VERSION_SD tag and the archive
+                           key, as stackility does
+            s3_client - S3 client for the template archive
+            bucket - bucket for the template archive
+            template_prefix - key prefix for the template archive
+            ssm_client - SSM client for [ssm:name] parameter values
+
+        Returns:
+           not a damn thing
+        """
+        self._cf_client = cf_client
+        self._stack_name = stack_name
+        self._model = model
+        self._parameters = self._match_parameters(parameters)
+        self._tags = kwargs.get('tags', {})
+        self._code_version = kwargs.get('code_version', None)
+        self._s3_client = kwargs.get('s3_client', None)
+        self._bucket = kwargs.get('bucket', None)
+        self._template_prefix = kwargs.get('template_prefix', 'templates')
+        self._ssm_client = kwargs.get('ssm_client', None)
+        self._resolved = None
+        self._digest_values = None
+        self.skipped = False
+        self.changes = []
+        self.stack_status = None
+
+    def _match_parameters(self, parameters):
+        given = dict((key.lower(), value) for key, value in parameters.items())
+        answer = {}
+        for name in self._model.parameters:
+            if name.lower() in given:
+                answer[name] = given[name.lower()]
+
+        return answer
+
+    def resolve_parameters(self):
+        """
+        Replace [ssm:name] values with the parameter from SSM and prompt for
+        [ask] values. Done once; later calls hand back the same values.
+
+        Alongside, the values that go into the digest are worked out: SSM
+        parameters by name and version so no fingerprint of a secret ends up
+        in a stack tag, [ask] parameters as the literal [ask].
+
+        Returns:
+            dictionary of resolved parameter values or None if an SSM
+            parameter could not be found
+        """
+        if self._resolved is not None:
+            return self._resolved
+
+        resolved = {}
+        digest_values = {}
+        for name, value in self._parameters.items():
+            value = str(value)
+            digest_values[name] = value
+            if value.startswith(self.SSM) and value.endswith(']'):
+                ssm_name = value[len(self.SSM):-1]
+                parameter = self._get_ssm_parameter(ssm_name)
+                if parameter is None or parameter.get('Value') is None:
+                    logging.error('SSM parameter {} not found'.format(ssm_name))
+                    return None
+                value = parameter['Value']
+                digest_values[name] = '{}@{}'.format(ssm_name, parameter.get('Version', ''))
+            elif value == self.ASK:
+                value = self._ask(name)
+
+            resolved[name] = value
+
+        self._resolved = resolved
+        self._digest_values = digest_values
+        return resolved
+
+    def asks(self):
+        """
+        Whether any parameter is typed in. Those values never go into the
+        digest, so a stack with one is never taken to be up to date.
+        """
+        return any(str(value) == self.ASK for value in self._parameters.values())
+
+    def _get_ssm_parameter(self, name):
+        if not self._ssm_client:
+            logging.error('no SSM client to look up {}'.format(name))
+            return None
+
+        try:
+            response = self._ssm_client.get_parameter(Name=name, WithDecryption=True)
+            return response.get('Parameter', None)
+        except Exception as ruh_roh:
+            logging.error(ruh_roh, exc_info=False)
+
+        return None
+
+    def _ask(self, name):
+        while True:
+            first = getpass.getpass(prompt="Enter value for '{}': ".format(name))
+            second = getpass.getpass(prompt="Confirm value for '{}': ".format(name))
+            if first == second:
+                return first
+            print('values do not match, try again')
+
+    def digest(self):
+        """
+        Digest of the template plus the parameters, with SSM parameters
+        taken by name and version so a new version is deployed too.
+        """
+        self.resolve_parameters()
+        digest = hashlib.sha256()
+        digest.update(self._model.digest().encode('utf-8'))
+        digest.update(json.dumps(self._digest_values, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def deployed_digest(self):
+        """
+        Returns:
+            the digest tag of the deployed stack, None if there is no stack
+            or it is not in a healthy state
+        """
+        try:
+            response = self._cf_client.describe_stacks(StackName=self._stack_name)
+        except Exception as wtf:
+            logging.info('stack {} not found: {}'.format(self._stack_name, wtf))
+            return None
+
+        stack = response['Stacks'][0]
+        self.stack_status = stack['StackStatus']
+        if self.stack_status not in HEALTHY_STATES:
+            return None
+
+        for tag in stack.get('Tags', []):
+            if tag['Key'] == DIGEST_TAG:
+                return tag['Value']
+
+        return None
+
+    def deploy(self):
+        """
+        Create/update the stack unless it already matches.
+
+        Args:
+            None
+
+        Returns:
+            True if the stack is where it should be, otherwise False
+        """
+        try:
+            if self.resolve_parameters() is None:
+                return False
+
+            digest = self.digest()
+            if self.deployed_digest() == digest and not self.asks():
+                logging.info('{} already matches digest {}, nothing to do'.format(self._stack_name, digest[:12]))
+                self.skipped = True
+                return True
+
+            if self.stack_status in DELETABLE_STATES:
+                if not self._delete_stack():
+                    return False
+
+            change_set_id = self._create_change_set(digest)
+            if not change_set_id:
+                return False
+
+            status = self._wait_for_change_set(change_set_id)
+            if status == 'NO_CHANGES':
+                self.skipped = True
+                return True
+            elif status != 'CREATE_COMPLETE':
+                return False
+
+            self.print_changes()
+
+            poller = StackPoller(self._cf_client, self._stack_name)
+            poller.mark()
+            self._cf_client.execute_change_set(ChangeSetName=change_set_id)
+            answer = poller.poll()
+            self.stack_status = poller.stack_status
+            return answer
+        except Exception as wtf:
+            logging.error('Exception caught in deploy(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+            return False
+
+    def _delete_stack(self):
+        """
+        Delete a stack left in one of the DELETABLE_STATES and wait for it
+        to go away so it can be created again.
+
+        Returns:
+            True if the stack is gone, otherwise False
+        """
+        logging.info('stack {} is in {} and will be deleted'.format(self._stack_name, self.stack_status))
+        self._cf_client.delete_stack(StackName=self._stack_name)
+        started = time.time()
+        while True:
+            try:
+                response = self._cf_client.describe_stacks(StackName=self._stack_name)
+                status = response['Stacks'][0]['StackStatus']
+            except Exception as wtf:
+                if 'does not exist' not in str(wtf):
+                    raise
+                status = 'DELETE_COMPLETE'
+
+            if status == 'DELETE_COMPLETE':
+                logging.info('{} is gone'.format(self._stack_name))
+                self.stack_status = None
+                return True
+
+            if status == 'DELETE_FAILED':
+                logging.error('delete of {} failed'.format(self._stack_name))
+                return False
+
+            if time.time() - started > STACK_DELETE_TIMEOUT:
+                logging.error('gave up waiting on delete of {}'.format(self._stack_name))
+                return False
+
+            time.sleep(CHANGE_SET_POLL_INTERVAL)
+
+    def _archive_elements(self, body):
+        """
+        Put the template and the parameters used into S3 under the same keys
+        stackility uses. The parameters are stored as given, with SSM
+        references rather than the values they resolve to.
+
+        Returns:
+            the https URL of the archived template, None when there is no
+            bucket to archive to
+        """
+        if not self._s3_client or not self._bucket:
+            return None
+
+        now = time.gmtime()
+        stub = '{}/{}/{}/{}'.format(
+            self._template_prefix,
+            self._stack_name,
+            self._code_version,
+            time.strftime('%Y/%m/%d/%H:%M:%S', now)
+        )
+        template_key = stub + '/stack.json'
+        property_key = stub + '/stack.properties'
+
+        logging.info('Copying parameters to s3://{}/{}'.format(self._bucket, property_key))
+        self._s3_client.put_object(
+            Bucket=self._bucket,
+            Key=property_key,
+            Body=json.dumps(self._parameters, indent=4).encode('utf-8')
+        )
+        logging.info('Copying template to s3://{}/{}'.format(self._bucket, template_key))
+        self._s3_client.put_object(Bucket=self._bucket, Key=template_key, Body=body.encode('utf-8'))
+        return 'https://s3.amazonaws.com/{}/{}'.format(self._bucket, template_key)
+
+    def _create_change_set(self, digest):
+        if self.stack_status is None:
+            change_set_type = 'CREATE'
+        elif self.stack_status == 'REVIEW_IN_PROGRESS':
+            change_set_type = 'CREATE'
+        else:
+            change_set_type = 'UPDATE'
+
+        tags = dict(self._tags)
+        tags[DIGEST_TAG] = digest
+        if self._code_version:
+            tags[CODE_VERSION_TAG] = self._code_version
+
+        kwargs = {
+            'StackName': self._stack_name,
+            'ChangeSetName': 'opsworkstool-{}-{}'.format(digest[:12], int(time.time())),
+            'ChangeSetType': change_set_type,
+            'Parameters': [
+                {'ParameterKey': k, 'ParameterValue': v} for k, v in sorted(self.resolve_parameters().items())
+            ],
+            'Capabilities': CAPABILITIES,
+            'Tags': [{'Key': k, 'Value': v} for k, v in sorted(tags.items())]
+        }
+
+        body = self._model.to_json()
+        template_url = self._archive_elements(body)
+        if len(body) > MAXIMUM_TEMPLATE_BODY:
+            if not template_url:
+                logging.error('template is too large to send inline and no bucket was given')
+                return None
+
+            kwargs['TemplateURL'] = template_url
+        else:
+            kwargs['TemplateBody'] = body
+
+        logging.info('creating {} change set for {}'.format(change_set_type, self._stack_name))
+        response = self._cf_client.create_change_set(**kwargs)
+        return response['Id']
+
+    def _wait_for_change_set(self, change_set_id):
+        started = time.time()
+        while True:
+            response = self._cf_client.describe_change_set(ChangeSetName=change_set_id)
+            status = response['Status']
+            if status == 'CREATE_COMPLETE':
+                self.changes = response.get('Changes', [])
+                next_token = response.get('NextToken', None)
+                while next_token:
+                    response = self._cf_client.describe_change_set(
+                        ChangeSetName=change_set_id,
+                        NextToken=next_token
+                    )
+                    self.changes.extend(response.get('Changes', []))
+                    next_token = response.get('NextToken', None)
+                return status
+
+            if status == 'FAILED':
+                reason = response.get('StatusReason', '')
+                if any(no_change in reason for no_change in NO_CHANGE_REASONS):
+                    logging.info('change set for {} has no changes, nothing to do'.format(self._stack_name))
+                    self._cf_client.delete_change_set(ChangeSetName=change_set_id)
+                    return 'NO_CHANGES'
+
+                logging.error('change set for {} failed: {}'.format(self._stack_name, reason))
+                return status
+
+            if time.time() - started > CHANGE_SET_TIMEOUT:
+                logging.error('gave up waiting on change set for {}'.format(self._stack_name))
+                return 'TIMEOUT'
+
+            time.sleep(CHANGE_SET_POLL_INTERVAL)
+
+    def print_changes(self):
+        print('\nChanges to {}:'.format(self._stack_name))
+        for change in self.changes:
+            resource = change.get('ResourceChange', {})
+            print('\t{}\t{}\t{}\t{}'.format(
+                resource.get('Action', ''),
+                resource.get('LogicalResourceId', ''),
+                resource.get('ResourceType', ''),
+                'replacement: {}'.format(resource.get('Replacement')) if resource.get('Replacement') else ''
+            ))
+        print('')
@@ -4,10 +4,8 @@ The command line interface to stackility.
 Major help from: https://www.youtube.com/watch?v=kNke39OZ2k0
 """
 import opsworkstool
-from opsworkstool.opsworks_creator import OpsworksCreator
-from opsworkstool.opsworks_deployer import OpsworksDeployer
+from opsworkstool import utility
 import click
-import boto3
 import logging
 import sys
 import json
@@ -26,8 +24,15 @@ opsworkstool deploy. The opsworks has been started in template.json.
 
 @click.group()
 @click.version_option(version='0.0.2')
-def cli():
-    pass
+@click.option('--max-pool-connections', help='HTTP connections kept per AWS client, default 10', type=int)
+@click.option('--max-aws-calls', help='AWS calls in flight at once across the whole run, default 16', type=click.IntRange(1, None))
+def cli(max_pool_connections, max_aws_calls):
+    if max_pool_connections:
+        utility.configure_client_pool(max_pool_connections)
+
+    if max_aws_calls:
+        from opsworkstool import aio
+        aio.configure(max_aws_calls)
 
 
 @cli.command()
@@ -35,8 +40,12 @@ def cli():
 @click.option('-n', '--name', help='name of the new opsworks skeleton', required=True)
 @click.option('-p', '--profile', help='AWS CLI profile to use in the deployment, more details at http://docs.aws.amazon.com/cli/latest/userguide/cli-chap-getting-started.html')
 @click.option('-r', '--region', help='target region, defaults to your credentials default region')
+@click.option('--role-name', help='name of the OpsWorks service role to look for, default opsworks_basic_vpc_execution')
+@click.option('--refresh', help='Ignore the cached default VPC info and look it up again', required=False, is_flag=True)
+@click.option('--cache-ttl', help='seconds the cached default VPC info stays good, default 86400', type=int, default=86400)
+@click.option('--discovery-timeout', help='seconds to wait on each default VPC lookup, default 10', type=float, default=10)
 @click.option('--debug', help='Turn on debugging', required=False, is_flag=True)
-def new(directory, name, profile, region, debug):
+def new(directory, name, profile, region, role_name, refresh, cache_ttl, discovery_timeout, debug):
     command_line = {}
     command_line['name'] = name
 
@@ -59,6 +68,16 @@ def new(directory, name, profile, region, debug):
     else:
         command_line['region'] = None
 
+    command_line['role_name'] = role_name
+
+    if refresh:
+        command_line['refresh'] = True
+    else:
+        command_line['refresh'] = False
+
+    command_line['cache_ttl'] = cache_ttl
+    command_line['discovery_timeout'] = discovery_timeout
+
     if debug:
         command_line['debug'] = True
     else:
@@ -70,13 +89,39 @@ def new(directory, name, profile, region, debug):
         sys.exit(1)
 
 
-@cli.command()
-@click.option('-d', '--directory', help='scratch directory for deploy, defaults to /tmp')
-@click.option('-p', '--profile', help='AWS CLI profile to use in the deployment, more details at http://docs.aws.amazon.com/cli/latest/userguide/cli-chap-getting-started.html')
-@click.option('-r', '--region', help='target region, defaults to your credentials default region')
-@click.option('-s', '--stage', help='The /config/<stage>  with parameters for cloudformation. Default: config.ini')
-@click.option('--debug', help='Turn on debugging', required=False, is_flag=True)
-def deploy(directory, profile, region, stage, debug):
+def deploy_options(function):
+    '''
+    Options shared by deploy and deploy-all.
+    '''
+    options = [
+        click.option('-d', '--directory', help='scratch directory for deploy, defaults to /tmp'),
+        click.option('-p', '--profile', help='AWS CLI profile to use in the deployment, more details at http://docs.aws.amazon.com/cli/latest/userguide/cli-chap-getting-started.html'),
+        click.option('-r', '--region', help='target region, defaults to your credentials default region'),
+        click.option('-s', '--stage', help='The /config/<stage>  with parameters for cloudformation. Default: config.ini'),
+        click.option('--stages', help='comma separated list of stages to deploy concurrently, e.g. dev,qa,prod'),
+        click.option('--all-stages', help='Deploy every stage in config/config.ini that names a bucket', required=False, is_flag=True),
+        click.option('--workers', help='number of stages deployed at once, default 4', type=int, default=4),
+        click.option('--content-digest', help='Key the recipe bundle by a digest of recipe/ and reuse it if already uploaded', required=False, is_flag=True),
+        click.option('--change-set', help='Deploy through a change set, skipping stacks that already match (turns on --content-digest)', required=False, is_flag=True),
+        click.option('--incremental', help='Skip stages whose bundle, template and parameters match the last deploy', required=False, is_flag=True),
+        click.option('--vendor', help='Vendor the recipe/Berksfile dependencies into the bundle, cached by Berksfile.lock', required=False, is_flag=True),
+        click.option('--part-size', help='multipart upload part size in MB', type=float),
+        click.option('--max-concurrency', help='number of upload parts sent at once', type=int),
+        click.option('--multipart-threshold', help='packages larger than this many MB are uploaded in parts', type=float),
+        click.option('--reproducible', help='Build a byte-stable bundle: sorted entries, fixed timestamps and permissions', required=False, is_flag=True, default=None),
+        click.option('--compression-level', help='zlib compression level for the bundle, 0-9', type=click.IntRange(0, 9)),
+        click.option('--bundle-workers', help='threads used to hash and compress the bundle, defaults to the CPU count', type=click.IntRange(1, None)),
+        click.option('--profile-deploy', help='Print how long each deploy step took and what it did', required=False, is_flag=True),
+        click.option('--profile-output', help='write the deploy profile as JSON to this file'),
+        click.option('--debug', help='Turn on debugging', required=False, is_flag=True)
+    ]
+    for option in reversed(options):
+        function = option(function)
+
+    return function
+
+
+def make_deploy_command_line(directory, profile, region, stage, stages, all_stages, workers, content_digest, change_set, incremental, vendor, part_size, max_concurrency, multipart_threshold, reproducible, compression_level, bundle_workers, profile_deploy, profile_output, debug):
     command_line = {}
 
     command_line['cwd'] =  str(os.getcwd())
@@ -106,8 +151,65 @@ def deploy(directory, profile, region, stage, debug):
     else:
         command_line['stage'] = default_stage
 
+    if stages:
+        command_line['stages'] = [s.strip() for s in stages.split(',') if s.strip()]
+    else:
+        command_line['stages'] = None
+
+    if all_stages:
+        command_line['all_stages'] = True
+    else:
+        command_line['all_stages'] = False
+
+    command_line['workers'] = workers
+
+    if content_digest:
+        command_line['content_digest'] = True
+    else:
+        command_line['content_digest'] = False
+
+    if change_set:
+        command_line['change_set'] = True
+    else:
+        command_line['change_set'] = False
+
+    if incremental:
+        command_line['incremental'] = True
+    else:
+        command_line['incremental'] = False
+
+    if vendor:
+        command_line['vendor_cookbooks'] = True
+    else:
+        command_line['vendor_cookbooks'] = False
+
+    command_line['transfer'] = {
+        'part_size_mb': part_size,
+        'max_concurrency': max_concurrency,
+        'multipart_threshold_mb': multipart_threshold
+    }
+
+    command_line['bundle'] = {
+        'reproducible': reproducible,
+        'compression_level': compression_level,
+        'workers': bundle_workers
+    }
+
+    if profile_deploy:
+        command_line['profile_deploy'] = True
+    else:
+        command_line['profile_deploy'] = False
+
+    command_line['profile_output'] = profile_output
 
     command_line['template_directory'] = '{}/template'.format(opsworkstool.__path__[0])
+    return command_line
+
+
+@cli.command()
+@deploy_options
+def deploy(**kwargs):
+    command_line = make_deploy_command_line(**kwargs)
     logging.info('command_line: {}'.format(json.dumps(command_line, indent=2)))
 
     if deploy_opsworks(command_line):
@@ -116,7 +218,26 @@ def deploy(directory, profile, region, stage, debug):
         sys.exit(1)
 
 
+@cli.command(name='deploy-all')
+@click.option('--root', help='directory searched for opsworkstool projects, defaults to current directory', default='.')
+@click.option('--project-workers', help='number of projects deployed at once, default 4', type=int, default=4)
+@deploy_options
+def deploy_all(root, project_workers, **kwargs):
+    from opsworkstool.fleet import FleetDeployer
+
+    command_line = make_deploy_command_line(**kwargs)
+    logging.info('command_line: {}'.format(json.dumps(command_line, indent=2)))
+
+    fleet = FleetDeployer(command_line, root, project_workers)
+    if fleet.deploy_all():
+        sys.exit(0)
+    else:
+        sys.exit(1)
+
+
 def start_new_opsworks(command_line):
+    from opsworkstool.opsworks_creator import OpsworksCreator
+
     try:
         tool = OpsworksCreator(command_line)
     except Exception:
@@ -137,6 +258,7 @@ def start_new_opsworks(command_line):
 
 
 def deploy_opsworks(command_line):
+    from opsworkstool.opsworks_deployer import OpsworksDeployer
 
     try:
         print('command_line: '+str(command_line))
@@ -154,5 +276,5 @@ def deploy_opsworks(command_line):
 
 
 def find_myself():
-    s = boto3.session.Session()
+    s = utility.get_session(None, None)
     return s.region_name
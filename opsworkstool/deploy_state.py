@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+STATE_FILE = '.opsworkstool-state.json'
+STATE_VERSION = 1
+SUCCESS_STATES = (
+    'CREATE_COMPLETE',
+    'UPDATE_COMPLETE',
+    'IMPORT_COMPLETE'
+)
+
+
+class DeployState(object):
+    """
+    What the last deploy shipped, per stage, kept in a sidecar file next to
+    .opsworkstool. Every entry holds the inputs the stage was deployed from
+    (bundle digest, template digest, parameter digest...) and the outputs it
+    produced (bundle key, recipe url, stack status). A stage whose inputs
+    match its last successful deploy does not need deploying again.
+    """
+    _file_name = None
+
+    def __init__(self, project_directory, file_name=STATE_FILE):
+        """
+        DeployState init method.
+
+        Args:
+            project_directory - the opsworkstool project
+            file_name - name of the state file in that directory
+
+        Returns:
+           not a damn thing
+        """
+        self._file_name = os.path.join(project_directory, file_name)
+        self._lock = threading.Lock()
+        self._stages = self._load()
+
+    def _load(self):
+        try:
+            with open(self._file_name, 'r') as f:
+                data = json.load(f)
+
+            if data.get('version') != STATE_VERSION:
+                logging.info('ignoring {}, it was written by another version'.format(self._file_name))
+                return {}
+
+            return data.get('stages', {})
+        except (IOError, OSError):
+            return {}
+        except ValueError as wtf:
+            logging.warning('ignoring unreadable {}: {}'.format(self._file_name, wtf))
+            return {}
+
+    def get(self, stage):
+        """
+        Args:
+            stage - the config.ini stage
+
+        Returns:
+            the recorded entry for the stage, an empty dictionary if none
+        """
+        with self._lock:
+            return dict(self._stages.get(stage, {}))
+
+    def unchanged(self, stage, inputs):
+        """
+        Args:
+            stage - the config.ini stage
+            inputs - dictionary of everything the stage is deployed from
+
+        Returns:
+            True if the stage was last deployed successfully from the same
+            inputs, otherwise False
+        """
+        entry = self.get(stage)
+        return (
+            entry.get('inputs') == inputs and
+            entry.get('stack_status') in SUCCESS_STATES
+        )
+
+    def record(self, stage, **outputs):
+        """
+        Merge outputs into the stage's entry and write the state file.
+
+        Args:
+            stage - the config.ini stage
+            outputs - e.g. inputs={...}, bundle_key='...', stack_status='...'
+
+        Returns:
+            True if the state file was written, otherwise False
+        """
+        with self._lock:
+            entry = self._stages.setdefault(stage, {})
+            entry.update(outputs)
+            entry['updated'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+            return self._save()
+
+    def _save(self):
+        tmp_name = None
+        try:
+            fd, tmp_name = tempfile.mkstemp(
+                dir=os.path.dirname(self._file_name) or '.',
+                suffix='.tmp'
+            )
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': STATE_VERSION, 'stages': self._stages}, f, indent=2, sort_keys=True)
+
+            os.replace(tmp_name, self._file_name)
+            return True
+        except Exception as wtf:
+            logging.warning('could not write {}: {}'.format(self._file_name, wtf))
+            if tmp_name and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return False
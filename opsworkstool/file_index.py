@@ -0,0 +1,236 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from opsworkstool import profiler
+
+INDEX_FILE = '.opsworkstool-index.json'
+INDEX_VERSION = 1
+HASH_BLOCK_SIZE = 1024 * 1024
+# a file modified this close to the last save could change again within the
+# same mtime tick without the stat changing, so it is hashed again next time
+RACY_SECONDS = 2.0
+
+
+class FileIndex(object):
+    """
+    A persistent index of a source tree. Every file has its size, mtime and
+    sha256; every directory has its mtime and listing. On refresh only
+    directories whose mtime moved are listed again and only files whose
+    size or mtime moved lose their hash, so a large, mostly unchanged tree
+    costs a stat per file instead of a full read.
+
+    Hashes are worked out lazily, when digest() or hashes() needs them, on a
+    pool of threads (hashlib drops the GIL while it works).
+    """
+    _source_dir = None
+    _index_file = None
+
+    def __init__(self, source_dir, index_file=None, workers=1):
+        """
+        FileIndex init method.
+
+        Args:
+            source_dir - root of the tree
+            index_file - where the index is kept, None for an in-memory index
+            workers - files hashed at once
+
+        Returns:
+           not a damn thing
+        """
+        self._source_dir = source_dir
+        self._index_file = index_file
+        self._workers = max(1, workers)
+        self._files = {}
+        self._directories = {}
+        self._saved = 0.0
+        self.files_hashed = 0
+        self.directories_listed = 0
+        self.directories_reused = 0
+        self._load()
+
+    def _load(self):
+        if not self._index_file:
+            return
+
+        try:
+            with open(self._index_file, 'r') as f:
+                data = json.load(f)
+        except (IOError, OSError):
+            return
+        except ValueError as wtf:
+            logging.warning('ignoring unreadable {}: {}'.format(self._index_file, wtf))
+            return
+
+        if data.get('version') != INDEX_VERSION or data.get('source_dir') != os.path.abspath(self._source_dir):
+            return
+
+        self._files = data.get('files', {})
+        self._directories = data.get('directories', {})
+        self._saved = data.get('saved', 0.0)
+
+    def refresh(self):
+        """
+        Bring the index up to date with the tree on disk.
+
+        Returns:
+            the index, for chaining
+        """
+        self.directories_listed = 0
+        self.directories_reused = 0
+        racy_after = self._saved - RACY_SECONDS
+        files = {}
+        directories = {}
+
+        pending = ['']
+        while pending:
+            relative = pending.pop()
+            folder = os.path.join(self._source_dir, relative) if relative else self._source_dir
+            try:
+                mtime = os.stat(folder).st_mtime_ns
+            except OSError:
+                continue
+
+            known = self._directories.get(relative, None)
+            if known and known['mtime'] == mtime and mtime / 1e9 < racy_after:
+                listing = known
+                self.directories_reused += 1
+            else:
+                listing = self._list(folder, mtime)
+                self.directories_listed += 1
+            directories[relative] = listing
+
+            for name in listing['directories']:
+                pending.append(_join(relative, name))
+
+            for name in listing['files']:
+                arcname = _join(relative, name)
+                try:
+                    info = os.stat(os.path.join(folder, name))
+                except OSError:
+                    continue
+
+                entry = self._files.get(arcname, None)
+                if (
+                    entry is None or
+                    entry['size'] != info.st_size or
+                    entry['mtime'] != info.st_mtime_ns or
+                    info.st_mtime_ns / 1e9 >= racy_after
+                ):
+                    entry = {'size': info.st_size, 'mtime': info.st_mtime_ns, 'sha256': None}
+                files[arcname] = entry
+
+        self._files = files
+        self._directories = directories
+        return self
+
+    def _list(self, folder, mtime):
+        # same split as os.walk: symlinked directories are neither followed
+        # nor bundled, symlinked files are bundled
+        listing = {'mtime': mtime, 'directories': [], 'files': []}
+        for entry in os.scandir(folder):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    listing['directories'].append(entry.name)
+            else:
+                listing['files'].append(entry.name)
+        return listing
+
+    def files(self):
+        """
+        Returns:
+            a list of (path on disk, name in the archive) tuples sorted by
+            the name in the archive
+        """
+        return [
+            (os.path.join(self._source_dir, *arcname.split('/')), arcname)
+            for arcname in sorted(self._files)
+        ]
+
+    def total_bytes(self):
+        return sum(entry['size'] for entry in self._files.values())
+
+    def hashes(self):
+        """
+        Returns:
+            a list of (name in the archive, sha256) tuples sorted by name,
+            hashing only the files that changed since the last refresh
+        """
+        stale = [
+            (path, arcname) for path, arcname in self.files()
+            if self._files[arcname]['sha256'] is None
+        ]
+        self.files_hashed = len(stale)
+        if self._workers > 1 and len(stale) > 1:
+            with ThreadPoolExecutor(max_workers=self._workers) as pool:
+                digests = list(pool.map(profiler.bind(hash_file), [path for path, arcname in stale]))
+        else:
+            digests = [hash_file(path) for path, arcname in stale]
+
+        for (path, arcname), sha256 in zip(stale, digests):
+            self._files[arcname]['sha256'] = sha256
+
+        return [(arcname, self._files[arcname]['sha256']) for arcname in sorted(self._files)]
+
+    def digest(self):
+        """
+        A digest of the tree: every file's archive name and content hash.
+        """
+        digest = hashlib.sha256()
+        for arcname, sha256 in self.hashes():
+            digest.update(arcname.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(sha256.encode('ascii'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def save(self):
+        """
+        Write the index, atomically, if it has a file.
+
+        Returns:
+            True if it was written, otherwise False
+        """
+        if not self._index_file:
+            return False
+
+        tmp_name = None
+        try:
+            fd, tmp_name = tempfile.mkstemp(
+                dir=os.path.dirname(self._index_file) or '.',
+                suffix='.tmp'
+            )
+            self._saved = time.time()
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'version': INDEX_VERSION,
+                    'source_dir': os.path.abspath(self._source_dir),
+                    'saved': self._saved,
+                    'directories': self._directories,
+                    'files': self._files
+                }, f, separators=(',', ':'))
+
+            os.replace(tmp_name, self._index_file)
+            return True
+        except Exception as wtf:
+            logging.warning('could not write {}: {}'.format(self._index_file, wtf))
+            if tmp_name and os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return False
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _join(relative, name):
+    return '{}/{}'.format(relative, name) if relative else name
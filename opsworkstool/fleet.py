@@ -0,0 +1,144 @@
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+
+from opsworkstool.opsworks_deployer import DEFAULT_MODULE_FILE
+from opsworkstool.opsworks_deployer import OpsworksDeployer
+from opsworkstool.opsworks_deployer import label_log_lines
+
+PROJECT_MARKER = '.opsworkstool'
+DEFAULT_PROJECT_WORKERS = 4
+SKIPPED_DIRECTORIES = ('.git', 'node_modules', '__pycache__')
+
+
+def find_projects(root):
+    """
+    Find every opsworkstool project under root. A project is a directory
+    with both a .opsworkstool file and a template.json; the search does not
+    descend into a project once found.
+
+    Args:
+        root - directory to search
+
+    Returns:
+        sorted list of project directories
+    """
+    projects = []
+    for folder, subs, files in os.walk(root):
+        if PROJECT_MARKER in files and DEFAULT_MODULE_FILE in files:
+            projects.append(os.path.abspath(folder))
+            subs[:] = []
+        else:
+            subs[:] = [d for d in subs if d not in SKIPPED_DIRECTORIES]
+
+    return sorted(projects)
+
+
+class FleetDeployer(object):
+    """
+    Deploy many opsworkstool projects at once. Each project gets its own
+    OpsworksDeployer pointed at the project directory, so nothing depends on
+    the process working directory, and its own scratch directory. Starting
+    a stackility upsert is serialized across every project by
+    opsworks_deployer.STACKILITY_LOCK, as it is across stages.
+    """
+    _config = None
+    _root = None
+    _workers = DEFAULT_PROJECT_WORKERS
+
+    def __init__(self, config_block, root, workers=DEFAULT_PROJECT_WORKERS):
+        """
+        FleetDeployer init method.
+
+        Args:
+            config_block - the deploy command line dictionary; cwd is
+                           replaced with each project directory
+            root - directory to search for projects
+            workers - number of projects deployed at once
+
+        Returns:
+           not a damn thing
+        """
+        self._config = config_block
+        self._root = root
+        self._workers = max(1, workers)
+        self.results = []
+
+    def deploy_all(self):
+        """
+        Deploy every project found under the root.
+
+        Args:
+            None
+
+        Returns:
+            True if every project deployed, otherwise False
+        """
+        projects = find_projects(self._root)
+        if not projects:
+            logging.error('no opsworkstool projects found under {}'.format(self._root))
+            return False
+
+        logging.info('deploying {} project(s) with {} worker(s)'.format(len(projects), self._workers))
+        label_log_lines()
+        self.results = []
+        with ThreadPoolExecutor(max_workers=min(self._workers, len(projects))) as pool:
+            futures = [pool.submit(self.deploy_project, project) for project in projects]
+            for future in as_completed(futures):
+                self.results.append(future.result())
+
+        self.results.sort(key=lambda r: r['project'])
+        self.print_report()
+        return all(r['deployed'] for r in self.results)
+
+    def deploy_project(self, project):
+        """
+        Deploy a single project directory.
+
+        Args:
+            project - the project directory
+
+        Returns:
+            a dictionary with the project, outcome and elapsed seconds
+        """
+        threading.current_thread().name = os.path.basename(project)
+        started = time.time()
+        deployed = False
+        try:
+            config_block = dict(self._config)
+            config_block['cwd'] = project
+            if config_block.get('profile_output'):
+                base, ext = os.path.splitext(config_block['profile_output'])
+                config_block['profile_output'] = '{}-{}{}'.format(base, os.path.basename(project), ext)
+            tool = OpsworksDeployer(config_block)
+            deployed = tool.deploy_opsworks()
+        except Exception as x:
+            logging.error('Exception caught in deploy_project({}): {}'.format(project, x))
+            traceback.print_exc(file=sys.stdout)
+
+        return {
+            'project': project,
+            'deployed': bool(deployed),
+            'seconds': round(time.time() - started, 3)
+        }
+
+    def print_report(self):
+        print('\nFleet deployment report:')
+        for result in self.results:
+            print('\t{}\t{}\t{:.1f}s'.format(
+                'succeeded' if result['deployed'] else 'FAILED',
+                os.path.relpath(result['project'], self._root),
+                result['seconds']
+            ))
+
+        failed = len([r for r in self.results if not r['deployed']])
+        print('\n{} of {} project(s) deployed, {} failed'.format(
+            len(self.results) - failed,
+            len(self.results),
+            failed
+        ))
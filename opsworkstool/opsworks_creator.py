@@ -4,9 +4,18 @@ import subprocess
 import os
 import sys
 import shutil
+import asyncio
+from opsworkstool import aio
 from opsworkstool import utility
+from opsworkstool.cache import DiskCache
+from opsworkstool.cache import DEFAULT_TTL
 import json
 
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 logging.basicConfig(level=logging.INFO,
@@ -14,6 +23,10 @@ logging.basicConfig(level=logging.INFO,
                     datefmt='%Y/%m/%d-%H:%M:%S')
 
 IGNORED_STUFF = ('template_template', '*.pyc')
+DEFAULT_DISCOVERY_TIMEOUT = 10
+DEFAULT_ROLE_NAME = 'opsworks_basic_vpc_execution'
+OPSWORKS_SERVICE_PRINCIPAL = 'opsworks.amazonaws.com'
+ROLE_PAGE_SIZE = 1000
 
 
 class OpsworksCreator:
@@ -23,6 +36,11 @@ class OpsworksCreator:
     _config = None
     _region = None
     _profile = None
+    _refresh = False
+    _cache_ttl = DEFAULT_TTL
+    _discovery_timeout = DEFAULT_DISCOVERY_TIMEOUT
+    _discovery_partial = False
+    _role_name = DEFAULT_ROLE_NAME
 
     def __init__(self, config_block):
         """
@@ -44,6 +62,10 @@ class OpsworksCreator:
             self._profile = config_block['profile']
             self._region = config_block['region']
             self.debug = config_block['debug']
+            self._refresh = config_block.get('refresh', False)
+            self._cache_ttl = config_block.get('cache_ttl', DEFAULT_TTL)
+            self._discovery_timeout = config_block.get('discovery_timeout', DEFAULT_DISCOVERY_TIMEOUT)
+            self._role_name = config_block.get('role_name', None) or DEFAULT_ROLE_NAME
         else:
             logger.error('config block was garbage')
             raise SystemError
@@ -72,7 +94,7 @@ class OpsworksCreator:
                 logger.info('     source_directory: {}'.format(self._config['template_directory']))
                 logger.info('destination_directory: {}'.format(destination_directory))
 
-            default_vpc_info = self._describe_opsworks_environment()
+            default_vpc_info = self._cached_opsworks_environment()
 
             logger.debug('default vpc info: '+str(default_vpc_info))
             logger.debug(json.dumps(self._config, indent=2))
@@ -200,13 +222,76 @@ class OpsworksCreator:
         if not os.path.exists(self._config['cwd']+'/'+str(self._config['name'])+'/recipe/Berksfile'):
 
             file = open(self._config['cwd']+'/'+str(self._config['name'])+'/recipe/Berksfile', "w")
-            file.write('source "https://supermarket.getchef.com"')
-            file.write("")
-            file.write("metadata")
-            file.write('cookbook '+self._config['name'])
+            file.write('source "https://supermarket.getchef.com"\n')
+            file.write('\n')
+            file.write("cookbook '{0}', path: './{0}'\n".format(self._config['name']))
             file.close()
 
 
+    def _cached_opsworks_environment(self):
+        '''
+        Default VPC info rarely changes for an account and region so it is
+        kept in a local cache, keyed by the account the credentials belong
+        to. --refresh skips the cache and rewrites it. If the account can not
+        be found the cache is not used at all.
+
+        Args:
+            None
+
+        Returns:
+            the same dictionary as _describe_opsworks_environment()
+        '''
+        region = self._region
+        if not region:
+            region = utility.get_session(self._profile, None).region_name
+
+        account = self._find_account()
+        if not account:
+            return self._describe_opsworks_environment()
+
+        # the role found for the role name is cached along with the vpc info
+        key = 'vpc-info:{}:{}:{}:{}'.format(
+            self._profile or 'default',
+            account,
+            region,
+            self._role_name
+        )
+        cache = DiskCache('environment', ttl=self._cache_ttl)
+        if not self._refresh:
+            vpc_info = cache.get(key)
+            if vpc_info is not None:
+                logger.info('using cached default vpc info for {}'.format(key))
+                return vpc_info
+
+        vpc_info = self._describe_opsworks_environment()
+        if vpc_info and not self._discovery_partial:
+            cache.put(key, vpc_info)
+
+        return vpc_info
+
+    def _find_account(self):
+        '''
+        Find the id of the account the credentials belong to.
+
+        Args:
+            None
+
+        Returns:
+            the account id or None
+        '''
+        try:
+            sts_client = utility.get_api_client(
+                self._profile,
+                self._region,
+                'sts'
+            )
+            return sts_client.get_caller_identity()['Account']
+        except Exception as wtf:
+            logger.error('Exception caught in _find_account(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+
+        return None
+
     def _describe_opsworks_environment(self):
         '''
         Find the default vpc for the given region
@@ -230,17 +315,12 @@ class OpsworksCreator:
 
             for vpc in response['Vpcs']:
                 if vpc['IsDefault']:
-                    subnets = self._find_default_subnets(vpc['VpcId'])
-                    if subnets:
-                        vpc_info['subnets'] = subnets
-
-                    security_group = self._find_default_security_group(vpc['VpcId'])
-                    if security_group:
-                        vpc_info['security_group'] = security_group
-
-                    opsworks_role = self._find_opsworks_role()
-                    if opsworks_role:
-                        vpc_info['role'] = opsworks_role
+                    lookups = {
+                        'subnets': (self._find_default_subnets, vpc['VpcId']),
+                        'security_group': (self._find_default_security_group, vpc['VpcId']),
+                        'role': (self._find_opsworks_role,)
+                    }
+                    vpc_info.update(self._run_lookups(lookups))
 
                     logger.info(json.dumps(vpc_info, indent=2))
                     return vpc_info
@@ -250,7 +330,75 @@ class OpsworksCreator:
 
         return {}
 
+    def _run_lookups(self, lookups):
+        '''
+        Run independent discovery calls at the same time. Each one gets
+        discovery_timeout seconds; a lookup that fails, finds nothing or runs
+        out of time is left out of the answer instead of spoiling the others,
+        and marks the answer partial so it is not cached.
+
+        Args:
+            lookups - dictionary of name: (function, args...)
+
+        Returns:
+            dictionary of name: result for the lookups that found something
+        '''
+        return aio.run(self._run_lookups_async(lookups))
+
+    async def _run_lookups_async(self, lookups):
+        tasks = dict(
+            (name, asyncio.ensure_future(aio.call(lookup[0], *lookup[1:])))
+            for name, lookup in lookups.items()
+        )
+        done, pending = await asyncio.wait(
+            list(tasks.values()),
+            timeout=self._discovery_timeout
+        )
+
+        answer = {}
+        for name, task in tasks.items():
+            if task in pending:
+                logger.warning('{} lookup timed out after {} seconds'.format(
+                    name,
+                    self._discovery_timeout
+                ))
+                self._discovery_partial = True
+                task.cancel()
+            elif task.exception() is not None:
+                logger.error('{} lookup failed: {}'.format(name, task.exception()))
+                self._discovery_partial = True
+            elif task.result():
+                answer[name] = task.result()
+            else:
+                # the lookups log and swallow their own errors, so nothing
+                # found counts as a failure and keeps the answer out of the
+                # cache
+                logger.warning('{} lookup found nothing'.format(name))
+                self._discovery_partial = True
+
+        return answer
+
     def _find_opsworks_role(self):
+        '''
+        Find the ARN of the OpsWorks service role. The configured role name is
+        looked up directly; if it is not there the roles are paged through at
+        full page size looking for that name or, failing that, a role trusted
+        by the OpsWorks service. The answer is kept in the local cache.
+
+        Args:
+            None
+
+        Returns:
+            the role ARN or None
+        '''
+        key = 'role:{}:{}'.format(self._profile or 'default', self._role_name)
+        cache = DiskCache('roles', ttl=self._cache_ttl)
+        if not self._refresh:
+            role_arn = cache.get(key)
+            if role_arn:
+                logger.info('using cached role: {}'.format(role_arn))
+                return role_arn
+
         try:
             iam_client = utility.get_api_client(
                 self._profile,
@@ -258,26 +406,69 @@ class OpsworksCreator:
                 'iam'
             )
 
-            response = iam_client.list_roles(MaxItems=5)
-            while response:
-                for role in response['Roles']:
-                    if role['RoleName'] == 'opsworks_basic_vpc_execution':
-                        logger.info('found role: {}'.format(role['Arn']))
-                        return role['Arn']
-
-                if response['IsTruncated']:
-                    response = iam_client.list_roles(
-                        MaxItems=5,
-                        Marker=response['Marker']
-                    )
-                else:
-                    response = None
+            role_arn = None
+            try:
+                response = iam_client.get_role(RoleName=self._role_name)
+                role_arn = response['Role']['Arn']
+            except iam_client.exceptions.NoSuchEntityException:
+                logger.info('role {} not found, searching by trust policy'.format(self._role_name))
+                role_arn = self._search_opsworks_role(iam_client)
+
+            if role_arn:
+                logger.info('found role: {}'.format(role_arn))
+                cache.put(key, role_arn)
+                return role_arn
         except Exception as wtf:
             logger.error('Exception caught in create_opsworks(): {}'.format(wtf))
             traceback.print_exc(file=sys.stdout)
 
         return None
 
+    def _search_opsworks_role(self, iam_client):
+        candidate = None
+        paginator = iam_client.get_paginator('list_roles')
+        for page in paginator.paginate(PaginationConfig={'PageSize': ROLE_PAGE_SIZE}):
+            for role in page['Roles']:
+                if role['RoleName'] == self._role_name:
+                    return role['Arn']
+
+                if candidate is None and self._trusts_opsworks(role):
+                    logger.info('found candidate role: {}'.format(role['Arn']))
+                    candidate = role['Arn']
+
+        return candidate
+
+    def _trusts_opsworks(self, role):
+        document = role.get('AssumeRolePolicyDocument', {})
+        if not isinstance(document, dict):
+            try:
+                document = json.loads(unquote(document))
+            except Exception:
+                return False
+
+        statements = document.get('Statement', [])
+        if isinstance(statements, dict):
+            statements = [statements]
+
+        for statement in statements:
+            if statement.get('Effect') != 'Allow':
+                continue
+
+            # a Principal of "*" trusts everyone; such a role is not picked
+            # as the OpsWorks role
+            principal = statement.get('Principal', {})
+            if not isinstance(principal, dict):
+                continue
+
+            services = principal.get('Service', [])
+            if not isinstance(services, list):
+                services = [services]
+
+            if OPSWORKS_SERVICE_PRINCIPAL in services:
+                return True
+
+        return False
+
     def _find_default_security_group(self, vpc_id):
         try:
             ec2_client = utility.get_api_client(
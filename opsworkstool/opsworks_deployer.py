@@ -6,9 +6,11 @@ import git
 import sys
 import uuid
 import json
-import boto3
-import shutil
-import zipfile
+import hashlib
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
 from configparser import RawConfigParser
 
 try:
@@ -17,16 +19,28 @@ except:
     from pip._internal import main as pipmain
 
 from configparser import ConfigParser
+from opsworkstool import utility
+from opsworkstool.bundle import BundleBuilder
+from opsworkstool.bundle import read_bundle_settings
+from opsworkstool.bundle import DEFAULT_WORKERS as DEFAULT_BUNDLE_WORKERS
+from opsworkstool.change_set import ChangeSetDeployer
+from opsworkstool.deploy_state import DeployState
+from opsworkstool.file_index import FileIndex
+from opsworkstool.file_index import INDEX_FILE
+from opsworkstool.profiler import DeployProfiler
+from opsworkstool.profiler import profiled
+from opsworkstool.stack_poller import StackPoller
 from opsworkstool.stack_tool import StackTool
 from opsworkstool.template_creator import TemplateCreator
+from opsworkstool.template_validator import TemplateValidator
+from opsworkstool.transfer import PackageUploader
+from opsworkstool.transfer import read_transfer_settings
+from opsworkstool.transfer import TRANSFER_SECTION
+from opsworkstool.vendor import BerkshelfVendor
+from opsworkstool.vendor import merge_vendored
+from opsworkstool.vendor import read_vendor_settings
 from stackility import CloudStackUtility
 
-try:
-    import zlib #noqa
-    compression = zipfile.ZIP_DEFLATED
-except:
-    compression = zipfile.ZIP_STORED
-
 logging.basicConfig(level=logging.INFO,
                     format='[%(levelname)s] %(asctime)s (%(module)s) %(message)s',
                     datefmt='%Y/%m/%d-%H:%M:%S')
@@ -44,10 +58,21 @@ PIP_ARGS = [
     '.'
 ]
 
-ZIP_MODES = {
-    zipfile.ZIP_DEFLATED: 'deflated',
-    zipfile.ZIP_STORED:   'stored'
-}
+DEFAULT_STAGE_WORKERS = 4
+# stackility keeps its tags and parameters on the class, so two upserts in
+# flight at once would share them; every upsert in the process takes this
+STACKILITY_LOCK = threading.Lock()
+WORKER_LOG_FORMAT = '[%(levelname)s] %(asctime)s (%(module)s) [%(threadName)s] %(message)s'
+
+
+def label_log_lines():
+    """
+    Stage and project workers are named after what they deploy; put that
+    name on every log line so the interleaved output of concurrent deploys
+    can be told apart.
+    """
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(WORKER_LOG_FORMAT, datefmt='%Y/%m/%d-%H:%M:%S'))
 
 
 class OpsworksDeployer:
@@ -72,6 +97,26 @@ class OpsworksDeployer:
     _stage = None
     cwd = None
     recipe_url = None
+    _content_digest = False
+    _package_reused = False
+    _transfer_overrides = None
+    _transfer_settings = None
+    _bundle_overrides = None
+    _stages = None
+    _all_stages = False
+    _workers = DEFAULT_STAGE_WORKERS
+    _template_model = None
+    _change_set = False
+    _incremental = False
+    _deploy_state = None
+    _stack_status = None
+    _profiler = None
+    _profile_deploy = False
+    _profile_output = None
+    _recipe_index = None
+    _vendor_cookbooks = False
+    _vendor_directory = None
+    _vendor_digest = None
 
     def __init__(self, config_block):
         """
@@ -103,6 +148,28 @@ class OpsworksDeployer:
             self.debug = config_block['debug']
             self._stage = config_block['stage']
             self.cwd = config_block['cwd']
+            self._content_digest = config_block.get('content_digest', False)
+            self._transfer_overrides = config_block.get('transfer', {})
+            self._bundle_overrides = config_block.get('bundle', {})
+            self._stages = config_block.get('stages', None)
+            self._all_stages = config_block.get('all_stages', False)
+            self._workers = config_block.get('workers', DEFAULT_STAGE_WORKERS)
+            self._change_set = config_block.get('change_set', False)
+            self._incremental = config_block.get('incremental', False)
+            # both only pay off when an unchanged recipe/ keeps the same
+            # bundle key and so the same recipes3url
+            if self._incremental or self._change_set:
+                self._content_digest = True
+            self._deploy_state = DeployState(self.cwd)
+            self._vendor_cookbooks = config_block.get('vendor_cookbooks', False)
+            self._profile_deploy = config_block.get('profile_deploy', False)
+            self._profile_output = config_block.get('profile_output', None)
+            if self._profile_deploy or self._profile_output:
+                self._profiler = DeployProfiler()
+            self._publish_lock = threading.Lock()
+            self._zip_lock = threading.Lock()
+            self._bucket_locks = {}
+            self._published = {}
 
         else:
             logging.error('config block was garbage')
@@ -138,6 +205,34 @@ class OpsworksDeployer:
                 logging.error('failed to read config/config.ini file, exiting'.format(DEFAULT_MODULE_FILE))
                 return False
 
+            if self.resolve_stages():
+                logging.info('deploying stage(s): {}'.format(', '.join(self._stages)))
+            else:
+                logging.error('failed to resolve stages, exiting')
+                return False
+
+            if self.validate_template():
+                logging.info('validate_template() found no problems in {}'.format(DEFAULT_MODULE_FILE))
+            else:
+                logging.error('validate_template() found problems in {}, exiting'.format(DEFAULT_MODULE_FILE))
+                return False
+
+            if self.read_transfer_info():
+                logging.info('transfer settings: {}'.format(json.dumps(self._transfer_settings)))
+                if self._profiler:
+                    for client in (self._s3_client, self._cf_client, self._ssm_client):
+                        self._profiler.watch(client)
+            else:
+                logging.error('failed to read transfer settings, exiting')
+                return False
+
+            if self._vendor_cookbooks:
+                if self.vendor_cookbooks():
+                    logging.info('vendor_cookbooks() vendored into {}'.format(self._vendor_directory))
+                else:
+                    logging.error('vendor_cookbooks() failed, exiting')
+                    return False
+
             if self.set_hash():
                 logging.info('deploying version/commit {} of {}'.format(self._hash, self._opsworks_name))
             else:
@@ -152,49 +247,301 @@ class OpsworksDeployer:
 
             logging.info('working directory: '+str(self._work_directory))
 
-            if self.copy_stuff():
-                logging.info('copy_stuff() to scratch directory successful')
-                os.chdir(self._work_directory)
+            if self.set_package_key():
+                logging.info('package key: {}'.format(self._package_key))
             else:
-                logging.error('copy_stuff() to scratch directory failed')
+                logging.error('failed to set package_key')
                 return False
 
-            if self.create_zip():
-                logging.info('create_zip() created {}'.format(self._package_name))
+            if self.make_work_directory():
+                logging.info('make_work_directory() created {}'.format(self._work_directory))
             else:
-                logging.info('create_zip() failed to create {}'.format(self._package_name))
+                logging.error('make_work_directory() failed')
                 return False
 
-            if self.upload_package():
-                logging.info('upload_package() uploaded {}'.format(self._package_name))
-            else:
-                logging.info('upload_package() failed to upload {}'.format(self._package_name))
-                return False
+            return self.deploy_stages()
+        except Exception as x:
+            logging.error('Exception caught in deploy_lambda(): {}'.format(x))
+            traceback.print_exc(file=sys.stdout)
+            return False
+        finally:
+            self.report_profile()
 
-            if self.create_tag_file():
-                logging.info('create_tag_file() created')
-            else:
-                logging.info('create_tag_file() failed')
-                return False
+    def report_profile(self):
+        """
+        Print and/or write the deploy profile if one was asked for.
+        """
+        if self._profiler is None:
+            return
 
-            if self.create_stack_properties():
-                logging.info('create_stack_properties() created')
-            else:
-                logging.info('create_stack_properties() failed')
-                return False
+        if self._profile_deploy:
+            self._profiler.print_table()
 
-            if self.create_stack():
-                logging.info('create_stack() created')
-            else:
-                logging.info('create_stack() failed')
-                return False
+        if self._profile_output:
+            self._profiler.write(self._profile_output)
+
+    @profiled('validate_template')
+    def validate_template(self):
+        """
+        Check template.json offline against each stage being deployed so
+        mistakes show up before anything is zipped, uploaded or sent to
+        CloudFormation.
+
+        Args:
+            None
+
+        Returns:
+            True if the template is good for every stage, otherwise False
+        """
+        validator = TemplateValidator(os.path.join(self.cwd, DEFAULT_MODULE_FILE))
+        answer = True
+        for stage in self._stages:
+            if not validator.validate(self._ini_data[stage]):
+                logging.error('template is not valid for stage {}'.format(stage))
+                answer = False
+                if validator.model is None:
+                    break
+
+        self._template_model = validator.model
+        return answer
+
+    @profiled('vendor_cookbooks')
+    def vendor_cookbooks(self):
+        """
+        Vendor the dependencies in recipe/Berksfile so they ship in the
+        bundle. Unchanged dependency sets come straight from the local cache.
+
+        Args:
+            None
 
+        Returns:
+            True if the dependencies are vendored or there are none
+        """
+        vendor = BerkshelfVendor(
+            os.path.join(self.cwd, 'recipe'),
+            **read_vendor_settings(self._ini_data)
+        )
+        if not vendor.has_dependencies():
+            logging.warning('recipe/Berksfile not found, nothing to vendor')
             return True
+
+        self._vendor_directory = vendor.vendor()
+        if self._vendor_directory is None:
+            return False
+
+        self._vendor_digest = vendor.key
+        if self._profiler:
+            self._profiler.count('vendor_cache_hits', 1 if vendor.cache_hit else 0)
+        return True
+
+    @profiled('resolve_stages')
+    def resolve_stages(self):
+        """
+        Work out which config.ini stages to deploy. With --all-stages every
+        section that names a bucket is a stage.
+
+        Args:
+            None
+
+        Returns:
+            True if every requested stage is in config/config.ini
+        """
+        if self._all_stages:
+            stages = sorted(
+                section for section in self._ini_data
+                if 'bucket' in self._ini_data[section]
+            )
+        elif self._stages:
+            stages = list(self._stages)
+        else:
+            stages = [self._stage]
+
+        missing = [stage for stage in stages if stage not in self._ini_data]
+        if missing:
+            logging.error('stage(s) {} not found in config/config.ini'.format(', '.join(missing)))
+            return False
+
+        if not stages:
+            logging.error('no stages found in config/config.ini')
+            return False
+
+        self._stages = stages
+        return True
+
+    def deploy_stages(self):
+        """
+        Deploy every resolved stage. The bundle is built once; the stacks are
+        upserted and polled concurrently with a bounded pool of workers.
+
+        Args:
+            None
+
+        Returns:
+            True if every stage deployed, otherwise False
+        """
+        if len(self._stages) == 1:
+            return self.deploy_stage(self._stages[0])
+
+        label_log_lines()
+        results = {}
+        workers = max(1, min(self._workers, len(self._stages)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = dict(
+                (pool.submit(self.deploy_stage, stage), stage) for stage in self._stages
+            )
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+
+        print('\nDeployment summary:')
+        for stage in self._stages:
+            print('\t{}\t{}-opsworks-{}\t{}'.format(
+                stage,
+                stage,
+                self._opsworks_name,
+                'succeeded' if results[stage] else 'FAILED'
+            ))
+
+        return all(results.values())
+
+    def deploy_stage(self, stage):
+        """
+        Deploy a single stage. Each stage works on its own shallow copy of the
+        deployer so the per-stage state does not leak between workers.
+
+        Args:
+            stage - the config.ini section to deploy
+
+        Returns:
+            True if the stage deployed, otherwise False
+        """
+        try:
+            stage_tool = copy.copy(self)
+            stage_tool._stage = stage
+            if len(self._stages) > 1:
+                threading.current_thread().name = stage
+                stage_tool._work_directory = os.path.join(self._work_directory, stage)
+                if not stage_tool.make_work_directory():
+                    return False
+
+            return stage_tool._deploy_current_stage()
         except Exception as x:
-            logging.error('Exception caught in deploy_lambda(): {}'.format(x))
+            logging.error('Exception caught in deploy_stage({}): {}'.format(stage, x))
             traceback.print_exc(file=sys.stdout)
             return False
 
+    def _deploy_current_stage(self):
+        inputs = self.stage_inputs()
+        if self._incremental and self._deploy_state.unchanged(self._stage, inputs):
+            entry = self._deploy_state.get(self._stage)
+            self.recipe_url = entry.get('recipe_url', None)
+            logging.info('stage {} is unchanged since {}, skipping'.format(self._stage, entry.get('updated')))
+            return True
+
+        if self.publish_package():
+            logging.info('publish_package() published {}'.format(self.recipe_url))
+            self._deploy_state.record(
+                self._stage,
+                bundle_key=self._package_key,
+                recipe_url=self.recipe_url
+            )
+        else:
+            logging.error('publish_package() failed')
+            return False
+
+        if self.create_tag_file():
+            logging.info('create_tag_file() created')
+        else:
+            logging.info('create_tag_file() failed')
+            return False
+
+        if self.create_stack_properties():
+            logging.info('create_stack_properties() created')
+        else:
+            logging.info('create_stack_properties() failed')
+            return False
+
+        answer = self.create_stack()
+        self._deploy_state.record(
+            self._stage,
+            inputs=inputs,
+            stack_name='{}-opsworks-{}'.format(self._stage, self._opsworks_name),
+            stack_status=self._stack_status
+        )
+        if answer:
+            logging.info('create_stack() created')
+        else:
+            logging.info('create_stack() failed')
+            return False
+
+        return True
+
+    def stage_inputs(self):
+        """
+        Everything the current stage's deploy depends on. The recipe url
+        handed to the stack is made from the bucket and the bundle key so it
+        is covered too.
+
+        Args:
+            None
+
+        Returns:
+            dictionary of digests and settings for the deploy state
+        """
+        stage_settings = json.dumps(self._ini_data[self._stage], sort_keys=True)
+        return {
+            'bundle_digest': self._hash,
+            'bundle_key': self._package_key,
+            'bucket': self._ini_data[self._stage].get('bucket', None),
+            'template_digest': self._template_model.digest(),
+            'parameter_digest': hashlib.sha256(stage_settings.encode('utf-8')).hexdigest(),
+            'profile': self._profile,
+            'region': self._region
+        }
+
+    @profiled('publish_package', per_stage=True, fan_out=True)
+    def publish_package(self):
+        """
+        Make sure the bundle is in the current stage's bucket. The zip is
+        built at most once and each bucket is uploaded to at most once, no
+        matter how many stages share it. Stages with different buckets upload
+        at the same time.
+
+        Args:
+            None
+
+        Returns:
+            True if recipe_url points at the bundle, otherwise False
+        """
+        bucket = self._ini_data.get(self._stage, {}).get('bucket', None)
+        with self._publish_lock:
+            bucket_lock = self._bucket_locks.setdefault(bucket, threading.Lock())
+
+        with bucket_lock:
+            if bucket in self._published:
+                self.recipe_url = self._published[bucket]
+                return True
+
+            if self._content_digest and self.find_existing_package():
+                logging.info('recipe bundle {} unchanged, skipping zip and upload'.format(self.recipe_url))
+            else:
+                with self._zip_lock:
+                    if not os.path.isfile(self._package_name):
+                        if self.create_zip():
+                            logging.info('create_zip() created {}'.format(self._package_name))
+                        else:
+                            logging.info('create_zip() failed to create {}'.format(self._package_name))
+                            return False
+
+                if self.upload_package():
+                    logging.info('upload_package() uploaded {}'.format(self._package_name))
+                else:
+                    logging.info('upload_package() failed to upload {}'.format(self._package_name))
+                    return False
+
+            self._published[bucket] = self.recipe_url
+            return True
+
+    @profiled('create_stack', per_stage=True)
     def create_stack(self):
         try:
             ini_data = {}
@@ -219,16 +566,32 @@ class OpsworksDeployer:
                 ini_data['environment']['profile'] = self._profile
 
             ini_data['tags'] = {'tool': 'opsworkstool'}
-            ini_data['parameters'] = self._stack_properties
+            ini_data['parameters'] = dict(self._stack_properties)
             ini_data['yaml'] = True
 
-            stack_driver = CloudStackUtility(ini_data)
-            if stack_driver.upsert():
+            if self._change_set:
+                return self.deploy_change_set(stack_name, ini_data['tags'])
+
+            poller = StackPoller(self._cf_client, stack_name)
+            poller.mark()
+
+            with STACKILITY_LOCK:
+                stack_driver = CloudStackUtility(ini_data)
+                stack_driver._tags = []
+                stack_driver._parameters = {}
+                started = stack_driver.upsert()
+
+            if started:
                 logging.info('stack create/update was started successfully.')
-                if stack_driver.poll_stack():
+                answer = poller.poll()
+                self._stack_status = poller.stack_status
+                if self._profiler:
+                    self._profiler.count('poll_seconds', round(poller.poll_seconds, 3))
+                if answer:
                     logging.info('stack create/update was finished successfully.')
                     st = StackTool(
                         stack_name,
+                        self._stage,
                         self._profile,
                         self._region,
                         self._cf_client,
@@ -246,8 +609,53 @@ class OpsworksDeployer:
             traceback.print_exc(file=sys.stdout)
             return False
 
+    def deploy_change_set(self, stack_name, tags):
+        """
+        Deploy the stage's stack through a change set. Nothing is sent to
+        CloudFormation beyond a describe_stacks when the deployed stack
+        already matches the template and parameters.
+
+        Args:
+            stack_name - the stack to create/update
+            tags - stack tags
+
+        Returns:
+            True if the stack is current, otherwise False
+        """
+        deployer = ChangeSetDeployer(
+            self._cf_client,
+            stack_name,
+            self._template_model,
+            self._stack_properties,
+            tags=tags,
+            code_version=self._hash,
+            s3_client=self._s3_client,
+            bucket=self._ini_data[self._stage]['bucket'],
+            ssm_client=self._ssm_client
+        )
+        answer = deployer.deploy()
+        self._stack_status = deployer.stack_status
+        if not answer:
+            logging.error('change set deploy of {} did not go well.'.format(stack_name))
+            return False
+
+        if deployer.skipped:
+            logging.info('stack {} is already up to date.'.format(stack_name))
+            return True
 
+        logging.info('stack create/update was finished successfully.')
+        st = StackTool(
+            stack_name,
+            self._stage,
+            self._profile,
+            self._region,
+            self._cf_client,
+        )
+        st.print_stack_info()
+        return True
 
+
+    @profiled('create_stack_properties', per_stage=True)
     def create_stack_properties(self):
         try:
 
@@ -263,12 +671,12 @@ class OpsworksDeployer:
 
                 wrk[str(item)]= data[str(item)]
 
-            if not wrk['bucket']:
-                print('You need to have a bucket parameter in the config ini file so we can upload the template so S3')
-                sys.exit(1)
-            if not wrk['recipes3url']:
-                print('You need to have a parameter named recipes3url so the cloudformation template can pull down the receipe from S3.')
-                sys.exit(1)
+            if not wrk.get('bucket'):
+                logging.error('You need to have a bucket parameter in the config ini file so we can upload the template so S3')
+                return False
+            if not wrk.get('recipes3url'):
+                logging.error('You need to have a parameter named recipes3url so the cloudformation template can pull down the receipe from S3.')
+                return False
             else:
                 # Set the property
                 wrk['recipes3url'] = self.recipe_url
@@ -282,6 +690,7 @@ class OpsworksDeployer:
             traceback.print_exc(file=sys.stdout)
             return False
 
+    @profiled('create_tag_file', per_stage=True)
     def create_tag_file(self):
         try:
             self._tag_file = '{}/tag.properties'.format(
@@ -304,16 +713,51 @@ class OpsworksDeployer:
             traceback.print_exc(file=sys.stdout)
             return False
 
-    def upload_package(self):
+    @profiled('set_package_key')
+    def set_package_key(self):
         try:
-            self._package_key = 'recipe-code/{}/{}.zip'.format(
-                self._lambda_name,
-                self._hash
-            )
-            logging.info('package key: {}'.format(self._package_key))
+            if self._opsworks_name and self._hash:
+                self._package_key = 'recipe-code/{}/{}.zip'.format(
+                    self._opsworks_name,
+                    self._hash
+                )
+                return True
+            else:
+                return False
+        except Exception:
+            return False
+
+    def find_existing_package(self):
+        """
+        Check whether the bundle for the current content digest has already
+        been uploaded to the stage bucket.
+
+        Args:
+            None
+
+        Returns:
+            True if the package key already exists in the bucket and can be
+            reused, otherwise False
+        """
+        bucket = self._ini_data.get(self._stage, {}).get('bucket', None)
+        if not bucket or not self._s3_client:
+            return False
+
+        try:
+            self._s3_client.head_object(Bucket=bucket, Key=self._package_key)
+        except Exception as wtf:
+            logging.info('s3://{}/{} not found: {}'.format(bucket, self._package_key, wtf))
+            return False
+
+        self.recipe_url = str('s3://'+str(bucket)+'/'+str(self._package_key))
+        self._package_reused = True
+        return True
 
+    @profiled('upload_package', per_stage=True, fan_out=True)
+    def upload_package(self):
+        try:
             if not self._region:
-                self._region = boto3.session.Session().region_name
+                self._region = utility.get_session(self._profile, None).region_name
 
             if self.debug:
                 print('ini data: '+str(self._ini_data))
@@ -329,8 +773,11 @@ class OpsworksDeployer:
                 return False
 
             if bucket:
-                with open(self._package_name, 'rb') as the_package:
-                    self._s3_client.upload_fileobj(the_package, bucket, self._package_key)
+                uploader = PackageUploader(self._s3_client, **self._transfer_settings)
+                if not uploader.upload(self._package_name, bucket, self._package_key):
+                    return False
+                if self._profiler:
+                    self._profiler.count('bytes_uploaded', os.path.getsize(self._package_name))
             else:
                 logging.error('S3 bucket not found in config/config.ini')
                 return False
@@ -343,55 +790,34 @@ class OpsworksDeployer:
 
 
 
-    def copy_stuff(self):
+    @profiled('make_work_directory')
+    def make_work_directory(self):
         try:
-
-
-            if self.debug:
-                print('woring directory: '+str(self._work_directory))
-
-            cwd = os.getcwd()
-
-            if self.debug:
-                print('cwd: '+str(cwd))
-
-            root_src_dir = os.path.join(cwd, 'recipe')
-            root_target_dir = os.path.join('.', self._work_directory)
-
-            operation = 'copy'  # 'copy' or 'move'
-
-            for src_dir, dirs, files in os.walk(root_src_dir):
-                dst_dir = src_dir.replace(root_src_dir, root_target_dir)
-                if not os.path.exists(dst_dir):
-                    os.mkdir(dst_dir)
-                for file_ in files:
-                    src_file = os.path.join(src_dir, file_)
-                    dst_file = os.path.join(dst_dir, file_)
-                    if os.path.exists(dst_file):
-                        os.remove(dst_file)
-                    if operation is 'copy':
-                        shutil.copy(src_file, dst_dir)
-                    elif operation is 'move':
-                        shutil.move(src_file, dst_dir)
-
-
-            for file_ in os.listdir(self._work_directory):
-                print(file_)
-
+            if not os.path.isdir(self._work_directory):
+                os.makedirs(self._work_directory)
 
             return True
         except Exception as miserable_failure:
-            logging.error('Exception caught in make_work_dir(): {}'.format(miserable_failure))
+            logging.error('Exception caught in make_work_directory(): {}'.format(miserable_failure))
             traceback.print_exc(file=sys.stdout)
             return False
 
+    @profiled('set_hash', fan_out=True)
     def set_hash(self):
+        if self._content_digest:
+            digest = self.compute_recipe_digest()
+            if not digest:
+                return False
+
+            self._hash = digest
+            return True
+
         random_bits = []
         random_bits.append((str(uuid.uuid4()))[:8])
         random_bits.append((str(uuid.uuid4()))[:8])
 
         try:
-            repo = git.Repo(search_parent_directories=False)
+            repo = git.Repo(self.cwd, search_parent_directories=False)
             hash = repo.head.object.hexsha
             hash = hash[:8]
         except Exception:
@@ -400,20 +826,83 @@ class OpsworksDeployer:
         self._hash = '{}-{}'.format(hash, random_bits[0])
         return True
 
+    def compute_recipe_digest(self):
+        """
+        Compute a digest of everything under the recipe directory. The relative
+        path of each file is folded into the digest along with its content hash
+        so renames and moves produce a new bundle key. Only files that changed
+        since the last deploy are read, see recipe_index().
+
+        Args:
+            None
+
+        Returns:
+            the first sixteen hex digits of the sha256 digest or None if
+            things went sideways
+        """
+        try:
+            index = self.recipe_index()
+            digest = index.digest()
+            index.save()
+            if self._vendor_digest:
+                digest = hashlib.sha256(
+                    '{}:{}'.format(digest, self._vendor_digest).encode('utf-8')
+                ).hexdigest()
+
+            if self._profiler:
+                self._profiler.count('files_indexed', len(index.files()))
+                self._profiler.count('files_hashed', index.files_hashed)
+            logging.info('{} of {} recipe files hashed, {} directories listed'.format(
+                index.files_hashed,
+                len(index.files()),
+                index.directories_listed
+            ))
+            return digest[:16]
+        except Exception as x:
+            logging.error('Exception caught in compute_recipe_digest(): {}'.format(x))
+            traceback.print_exc(file=sys.stdout)
+            return None
+
+    def recipe_index(self):
+        """
+        The index of the recipe tree, refreshed once per deploy. It is kept
+        in .opsworkstool-index.json when --content-digest (or a mode that
+        turns it on) is used, otherwise it only lives for this deploy.
+
+        Args:
+            None
+
+        Returns:
+            a refreshed FileIndex
+        """
+        if self._recipe_index is None:
+            settings = read_bundle_settings(self._ini_data, self._bundle_overrides)
+            index_file = None
+            if self._content_digest:
+                index_file = os.path.join(self.cwd, INDEX_FILE)
+
+            self._recipe_index = FileIndex(
+                os.path.join(self.cwd, 'recipe'),
+                index_file,
+                workers=settings.get('workers', DEFAULT_BUNDLE_WORKERS)
+            ).refresh()
+
+        return self._recipe_index
+
     def verify_opsworks_directory(self):
-        return os.path.isfile(DEFAULT_MODULE_FILE)
+        return os.path.isfile(os.path.join(self.cwd, DEFAULT_MODULE_FILE))
 
+    @profiled('find_opsworks_name')
     def find_opsworks_name(self):
         opsworkstool = '.opsworkstool'
         opsworks_name = None
         try:
-            with open(opsworkstool, 'r') as j:
+            with open(os.path.join(self.cwd, opsworkstool), 'r') as j:
                 stuff = json.load(j)
                 lambda_name = stuff['name']
 
             if not opsworks_name:
-                cwd = os.getcwd()
-                dirs = cwd.split('/')
+                dirs = os.path.abspath(self.cwd).split('/')
                 opsworks_name = dirs[-1]
 
             logging.info('opsworks_name: {}'.format(opsworks_name))
@@ -444,19 +933,7 @@ class OpsworksDeployer:
             traceback.print_exc(file=sys.stdout)
             return x.returncode, None, None
 
-    def find_data(self, the_dir):
-        tree = []
-        package_file_name = (self._package_name.split('/'))[-1]
-        try:
-            for folder, subs, files in os.walk(the_dir):
-                for file in files:
-                    if file != package_file_name:
-                        tree.append('{}/{}'.format(folder, file))
-        except Exception:
-            pass
-
-        return tree
-
+    @profiled('set_package_name')
     def set_package_name(self):
         try:
             if self._work_directory and self._hash:
@@ -470,29 +947,35 @@ class OpsworksDeployer:
         except Exception:
             return False
 
+    @profiled('create_zip', per_stage=True, fan_out=True)
     def create_zip(self):
-        zf = None
         try:
-            logging.info('adding files with compression mode={}'.format(ZIP_MODES[compression]))
-            zf = zipfile.ZipFile(self._package_name, mode='w')
-
-            for f in self.find_data('.'):
-                zf.write(f, compress_type=compression)
-
+            builder = BundleBuilder(**read_bundle_settings(self._ini_data, self._bundle_overrides))
+            files = self.recipe_index().files()
+            if self._vendor_directory:
+                files = merge_vendored(files, builder.find_files(self._vendor_directory))
+
+            builder.build(
+                os.path.join(self.cwd, 'recipe'),
+                self._package_name,
+                files=files
+            )
+            self.recipe_index().save()
+            logging.info('added {} files, {} bytes'.format(builder.file_count, builder.bytes_read))
+            if self._profiler:
+                self._profiler.count('files_zipped', builder.file_count)
+                self._profiler.count('bytes_zipped', builder.bytes_read)
+                self._profiler.count('bundle_bytes', os.path.getsize(self._package_name))
             return True
         except Exception as x:
             logging.error('Exception caught in create_zip(): {}'.format(x))
             traceback.print_exc(file=sys.stdout)
             return False
-        finally:
-            try:
-                zf.close()
-            except Exception:
-                pass
 
+    @profiled('read_config_info')
     def read_config_info(self):
         try:
-            ini_file = 'config/config.ini'
+            ini_file = os.path.join(self.cwd, 'config', 'config.ini')
             config = ConfigParser()
             config.read(ini_file)
             the_stuff = {}
@@ -508,6 +991,44 @@ class OpsworksDeployer:
             traceback.print_exc(file=sys.stdout)
             return None
 
+    @profiled('read_transfer_info')
+    def read_transfer_info(self):
+        """
+        Work out the S3 transfer settings from the [transfer] section of
+        config/config.ini and the command line. A endpoint_url in that section
+        points the S3 client at a local stand-in.
+
+        Args:
+            None
+
+        Returns:
+            Good or Bad; True or False
+        """
+        try:
+            self._transfer_settings = read_transfer_settings(
+                self._ini_data,
+                self._transfer_overrides
+            )
+
+            endpoint_url = self._ini_data.get(TRANSFER_SECTION, {}).get('endpoint_url', None)
+            if endpoint_url:
+                logging.info('using S3 endpoint {}'.format(endpoint_url))
+
+            if endpoint_url or self._transfer_settings['max_concurrency'] > utility.DEFAULT_MAX_POOL_CONNECTIONS:
+                self._s3_client = utility.get_api_client(
+                    self._profile,
+                    self._region,
+                    's3',
+                    endpoint_url=endpoint_url,
+                    max_pool_connections=self._transfer_settings['max_concurrency']
+                )
+
+            return True
+        except Exception as wtf:
+            logging.error('Exception caught in read_transfer_info(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+            return False
+
     def _init_boto3_clients(self):
         """
         The utililty requires boto3 clients to SSM, Cloud Formation and S3. Here is
@@ -521,14 +1042,9 @@ class OpsworksDeployer:
         """
 
         try:
-            if self._profile:
-                self._b3Sess = boto3.session.Session(profile_name=self._profile)
-            else:
-                self._b3Sess = boto3.session.Session()
-
-            self._s3_client = self._b3Sess.client('s3')
-            self._cf_client = self._b3Sess.client('cloudformation', region_name=self._region)
-            self._ssm_client = self._b3Sess.client('ssm', region_name=self._region)
+            self._s3_client = utility.get_api_client(self._profile, self._region, 's3')
+            self._cf_client = utility.get_api_client(self._profile, self._region, 'cloudformation')
+            self._ssm_client = utility.get_api_client(self._profile, self._region, 'ssm')
 
             return True
         except Exception as wtf:
@@ -0,0 +1,226 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+thread_time = getattr(time, 'thread_time', time.process_time)
+
+MEGABYTE = 1024 * 1024
+
+# (profiler, step entry) of the step running in this thread, or in the thread
+# that handed work to a pool through bind()
+_current_step = contextvars.ContextVar('opsworkstool_profiler_step', default=None)
+
+
+def bind(function):
+    """
+    Carry the step running on this thread over to whichever pool thread ends
+    up running function, so the counters and API calls made there are
+    charged to the same step. Without a profiled step it is a no-op.
+
+    Args:
+        function - what is about to be handed to a pool
+
+    Returns:
+        a callable that runs function under the caller's step
+    """
+    current = _current_step.get()
+    if current is None:
+        return function
+
+    @functools.wraps(function)
+    def bound(*args, **kwargs):
+        token = _current_step.set(current)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _current_step.reset(token)
+    return bound
+
+
+class DeployProfiler(object):
+    """
+    Timing and counters for the steps of a deploy. Each step records its
+    wall clock and CPU seconds; while a step runs, counters (files zipped,
+    bytes uploaded, poll seconds...) and the AWS API calls made from the
+    same thread, or from pool threads given work through bind(), are
+    charged to it. Steps that run once per stage are kept apart by stage.
+
+    CPU seconds are the thread's own, except for steps that fan out to a
+    pool, which are charged process CPU so their workers are included.
+    """
+
+    def __init__(self):
+        """
+        DeployProfiler init method.
+
+        Args:
+            None
+
+        Returns:
+           not a damn thing
+        """
+        self._lock = threading.Lock()
+        self._clients = set()
+        self.steps = OrderedDict()
+        self.started = time.time()
+
+    def _entry(self, step, stage):
+        key = (step, stage)
+        with self._lock:
+            entry = self.steps.get(key, None)
+            if entry is None:
+                entry = OrderedDict([
+                    ('step', step),
+                    ('stage', stage),
+                    ('seconds', 0.0),
+                    ('cpu_seconds', 0.0),
+                    ('api_calls', OrderedDict())
+                ])
+                self.steps[key] = entry
+            return entry
+
+    def _current(self):
+        current = _current_step.get()
+        if current is None or current[0] is not self:
+            return None
+        return current[1]
+
+    def start(self, step, stage=None, fan_out=False):
+        entry = self._entry(step, stage)
+        token = _current_step.set((self, entry))
+        clock = time.process_time if fan_out else thread_time
+        return time.time(), clock, clock(), token
+
+    def stop(self, started):
+        wall, clock, cpu, token = started
+        entry = _current_step.get()[1]
+        _current_step.reset(token)
+        with self._lock:
+            entry['seconds'] += time.time() - wall
+            entry['cpu_seconds'] += clock() - cpu
+
+    def count(self, counter, amount=1):
+        """
+        Add to a counter of the step running on this thread.
+
+        Args:
+            counter - e.g. 'bytes_zipped'
+            amount - how much to add
+
+        Returns:
+            not a damn thing
+        """
+        entry = self._current()
+        if entry is None:
+            return
+
+        with self._lock:
+            entry[counter] = entry.get(counter, 0) + amount
+
+    def watch(self, client):
+        """
+        Count the API calls a boto3 client makes. Clients without an event
+        system, e.g. local stand-ins, are ignored.
+        """
+        events = getattr(getattr(client, 'meta', None), 'events', None)
+        if events is None or id(client) in self._clients:
+            return
+
+        self._clients.add(id(client))
+        events.register(
+            'before-call.*.*',
+            self._count_api_call,
+            unique_id='opsworkstool-profiler-{}'.format(id(self))
+        )
+
+    def _count_api_call(self, model, **kwargs):
+        entry = self._current()
+        if entry is None:
+            return
+
+        name = '{}.{}'.format(model.service_model.service_name, model.name)
+        with self._lock:
+            entry['api_calls'][name] = entry['api_calls'].get(name, 0) + 1
+
+    def report(self):
+        """
+        Returns:
+            dictionary with the total seconds and one row per step
+        """
+        rows = []
+        with self._lock:
+            for entry in self.steps.values():
+                row = OrderedDict(entry)
+                row['seconds'] = round(row['seconds'], 3)
+                row['cpu_seconds'] = round(row['cpu_seconds'], 3)
+                row['api_calls'] = OrderedDict(sorted(entry['api_calls'].items()))
+                if row.get('bytes_uploaded') and row['seconds']:
+                    row['upload_mb_per_second'] = round(row['bytes_uploaded'] / MEGABYTE / row['seconds'], 2)
+                rows.append(row)
+
+        return OrderedDict([
+            ('seconds', round(time.time() - self.started, 3)),
+            ('steps', rows)
+        ])
+
+    def to_json(self):
+        return json.dumps(self.report(), indent=2)
+
+    def write(self, file_name):
+        try:
+            with open(file_name, 'w') as f:
+                f.write(self.to_json())
+            logging.info('deploy profile written to {}'.format(file_name))
+            return True
+        except Exception as wtf:
+            logging.error('Exception caught in write(): {}'.format(wtf))
+            return False
+
+    def print_table(self):
+        report = self.report()
+        print('\nDeploy profile ({} seconds):'.format(report['seconds']))
+        print('\t{:<24}{:<10}{:>9}{:>9}{:>7}  {}'.format('step', 'stage', 'seconds', 'cpu', 'calls', 'counters'))
+        for row in report['steps']:
+            counters = ', '.join(
+                '{}={}'.format(k, v) for k, v in row.items()
+                if k not in ('step', 'stage', 'seconds', 'cpu_seconds', 'api_calls')
+            )
+            print('\t{:<24}{:<10}{:>9.3f}{:>9.3f}{:>7}  {}'.format(
+                row['step'],
+                row['stage'] or '',
+                row['seconds'],
+                row['cpu_seconds'],
+                sum(row['api_calls'].values()),
+                counters
+            ))
+        print('')
+
+
+def profiled(step, per_stage=False, fan_out=False):
+    """
+    Time a deployer method as a step of the deploy profile. The deployer
+    needs a _profiler attribute; when it is None the method runs as is.
+
+    Args:
+        step - name of the step in the report
+        per_stage - keep the step apart for every stage
+        fan_out - the step hands work to a pool, charge it process CPU
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = getattr(self, '_profiler', None)
+            if profiler is None:
+                return method(self, *args, **kwargs)
+
+            started = profiler.start(step, self._stage if per_stage else None, fan_out)
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                profiler.stop(started)
+        return wrapper
+    return decorator
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import sys
+import time
+import traceback
+
+from opsworkstool import aio
+
+STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+SUCCESS_STATES = (
+    'CREATE_COMPLETE',
+    'UPDATE_COMPLETE',
+    'IMPORT_COMPLETE'
+)
+MINIMUM_DELAY = 2.0
+MAXIMUM_DELAY = 30.0
+BACKOFF_FACTOR = 1.5
+DEFAULT_TIMEOUT = 3 * 60 * 60
+
+
+class StackPoller(object):
+    """
+    Follow a CloudFormation stack operation by tailing its events. Only the
+    events newer than the last one seen are fetched, each new event is
+    written to the console as it arrives, and the delay between polls grows
+    while the stack is quiet and snaps back when something happens.
+    """
+    _cf_client = None
+    _stack_name = None
+    _last_event_id = None
+    _minimum_delay = MINIMUM_DELAY
+    _maximum_delay = MAXIMUM_DELAY
+    _backoff_factor = BACKOFF_FACTOR
+    _timeout = DEFAULT_TIMEOUT
+
+    def __init__(self, cf_client, stack_name, **kwargs):
+        """
+        StackPoller init method.
+
+        Args:
+            cf_client - a boto3 CloudFormation client
+            stack_name - name of the stack of interest
+            minimum_delay - seconds between polls while events are flowing
+            maximum_delay - upper bound on the delay while the stack is quiet
+            backoff_factor - how fast the delay grows on a quiet poll
+            timeout - give up after this many seconds
+
+        Returns:
+           not a damn thing
+        """
+        self._cf_client = cf_client
+        self._stack_name = stack_name
+        self._minimum_delay = kwargs.get('minimum_delay', MINIMUM_DELAY)
+        self._maximum_delay = kwargs.get('maximum_delay', MAXIMUM_DELAY)
+        self._backoff_factor = kwargs.get('backoff_factor', BACKOFF_FACTOR)
+        self._timeout = kwargs.get('timeout', DEFAULT_TIMEOUT)
+        self.stack_status = None
+        self.poll_seconds = 0.0
+
+    def mark(self):
+        """
+        Remember the newest existing event so that only events caused by the
+        coming stack operation are reported. Call this before starting it.
+
+        Args:
+            None
+
+        Returns:
+            the id of the newest event or None if the stack does not exist
+        """
+        try:
+            response = self._cf_client.describe_stack_events(StackName=self._stack_name)
+            events = response.get('StackEvents', [])
+            if events:
+                self._last_event_id = events[0]['EventId']
+        except Exception as wtf:
+            logging.info('no existing events for {}: {}'.format(self._stack_name, wtf))
+            self._last_event_id = None
+
+        return self._last_event_id
+
+    def poll(self):
+        """
+        Spin until the stack operation either fails or succeeds.
+
+        Args:
+            None
+
+        Returns:
+            Good or bad; True or False
+        """
+        return aio.run(self.poll_async())
+
+    async def poll_async(self):
+        """
+        poll() as a coroutine, so several stacks can be followed from one
+        event loop.
+        """
+        started = time.time()
+        delay = self._minimum_delay
+        logging.info('following events of {}'.format(self._stack_name))
+        try:
+            while True:
+                await asyncio.sleep(delay)
+                events = await aio.call(self._new_events)
+                for event in events:
+                    self._report(event)
+
+                if self.stack_status and self._is_finished(self.stack_status):
+                    logging.info('{} finished with {}'.format(self._stack_name, self.stack_status))
+                    return self.stack_status in SUCCESS_STATES
+
+                if time.time() - started > self._timeout:
+                    logging.error('gave up waiting on {} after {} seconds'.format(
+                        self._stack_name,
+                        self._timeout
+                    ))
+                    return False
+
+                if events:
+                    delay = self._minimum_delay
+                else:
+                    delay = min(delay * self._backoff_factor, self._maximum_delay)
+        except Exception as wtf:
+            logging.error('Exception caught in poll(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+            return False
+        finally:
+            self.poll_seconds = time.time() - started
+
+    def _new_events(self):
+        """
+        Page back through the stack events until the last one seen.
+
+        Returns:
+            the unseen events, oldest first
+        """
+        fresh = []
+        kwargs = {'StackName': self._stack_name}
+        while True:
+            response = self._cf_client.describe_stack_events(**kwargs)
+            caught_up = False
+            for event in response.get('StackEvents', []):
+                if event['EventId'] == self._last_event_id:
+                    caught_up = True
+                    break
+                fresh.append(event)
+
+            next_token = response.get('NextToken', None)
+            if caught_up or not next_token:
+                break
+            kwargs['NextToken'] = next_token
+
+        if fresh:
+            self._last_event_id = fresh[0]['EventId']
+
+        fresh.reverse()
+        return fresh
+
+    def _report(self, event):
+        logging.info('{}\t{}\t{}\t{}\t{}'.format(
+            event.get('Timestamp', ''),
+            event.get('ResourceStatus', ''),
+            event.get('ResourceType', ''),
+            event.get('LogicalResourceId', ''),
+            event.get('ResourceStatusReason', '')
+        ))
+
+        if event.get('ResourceType') == STACK_RESOURCE_TYPE and \
+                event.get('LogicalResourceId') == self._stack_name:
+            self.stack_status = event.get('ResourceStatus')
+
+    def _is_finished(self, status):
+        return status.endswith('_COMPLETE') or status.endswith('_FAILED')
@@ -7,6 +7,8 @@ except ImportError:
     from io import StringIO
 
 from opsworkstool.parts import get_the_api_chunk
+from opsworkstool.parts import get_the_api_fragment
+from opsworkstool.template_model import TemplateModel
 
 from opsworkstool.cf_import_things import role_parameter_section
 from opsworkstool.cf_import_things import parameter_role_spec
@@ -20,10 +22,21 @@ from opsworkstool.cf_import_things import subnets_parameter_section
 from opsworkstool.cf_import_things import subnets_parameter_spec
 from opsworkstool.cf_import_things import imported_subnets_spec
 
+from opsworkstool.cf_import_things import role_parameter_fragment
+from opsworkstool.cf_import_things import subnets_parameter_fragment
+from opsworkstool.cf_import_things import sg_parameter_fragment
+from opsworkstool.cf_import_things import imported_value
+from opsworkstool.cf_import_things import imported_values
+
 import traceback
 import os
 import sys
 import logging
+import hashlib
+import threading
+from collections import OrderedDict
+import asyncio
+from opsworkstool import aio
 
 
 snsTopicARN = 'snstopicarn'
@@ -32,6 +45,76 @@ schedule = 'scheduleexpression'
 service = 'service'
 new_line = '\n'
 spacer = '          '
+MODEL_TEMPLATE_EXTENSIONS = ('.json', '.yaml', '.yml')
+
+environment_header = """      Environment:
+        Variables:
+"""
+SSM_BATCH_SIZE = 10
+SSM_WORKERS = 4
+TEMPLATE_CACHE_SIZE = 32
+MODULE_CACHE_SIZE = 128
+
+_template_cache = OrderedDict()
+_template_cache_lock = threading.Lock()
+
+
+def get_compiled_template(template_file, module_directory=None):
+    """
+    Get a compiled Mako template, compiling it only the first time a given
+    version of the file is seen. Templates are kept in memory keyed by path
+    and content digest with least recently used eviction; when a module
+    directory is given the compiled module is also kept on disk, named after
+    the digest, so other processes can skip compilation too.
+
+    Args:
+        template_file - the Mako template
+        module_directory - optional directory for compiled modules
+
+    Returns:
+        a mako.template.Template
+    """
+    with open(template_file, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+
+    key = (os.path.abspath(template_file), digest, module_directory)
+    with _template_cache_lock:
+        t = _template_cache.get(key, None)
+        if t is not None:
+            _template_cache.move_to_end(key)
+            return t
+
+    if module_directory:
+        if not os.path.isdir(module_directory):
+            os.makedirs(module_directory)
+        t = Template(
+            filename=template_file,
+            module_filename=os.path.join(module_directory, '{}.py'.format(digest))
+        )
+        _prune_module_directory(module_directory)
+    else:
+        t = Template(filename=template_file)
+
+    with _template_cache_lock:
+        _template_cache[key] = t
+        while len(_template_cache) > TEMPLATE_CACHE_SIZE:
+            _template_cache.popitem(last=False)
+
+    return t
+
+
+def _prune_module_directory(module_directory):
+    try:
+        modules = [
+            os.path.join(module_directory, name)
+            for name in os.listdir(module_directory)
+            if name.endswith('.py')
+        ]
+        modules.sort(key=os.path.getmtime)
+        for module in modules[:-MODULE_CACHE_SIZE]:
+            os.remove(module)
+    except Exception as wtf:
+        logging.warning('could not prune {}: {}'.format(module_directory, wtf))
 
 sns_topic_arn = """  snsTopicARN:
     Description: the ARN of the topic to which we are subscribing
@@ -102,6 +185,89 @@ schedule_resource = """  LambdaSchedule:
       Principal: events.amazonaws.com""".format(rule_id)
 
 
+sns_topic_arn_fragment = {
+    'Parameters': {
+        'snsTopicARN': {
+            'Description': 'the ARN of the topic to which we are subscribing',
+            'Type': 'String'
+        }
+    },
+    'Resources': {
+        'TopicSubscription': {
+            'Type': 'AWS::SNS::Subscription',
+            'DependsOn': 'LambdaFunction',
+            'Properties': {
+                'Endpoint': {'Fn::GetAtt': ['LambdaFunction', 'Arn']},
+                'Protocol': 'lambda',
+                'TopicArn': {'Ref': 'snsTopicARN'}
+            }
+        },
+        'TopicPermission': {
+            'Type': 'AWS::Lambda::Permission',
+            'DependsOn': 'TopicSubscription',
+            'Properties': {
+                'FunctionName': {'Fn::GetAtt': ['LambdaFunction', 'Arn']},
+                'Action': 'lambda:InvokeFunction',
+                'Principal': 'sns.amazonaws.com'
+            }
+        }
+    }
+}
+
+trusted_service_fragment = {
+    'Parameters': {
+        'trustedService': {
+            'Description': 'service which this lambda trusts',
+            'Type': 'String'
+        }
+    },
+    'Resources': {
+        'TrustedService': {
+            'Type': 'AWS::Lambda::Permission',
+            'DependsOn': 'LambdaFunction',
+            'Properties': {
+                'FunctionName': {'Fn::GetAtt': ['LambdaFunction', 'Arn']},
+                'Action': 'lambda:InvokeFunction',
+                'Principal': {'Ref': 'trustedService'}
+            }
+        }
+    }
+}
+
+schedule_fragment = {
+    'Parameters': {
+        'scheduleExpression': {
+            'Description': 'rate or cron expression for a scheduled  lambda',
+            'Type': 'String'
+        }
+    },
+    'Resources': {
+        'LambdaSchedule': {
+            'Type': 'AWS::Events::Rule',
+            'DependsOn': 'LambdaFunction',
+            'Properties': {
+                'Description': 'String',
+                'ScheduleExpression': {'Ref': 'scheduleExpression'},
+                'State': 'ENABLED',
+                'Targets': [{
+                    'Arn': {'Fn::GetAtt': ['LambdaFunction', 'Arn']},
+                    'Id': rule_id
+                }]
+            }
+        },
+        'EventPermission': {
+            'Type': 'AWS::Lambda::Permission',
+            'DependsOn': 'LambdaFunction',
+            'Properties': {
+                'FunctionName': {'Fn::GetAtt': ['LambdaFunction', 'Arn']},
+                'Action': 'lambda:InvokeFunction',
+                'Principal': 'events.amazonaws.com'
+            }
+        }
+    }
+}
+
+
 class TemplateCreator:
     _stack_properties = None
     _input_file = None
@@ -116,15 +282,29 @@ class TemplateCreator:
     _import_role = False
     _import_subnets = False
     _import_security_group = False
+    _module_directory = None
     SSM = '[ssm:'
     IMPORT = '[import:'
 
-    _food = """      Environment:
-        Variables:
-"""
-
     def __init__(self, ssm_client):
         self._ssm_client = ssm_client
+        self._ssm_cache = {}
+        self._reset_render_state()
+
+    def _reset_render_state(self):
+        """
+        Everything a render accumulates lives on the instance and starts
+        fresh each time, so repeated renders neither leak into each other
+        nor grow memory.
+        """
+        self._environment_lines = [environment_header]
+        self._sns_topic_arn_found = False
+        self._trusted_service_found = False
+        self._schedule_found = False
+        self._create_service = False
+        self._import_role = False
+        self._import_subnets = False
+        self._import_security_group = False
 
     def _prop_to_yaml(self, thing):
         idx = thing.find('=')
@@ -137,16 +317,35 @@ class TemplateCreator:
 
         return None, None
 
+    def _read_properties(self):
+        """
+        Read the function properties, resolving any SSM references.
+
+        Returns:
+            list of (key, value) tuples
+        """
+        with open(self._input_file, 'r') as infile:
+            things = [thing.strip() for thing in infile]
+
+        self._resolve_ssm_parameters(
+            [self._ssm_name(thing[(thing.find('=')+1):].strip()) for thing in things]
+        )
+
+        properties = []
+        for thing in things:
+            key, val = self._prop_to_yaml(thing)
+            if key and val:
+                properties.append((key, val))
+
+        return properties
+
     def _inject_stuff(self):
         try:
-            with open(self._input_file, 'r') as infile:
-                for thing in infile:
-                    key, val = self._prop_to_yaml(thing.strip())
-                    if key and val:
-                        self._food += spacer + key + ': ' + val + '\n'
+            for key, val in self._read_properties():
+                self._environment_lines.append(spacer + key + ': ' + val + '\n')
 
             buf = StringIO()
-            t = Template(filename=self._template_file)
+            t = get_compiled_template(self._template_file, self._module_directory)
 
             if self._sns_topic_arn_found:
                 sns_var_bits = sns_topic_arn
@@ -189,43 +388,33 @@ class TemplateCreator:
                 current_role_parameter_section = role_parameter_section
                 role_specification = parameter_role_spec
 
-            subnet_specification = None
             if self._import_subnets:
                 current_subnets_parameter_section = ''
                 subnets = self._find_imported_csv(
                     self._stack_properties.get('subnetIds', None)
                 )
-                for subnet in subnets.split(','):
-                    if subnet_specification:
-                        subnet_specification = subnet_specification + \
-                            '\n' + spacer + \
-                            imported_subnets_spec.format(subnet)
-                    else:
-                        subnet_specification = imported_subnets_spec.format(subnet)
+                subnet_specification = ('\n' + spacer).join(
+                    imported_subnets_spec.format(subnet) for subnet in subnets.split(',')
+                )
             else:
                 current_subnets_parameter_section = subnets_parameter_section
                 subnet_specification = subnets_parameter_spec
 
-            sg_specification = None
             if self._import_security_group:
                 current_sg_parameter_section = ''
                 sg_csv = self._find_imported_csv(
                     self._stack_properties.get('securityGroupIds', None)
                 )
-                for sg in sg_csv.split(','):
-                    if sg_specification:
-                        sg_specification = sg_specification + \
-                            '\n' + spacer + \
-                            imported_sg_spec.format(sg)
-                    else:
-                        sg_specification = imported_sg_spec.format(sg)
+                sg_specification = ('\n' + spacer).join(
+                    imported_sg_spec.format(sg) for sg in sg_csv.split(',')
+                )
             else:
                 current_sg_parameter_section = sg_parameter_section
                 sg_specification = sg_parameter_spec
 
             ctx = Context(
                 buf,
-                environment_section=self._food,
+                environment_section=''.join(self._environment_lines),
                 snsTopicARN=sns_var_bits,
                 snsSubscriptionResource=sns_resource_bits,
                 trustedService=trusted_service_var_bits,
@@ -251,6 +440,75 @@ class TemplateCreator:
             traceback.print_exc(file=sys.stdout)
             sys.exit(1)
 
+    def _render_model(self):
+        """
+        Render a JSON or YAML template through TemplateModel: the optional
+        pieces are merged in as dictionaries and the result is serialized
+        once, with no text splicing.
+        """
+        try:
+            model = TemplateModel.from_file(self._template_file)
+
+            if self._sns_topic_arn_found:
+                model.merge(sns_topic_arn_fragment)
+
+            if self._trusted_service_found:
+                model.merge(trusted_service_fragment)
+
+            if self._schedule_found:
+                model.merge(schedule_fragment)
+
+            if self._create_service:
+                model.merge(get_the_api_fragment(
+                    region=self._region,
+                    stage_name=self._stage_name,
+                    short_name=self._short_name,
+                    account=self._account
+                ))
+
+            if self._import_role:
+                model.remove_parameter('role')
+                model.replace_ref('role', imported_value(
+                    self._find_imported_csv(self._stack_properties.get('role', None))
+                ))
+            elif 'role' not in model.parameters:
+                model.merge(role_parameter_fragment)
+
+            if self._import_subnets:
+                model.remove_parameter('subnetIds')
+                model.replace_ref('subnetIds', imported_values(
+                    self._find_imported_csv(self._stack_properties.get('subnetIds', None)).split(',')
+                ))
+            elif 'subnetIds' not in model.parameters:
+                model.merge(subnets_parameter_fragment)
+
+            if self._import_security_group:
+                model.remove_parameter('securityGroupIds')
+                model.replace_ref('securityGroupIds', imported_values(
+                    self._find_imported_csv(self._stack_properties.get('securityGroupIds', None)).split(',')
+                ))
+            elif 'securityGroupIds' not in model.parameters:
+                model.merge(sg_parameter_fragment)
+
+            variables = OrderedDict(self._read_properties())
+            if variables:
+                for resource in model.resources.values():
+                    if resource.type == 'AWS::Lambda::Function':
+                        resource.properties.setdefault('Environment', {})['Variables'] = variables
+
+            logging.info('writing template {}'.format(self._output_file))
+            with open(self._output_file, 'w') as outfile:
+                if self._output_file.endswith('.json'):
+                    outfile.write(model.to_json())
+                else:
+                    outfile.write(model.to_yaml())
+
+            self.model = model
+        except Exception as wtf:
+            logging.error('Exception caught in render_model(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+            sys.exit(1)
+
     def _read_stack_properties(self):
         try:
             lowered_stack_properties = {}
@@ -299,14 +557,84 @@ class TemplateCreator:
             self._stage_name = kwargs['stage_name']
             self._short_name = kwargs['short_name']
             self._account = kwargs['account']
+            self._module_directory = kwargs.get('module_directory', None)
 
+            self._reset_render_state()
             self._read_stack_properties()
-            self._inject_stuff()
+            if self._template_file.endswith(MODEL_TEMPLATE_EXTENSIONS):
+                self._render_model()
+            else:
+                self._inject_stuff()
             return True
         except Exception as wtf:
             logging.error(wtf)
             return False
 
+    def _ssm_name(self, p):
+        """
+        Pull the parameter name out of a [ssm:name] reference.
+
+        Args:
+            p - a property value
+        Returns:
+            the parameter name or None if p is not an SSM reference
+        """
+        if p.startswith(self.SSM) and p.endswith(']'):
+            parts = p.split(':')
+            return parts[1].replace(']', '')
+
+        return None
+
+    def _resolve_ssm_parameters(self, names):
+        """
+        Fetch the given parameters from Simple Systems Manager in batches of
+        SSM_BATCH_SIZE, with the batches sent in parallel. Values land in the
+        memo cache; names that are already cached are not fetched again.
+        Args:
+            names - parameter names, None entries are ignored
+        Returns:
+            the memo cache
+        """
+        wanted = []
+        for name in names:
+            if name and name not in self._ssm_cache and name not in wanted:
+                wanted.append(name)
+
+        if not wanted:
+            return self._ssm_cache
+
+        batches = [
+            wanted[i:i + SSM_BATCH_SIZE] for i in range(0, len(wanted), SSM_BATCH_SIZE)
+        ]
+        for answer in aio.run(self._fetch_ssm_batches(batches)):
+            self._ssm_cache.update(answer)
+
+        return self._ssm_cache
+
+    async def _fetch_ssm_batches(self, batches):
+        ssm = aio.AsyncClient(self._ssm_client)
+        limit = asyncio.Semaphore(SSM_WORKERS)
+
+        async def fetch(batch):
+            async with limit:
+                return await self._fetch_ssm_batch(ssm, batch)
+
+        return await asyncio.gather(*[fetch(batch) for batch in batches])
+
+    async def _fetch_ssm_batch(self, ssm, batch):
+        answer = dict((name, None) for name in batch)
+        try:
+            response = await ssm.get_parameters(Names=batch, WithDecryption=True)
+            for parameter in response.get('Parameters', []):
+                answer[parameter['Name']] = parameter.get('Value', None)
+
+            for name in response.get('InvalidParameters', []):
+                logging.error('SSM parameter {} not found'.format(name))
+        except Exception as wtf:
+            logging.error('Exception caught in _fetch_ssm_batch({}): {}'.format(batch, wtf))
+
+        return answer
+
     def _get_ssm_parameter(self, p):
         """
         Get parameters from Simple Systems Manager
@@ -316,32 +644,14 @@ class TemplateCreator:
             a value, decrypted if needed, if successful or None if things go
             sideways.
         """
-        val = None
-        secure_string = False
-        try:
-            if p.startswith(self.SSM) and p.endswith(']'):
-                parts = p.split(':')
-                p = parts[1].replace(']', '')
-            else:
-                return p
-
-            response = self._ssm_client.describe_parameters(
-                Filters=[{'Key': 'Name', 'Values': [p]}]
-            )
+        name = self._ssm_name(p)
+        if name is None:
+            return p
 
-            if 'Parameters' in response:
-                t = response['Parameters'][0].get('Type', None)
-                if t == 'String':
-                    secure_string = False
-                elif t == 'SecureString':
-                    secure_string = True
-
-                response = self._ssm_client.get_parameter(Name=p, WithDecryption=secure_string)
-                val = response.get('Parameter', {}).get('Value', None)
-        except Exception as wtf:
-            logging.error('Exception caught in _get_ssm_parameter({}): {}'.format(p, wtf))
+        if name not in self._ssm_cache:
+            self._resolve_ssm_parameters([name])
 
-        return val
+        return self._ssm_cache.get(name, None)
 
     def _find_imported_csv(self, raw_str):
         answer = None
@@ -0,0 +1,323 @@
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+
+import yaml
+
+SECTION_ORDER = (
+    'AWSTemplateFormatVersion',
+    'Description',
+    'Metadata',
+    'Parameters',
+    'Mappings',
+    'Conditions',
+    'Transform',
+    'Resources',
+    'Outputs'
+)
+
+
+class Parameter(object):
+    """
+    A CloudFormation template parameter.
+    """
+    def __init__(self, name, type='String', description=None, default=None, **extra):
+        self.name = name
+        self.type = type
+        self.description = description
+        self.default = default
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, name, data):
+        data = dict(data)
+        return cls(
+            name,
+            type=data.pop('Type', 'String'),
+            description=data.pop('Description', None),
+            default=data.pop('Default', None),
+            **data
+        )
+
+    def to_dict(self):
+        answer = OrderedDict()
+        if self.description is not None:
+            answer['Description'] = self.description
+        answer['Type'] = self.type
+        if self.default is not None:
+            answer['Default'] = self.default
+        answer.update(self.extra)
+        return answer
+
+
+class Resource(object):
+    """
+    A CloudFormation template resource.
+    """
+    def __init__(self, name, type, properties=None, depends_on=None, **extra):
+        self.name = name
+        self.type = type
+        self.properties = properties if properties is not None else OrderedDict()
+        self.depends_on = depends_on
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, name, data):
+        data = dict(data)
+        return cls(
+            name,
+            data.pop('Type'),
+            properties=data.pop('Properties', None),
+            depends_on=data.pop('DependsOn', None),
+            **data
+        )
+
+    def to_dict(self):
+        answer = OrderedDict()
+        answer['Type'] = self.type
+        if self.depends_on:
+            answer['DependsOn'] = self.depends_on
+        if self.properties:
+            answer['Properties'] = self.properties
+        answer.update(self.extra)
+        return answer
+
+
+class Output(object):
+    """
+    A CloudFormation template output.
+    """
+    def __init__(self, name, value, description=None, export=None, **extra):
+        self.name = name
+        self.value = value
+        self.description = description
+        self.export = export
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, name, data):
+        data = dict(data)
+        return cls(
+            name,
+            data.pop('Value'),
+            description=data.pop('Description', None),
+            export=data.pop('Export', None),
+            **data
+        )
+
+    def to_dict(self):
+        answer = OrderedDict()
+        if self.description is not None:
+            answer['Description'] = self.description
+        answer['Value'] = self.value
+        if self.export is not None:
+            answer['Export'] = self.export
+        answer.update(self.extra)
+        return answer
+
+
+SECTION_TYPES = OrderedDict([
+    ('Parameters', Parameter),
+    ('Resources', Resource),
+    ('Outputs', Output)
+])
+
+
+class TemplateModel(object):
+    """
+    An in-memory CloudFormation template. Fragments are merged in as plain
+    dictionaries and the whole thing is serialized once, to JSON or YAML,
+    when it is written out.
+    """
+    def __init__(self):
+        self.parameters = OrderedDict()
+        self.resources = OrderedDict()
+        self.outputs = OrderedDict()
+        self.other = OrderedDict()
+
+    def _section(self, name):
+        return {
+            'Parameters': self.parameters,
+            'Resources': self.resources,
+            'Outputs': self.outputs
+        }[name]
+
+    @classmethod
+    def from_dict(cls, data):
+        model = cls()
+        model.merge(data)
+        return model
+
+    @classmethod
+    def from_file(cls, file_name):
+        """
+        Load a template from a JSON or YAML file. JSON errors carry the line
+        and column of the problem.
+        """
+        with open(file_name, 'r') as f:
+            body = f.read()
+
+        if file_name.endswith('.json'):
+            data = json.loads(body, object_pairs_hook=OrderedDict)
+        else:
+            data = yaml.load(body, Loader=CloudFormationLoader)
+
+        if not isinstance(data, dict):
+            raise ValueError('{} does not hold a template'.format(file_name))
+
+        return cls.from_dict(data)
+
+    def add_parameter(self, parameter):
+        self._add('Parameters', parameter)
+        return parameter
+
+    def add_resource(self, resource):
+        self._add('Resources', resource)
+        return resource
+
+    def add_output(self, output):
+        self._add('Outputs', output)
+        return output
+
+    def _add(self, section_name, item):
+        section = self._section(section_name)
+        existing = section.get(item.name, None)
+        if existing is not None and existing.to_dict() != item.to_dict():
+            raise ValueError('{} {} is already defined differently'.format(section_name, item.name))
+        section[item.name] = item
+
+    def merge(self, fragment):
+        """
+        Merge a template fragment, a dictionary laid out like a template.
+
+        Args:
+            fragment - e.g. {'Parameters': {...}, 'Resources': {...}}
+
+        Returns:
+            the model, for chaining
+
+        Raises:
+            ValueError - if the fragment redefines something differently
+        """
+        for section_name, value in fragment.items():
+            item_type = SECTION_TYPES.get(section_name, None)
+            if item_type is None:
+                if isinstance(value, dict) and isinstance(self.other.get(section_name, None), dict):
+                    self.other[section_name].update(copy.deepcopy(value))
+                else:
+                    self.other[section_name] = copy.deepcopy(value)
+                continue
+
+            for name, data in (value or {}).items():
+                self._add(section_name, item_type.from_dict(name, copy.deepcopy(data)))
+
+        return self
+
+    def remove_parameter(self, name):
+        return self.parameters.pop(name, None)
+
+    def replace_ref(self, name, replacement):
+        """
+        Swap every {'Ref': name} in the resources and outputs for the given
+        replacement, e.g. an Fn::ImportValue.
+        """
+        def walk(thing):
+            if isinstance(thing, dict):
+                if len(thing) == 1 and thing.get('Ref', None) == name:
+                    return copy.deepcopy(replacement)
+                return type(thing)((k, walk(v)) for k, v in thing.items())
+            if isinstance(thing, list):
+                return [walk(v) for v in thing]
+            return thing
+
+        for resource in self.resources.values():
+            resource.properties = walk(resource.properties)
+        for output in self.outputs.values():
+            output.value = walk(output.value)
+
+    def to_dict(self):
+        answer = OrderedDict()
+        sections = dict(self.other)
+        for name in SECTION_TYPES:
+            items = self._section(name)
+            if items:
+                sections[name] = OrderedDict((k, v.to_dict()) for k, v in items.items())
+
+        for name in SECTION_ORDER:
+            if name in sections:
+                answer[name] = sections.pop(name)
+        answer.update(sections)
+        return answer
+
+    def to_json(self, indent=2):
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def to_yaml(self):
+        return yaml.dump(_plain(self.to_dict()), default_flow_style=False, sort_keys=False)
+
+    def digest(self):
+        """
+        A digest of the template content that does not depend on key order
+        or formatting.
+        """
+        canonical = json.dumps(self.to_dict(), sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def diff(self, other):
+        """
+        Compare with another model section by section.
+
+        Returns:
+            dictionary of section: {'added': [...], 'removed': [...],
+            'changed': [...]} for the sections that differ
+        """
+        answer = OrderedDict()
+        mine = self.to_dict()
+        theirs = other.to_dict()
+        for section_name in SECTION_TYPES:
+            a = mine.get(section_name, {})
+            b = theirs.get(section_name, {})
+            change = OrderedDict([
+                ('added', sorted(k for k in a if k not in b)),
+                ('removed', sorted(k for k in b if k not in a)),
+                ('changed', sorted(k for k in a if k in b and a[k] != b[k]))
+            ])
+            if any(change.values()):
+                answer[section_name] = change
+
+        return answer
+
+
+def _plain(thing):
+    if isinstance(thing, dict):
+        return dict((k, _plain(v)) for k, v in thing.items())
+    if isinstance(thing, list):
+        return [_plain(v) for v in thing]
+    return thing
+
+
+class CloudFormationLoader(yaml.SafeLoader):
+    """
+    A YAML loader that understands the CloudFormation short form tags,
+    turning !Ref x into {'Ref': x} and !Sub ... into {'Fn::Sub': ...}.
+    """
+    pass
+
+
+def _short_form(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    if tag_suffix == 'Ref':
+        return {'Ref': value}
+    if tag_suffix == 'GetAtt' and isinstance(value, str):
+        value = value.split('.', 1)
+    return {'Fn::{}'.format(tag_suffix): value}
+
+
+CloudFormationLoader.add_multi_constructor('!', _short_form)
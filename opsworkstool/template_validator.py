@@ -0,0 +1,159 @@
+import json
+import logging
+import re
+
+import yaml
+
+from opsworkstool.template_model import TemplateModel
+
+PSEUDO_PARAMETERS = (
+    'AWS::AccountId',
+    'AWS::NotificationARNs',
+    'AWS::NoValue',
+    'AWS::Partition',
+    'AWS::Region',
+    'AWS::StackId',
+    'AWS::StackName',
+    'AWS::URLSuffix'
+)
+DEPLOYER_SETTINGS = ('bucket',)
+SUB_VARIABLE = re.compile(r'\$\{([^!][^}]*)\}')
+
+
+class TemplateValidator(object):
+    """
+    Offline checks on a CloudFormation template, run before anything is
+    zipped, uploaded or sent to AWS:
+
+        * the template parses
+        * there is at least one resource and every resource has a Type
+        * Ref, Fn::GetAtt, Fn::Sub and DependsOn point at things that exist
+        * every parameter without a Default is given in the stage section
+          of config/config.ini
+    """
+    _template_file = None
+
+    def __init__(self, template_file):
+        """
+        TemplateValidator init method.
+
+        Args:
+            template_file - the JSON or YAML template to check
+
+        Returns:
+           not a damn thing
+        """
+        self._template_file = template_file
+        self.model = None
+        self.errors = []
+        self.warnings = []
+
+    def validate(self, stage_parameters=None):
+        """
+        Check the template, and the stage parameters against it.
+
+        Args:
+            stage_parameters - the config.ini section for the stage, or None
+                               to skip the parameter checks
+
+        Returns:
+            True if no errors were found, otherwise False
+        """
+        self.errors = []
+        self.warnings = []
+        if self.model is None and not self._load():
+            return False
+
+        self._check_resources()
+        self._check_references()
+        if stage_parameters is not None:
+            self._check_parameters(stage_parameters)
+
+        for warning in self.warnings:
+            logging.warning('{}: {}'.format(self._template_file, warning))
+        for error in self.errors:
+            logging.error('{}: {}'.format(self._template_file, error))
+
+        return not self.errors
+
+    def _load(self):
+        try:
+            self.model = TemplateModel.from_file(self._template_file)
+            return True
+        except ValueError as wtf:
+            if isinstance(wtf, json.JSONDecodeError):
+                self.errors.append('invalid JSON at line {} column {}: {}'.format(
+                    wtf.lineno,
+                    wtf.colno,
+                    wtf.msg
+                ))
+            else:
+                self.errors.append(str(wtf))
+        except yaml.YAMLError as wtf:
+            self.errors.append('invalid YAML: {}'.format(wtf))
+        except (IOError, OSError) as wtf:
+            self.errors.append('could not read template: {}'.format(wtf))
+        except KeyError as wtf:
+            self.errors.append('missing required key {}'.format(wtf))
+
+        for error in self.errors:
+            logging.error('{}: {}'.format(self._template_file, error))
+        return False
+
+    def _check_resources(self):
+        if not self.model.resources:
+            self.errors.append('template has no Resources')
+
+        for name, resource in self.model.resources.items():
+            if not isinstance(resource.type, str) or '::' not in resource.type:
+                self.errors.append('resource {} has a bad Type: {}'.format(name, resource.type))
+
+            depends_on = resource.depends_on or []
+            if not isinstance(depends_on, list):
+                depends_on = [depends_on]
+            for target in depends_on:
+                if target not in self.model.resources:
+                    self.errors.append('resource {} depends on unknown resource {}'.format(name, target))
+
+    def _check_references(self):
+        known = set(self.model.parameters) | set(self.model.resources) | set(PSEUDO_PARAMETERS)
+
+        def walk(thing, where):
+            if isinstance(thing, dict):
+                for key, value in thing.items():
+                    if key == 'Ref' and isinstance(value, str) and value not in known:
+                        self.errors.append('{} refers to unknown {}'.format(where, value))
+                    elif key == 'Fn::GetAtt':
+                        target = value.split('.', 1)[0] if isinstance(value, str) else value[0]
+                        if target not in self.model.resources:
+                            self.errors.append('{} gets an attribute of unknown resource {}'.format(where, target))
+                    elif key == 'Fn::Sub':
+                        template = value if isinstance(value, str) else value[0]
+                        local = set(value[1]) if isinstance(value, list) and len(value) > 1 else set()
+                        for variable in SUB_VARIABLE.findall(template):
+                            variable = variable.split('.', 1)[0]
+                            if variable not in known and variable not in local:
+                                self.errors.append('{} substitutes unknown {}'.format(where, variable))
+                    walk(value, where)
+            elif isinstance(thing, list):
+                for value in thing:
+                    walk(value, where)
+
+        for name, resource in self.model.resources.items():
+            walk(resource.properties, 'resource {}'.format(name))
+        for name, output in self.model.outputs.items():
+            walk(output.value, 'output {}'.format(name))
+        walk(self.model.other.get('Conditions', {}), 'Conditions')
+
+    def _check_parameters(self, stage_parameters):
+        # config.ini keys come back lower case from ConfigParser
+        given = dict((key.lower(), value) for key, value in stage_parameters.items())
+        declared = set(name.lower() for name in self.model.parameters)
+
+        for name, parameter in self.model.parameters.items():
+            if parameter.default is None and name.lower() not in given:
+                self.errors.append('parameter {} has no Default and is not set in the stage config'.format(name))
+
+        for key in given:
+            if key not in declared and key not in DEPLOYER_SETTINGS:
+                self.warnings.append('stage setting {} is not a template parameter'.format(key))
@@ -0,0 +1,267 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+import traceback
+
+from opsworkstool import aio
+
+MEGABYTE = 1024 * 1024
+MINIMUM_PART_SIZE = 5 * MEGABYTE
+DEFAULT_PART_SIZE = 8 * MEGABYTE
+DEFAULT_MULTIPART_THRESHOLD = 16 * MEGABYTE
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_ATTEMPTS = 3
+RETRY_DELAY = 1.0
+
+TRANSFER_SECTION = 'transfer'
+
+
+def read_transfer_settings(ini_data, overrides=None):
+    """
+    Build the transfer settings from the [transfer] section of config.ini and
+    any command line overrides. Sizes are given in megabytes.
+
+    Args:
+        ini_data - the dictionary made from config/config.ini
+        overrides - dictionary of command line values, None means not given
+
+    Returns:
+        a dictionary suitable for PackageUploader(**settings)
+    """
+    section = (ini_data or {}).get(TRANSFER_SECTION, {})
+    overrides = overrides or {}
+
+    def pick(name, default):
+        value = overrides.get(name, None)
+        if value is None:
+            value = section.get(name, None)
+        if value is None or value == '':
+            return default
+        return value
+
+    return {
+        'part_size': int(float(pick('part_size_mb', DEFAULT_PART_SIZE / MEGABYTE)) * MEGABYTE),
+        'multipart_threshold': int(float(pick('multipart_threshold_mb', DEFAULT_MULTIPART_THRESHOLD / MEGABYTE)) * MEGABYTE),
+        'max_concurrency': int(pick('max_concurrency', DEFAULT_MAX_CONCURRENCY)),
+        'max_attempts': int(pick('max_attempts', DEFAULT_MAX_ATTEMPTS))
+    }
+
+
+class PackageUploader(object):
+    """
+    Upload a package to S3, splitting large files into parts that are sent
+    in parallel. A failed part is retried on its own; the whole upload is
+    only abandoned when a part runs out of attempts.
+
+    Parts are sent from an event loop onto the shared pool of aio, so they
+    count against the global limit on AWS calls in flight as well as
+    max_concurrency.
+    """
+    _s3_client = None
+    _part_size = DEFAULT_PART_SIZE
+    _multipart_threshold = DEFAULT_MULTIPART_THRESHOLD
+    _max_concurrency = DEFAULT_MAX_CONCURRENCY
+    _max_attempts = DEFAULT_MAX_ATTEMPTS
+
+    def __init__(self, s3_client, **kwargs):
+        """
+        PackageUploader init method.
+
+        Args:
+            s3_client - a boto3 S3 client (or anything that quacks like one)
+            part_size - bytes per part, at least 5MB
+            multipart_threshold - files smaller than this are sent whole
+            max_concurrency - number of parts in flight at once, within the
+                              global limit set with aio.configure()
+            max_attempts - tries per part before giving up
+
+        Returns:
+           not a damn thing
+        """
+        self._s3_client = s3_client
+        self._part_size = kwargs.get('part_size', DEFAULT_PART_SIZE)
+        self._multipart_threshold = kwargs.get('multipart_threshold', DEFAULT_MULTIPART_THRESHOLD)
+        self._max_concurrency = max(1, kwargs.get('max_concurrency', DEFAULT_MAX_CONCURRENCY))
+        self._max_attempts = max(1, kwargs.get('max_attempts', DEFAULT_MAX_ATTEMPTS))
+        self.parts = []
+
+        if self._part_size < MINIMUM_PART_SIZE:
+            logging.warning('part size {} is below the S3 minimum, using {}'.format(
+                self._part_size,
+                MINIMUM_PART_SIZE
+            ))
+            self._part_size = MINIMUM_PART_SIZE
+
+    def upload(self, file_name, bucket, key):
+        """
+        Upload the given file to s3://bucket/key
+
+        Args:
+            file_name - the local file to send
+            bucket - target bucket
+            key - target key
+
+        Returns:
+            True if the object landed in S3, otherwise False
+        """
+        try:
+            self.parts = []
+            size = os.path.getsize(file_name)
+            if size < self._multipart_threshold:
+                return self._upload_whole(file_name, bucket, key, size)
+
+            return self._upload_parts(file_name, bucket, key, size)
+        except Exception as wtf:
+            logging.error('Exception caught in upload(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+            return False
+
+    def _upload_whole(self, file_name, bucket, key, size):
+        def send():
+            with open(file_name, 'rb') as the_package:
+                self._s3_client.put_object(Bucket=bucket, Key=key, Body=the_package)
+
+        self._attempt(send, 1, size)
+        return True
+
+    def _upload_parts(self, file_name, bucket, key, size):
+        response = self._s3_client.create_multipart_upload(Bucket=bucket, Key=key)
+        upload_id = response['UploadId']
+        part_count = (size + self._part_size - 1) // self._part_size
+        logging.info('uploading {} bytes in {} parts of {} bytes with concurrency {}'.format(
+            size,
+            part_count,
+            self._part_size,
+            self._max_concurrency
+        ))
+
+        async def send_part(part_number):
+            offset = (part_number - 1) * self._part_size
+            length = min(self._part_size, size - offset)
+
+            def send():
+                with open(file_name, 'rb') as the_package:
+                    the_package.seek(offset)
+                    body = the_package.read(length)
+
+                answer = self._s3_client.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body
+                )
+                return answer['ETag']
+
+            etag = await self._attempt_async(send, part_number, length, part_count)
+            return {'ETag': etag, 'PartNumber': part_number}
+
+        started = time.time()
+        try:
+            completed = aio.run(self._send_parts(send_part, part_count))
+        except Exception:
+            logging.error('aborting multipart upload of s3://{}/{}'.format(bucket, key))
+            try:
+                self._s3_client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception as wtf:
+                logging.error('abort_multipart_upload() failed: {}'.format(wtf))
+            raise
+
+        self._s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': completed}
+        )
+
+        elapsed = max(time.time() - started, 0.000001)
+        logging.info('uploaded {} bytes in {:.2f}s ({:.2f} MB/s)'.format(
+            size,
+            elapsed,
+            size / elapsed / MEGABYTE
+        ))
+        return True
+
+    async def _send_parts(self, send_part, part_count):
+        limit = asyncio.Semaphore(self._max_concurrency)
+
+        async def send(part_number):
+            async with limit:
+                return await send_part(part_number)
+
+        # every part is let finish before a failure is raised so the upload
+        # is not aborted under parts still in flight
+        answers = await asyncio.gather(
+            *[send(part_number) for part_number in range(1, part_count + 1)],
+            return_exceptions=True
+        )
+        for answer in answers:
+            if isinstance(answer, BaseException):
+                raise answer
+
+        return answers
+
+    def _attempt(self, send, part_number, length, part_count=1):
+        attempt = 1
+        while True:
+            started = time.time()
+            try:
+                answer = send()
+                self._sent(part_number, part_count, length, started, attempt)
+                return answer
+            except Exception as wtf:
+                time.sleep(self._retry_delay(part_number, part_count, attempt, wtf))
+                attempt += 1
+
+    async def _attempt_async(self, send, part_number, length, part_count=1):
+        attempt = 1
+        while True:
+            started = time.time()
+            try:
+                answer = await aio.call(send)
+                self._sent(part_number, part_count, length, started, attempt)
+                return answer
+            except Exception as wtf:
+                await asyncio.sleep(self._retry_delay(part_number, part_count, attempt, wtf))
+                attempt += 1
+
+    def _sent(self, part_number, part_count, length, started, attempt):
+        elapsed = max(time.time() - started, 0.000001)
+        logging.info('part {}/{}: {} bytes in {:.2f}s ({:.2f} MB/s)'.format(
+            part_number,
+            part_count,
+            length,
+            elapsed,
+            length / elapsed / MEGABYTE
+        ))
+        self.parts.append({
+            'part': part_number,
+            'bytes': length,
+            'seconds': elapsed,
+            'attempts': attempt
+        })
+
+    def _retry_delay(self, part_number, part_count, attempt, wtf):
+        """
+        Log a failed attempt and say how long to wait before the next one.
+        Re-raises the failure when the part is out of attempts, so it must be
+        called from inside the except block.
+        """
+        if attempt >= self._max_attempts:
+            logging.error('part {}/{} failed after {} attempts: {}'.format(
+                part_number,
+                part_count,
+                attempt,
+                wtf
+            ))
+            raise
+
+        logging.warning('part {}/{} attempt {} failed, retrying: {}'.format(
+            part_number,
+            part_count,
+            attempt,
+            wtf
+        ))
+        return RETRY_DELAY * attempt
@@ -1,18 +1,90 @@
-import boto3
 import traceback
 import sys
 import logging
+import threading
 
+DEFAULT_MAX_POOL_CONNECTIONS = 10
 
-def get_api_client(profile_name, region_name, aws_service):
+_sessions = {}
+_clients = {}
+_registry_lock = threading.RLock()
+_max_pool_connections = DEFAULT_MAX_POOL_CONNECTIONS
+
+
+def configure_client_pool(max_pool_connections):
+    """
+    Set the HTTP connection pool size used by clients made from here on.
+
+    Args:
+        max_pool_connections - connections kept per client
+    """
+    global _max_pool_connections
+    if max_pool_connections:
+        _max_pool_connections = int(max_pool_connections)
+
+
+def get_session(profile_name, region_name):
+    """
+    Sessions are shared per (profile, region) so credential resolution and
+    endpoint loading only happen once per process.
+    """
+    import boto3
+
+    key = (profile_name, region_name)
+    with _registry_lock:
+        api_session = _sessions.get(key, None)
+        if api_session is None:
+            if profile_name:
+                api_session = boto3.Session(profile_name=profile_name, region_name=region_name)
+            else:
+                api_session = boto3.Session(region_name=region_name)
+            _sessions[key] = api_session
+
+        return api_session
+
+
+def get_api_client(profile_name, region_name, aws_service, endpoint_url=None, max_pool_connections=None):
+    """
+    Get a client from the process wide registry, making it on first use.
+    Clients are keyed by (profile, region, service) plus the endpoint and
+    pool size when those are given.
+    """
+    from botocore.config import Config
+
+    pool_size = max(max_pool_connections or 0, _max_pool_connections)
+    key = (profile_name, region_name, aws_service, endpoint_url, pool_size)
     try:
-        if profile_name:
-            api_session = boto3.Session(profile_name=profile_name, region_name=region_name)
-        else:
-            api_session = boto3.Session(region_name=region_name)
+        with _registry_lock:
+            api_client = _clients.get(key, None)
+            if api_client is None:
+                api_session = get_session(profile_name, region_name)
+                api_client = api_session.client(
+                    aws_service,
+                    endpoint_url=endpoint_url,
+                    config=Config(max_pool_connections=pool_size)
+                )
+                _clients[key] = api_client
 
-        api_client = api_session.client(aws_service)
-        return api_client
+            return api_client
     except Exception as x:
-        logging.error('Exception caught in get_opsworks_client(): {}'.format(x))
+        logging.error('Exception caught in get_api_client(): {}'.format(x))
         return None
+
+
+def register_client(profile_name, region_name, aws_service, api_client):
+    """
+    Put a ready made client in the registry, e.g. a stand-in for local
+    testing. It is handed out for that (profile, region, service) from now on.
+    """
+    key = (profile_name, region_name, aws_service, None, _max_pool_connections)
+    with _registry_lock:
+        _clients[key] = api_client
+
+
+def clear_clients():
+    """
+    Forget every session and client in the registry.
+    """
+    with _registry_lock:
+        _sessions.clear()
+        _clients.clear()
@@ -0,0 +1,253 @@
+import hashlib
+import logging
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import traceback
+import uuid
+
+from opsworkstool.file_index import FileIndex
+
+VENDOR_SECTION = 'vendor'
+DEFAULT_VENDOR_COMMAND = 'berks vendor {target}'
+DEFAULT_VENDOR_DIRECTORY = os.path.join(os.path.expanduser('~'), '.opsworkstool', 'berks')
+DEPENDENCY_FILES = ('Berksfile', 'Berksfile.lock')
+COMPLETE_MARKER = '.opsworkstool-vendored'
+METADATA_FILES = ('metadata.rb', 'metadata.json')
+# cookbook 'name', path: './name' or the older cookbook 'name', :path => '...'
+PATH_COOKBOOK = re.compile(
+    r'''^\s*cookbook\s+['"][^'"]+['"].*?(?:\bpath:|:path\s*=>)\s*['"]([^'"]+)['"]''',
+    re.MULTILINE
+)
+
+
+def read_vendor_settings(ini_data, overrides=None):
+    """
+    Build the vendor settings from the [vendor] section of config.ini and any
+    command line overrides.
+
+    Args:
+        ini_data - the dictionary made from config/config.ini
+        overrides - dictionary of command line values, None means not given
+
+    Returns:
+        a dictionary suitable for BerkshelfVendor(recipe_dir, **settings)
+    """
+    section = (ini_data or {}).get(VENDOR_SECTION, {})
+    overrides = overrides or {}
+    settings = {}
+    for name in ('command', 'cache_directory'):
+        value = overrides.get(name, None) or section.get(name, None)
+        if value:
+            settings[name] = value
+
+    return settings
+
+
+class BerkshelfVendor(object):
+    """
+    Vendor the cookbook dependencies of recipe/Berksfile into a local cache
+    keyed by a digest of the resolver command, Berksfile, Berksfile.lock and
+    the cookbooks the Berksfile takes from a path: their metadata when they
+    live right under recipe/, which is bundled in their place, and their
+    whole tree otherwise, since then the vendored copy is what ships. An
+    unchanged set of dependencies is never resolved twice; the vendored tree
+    is reused as is.
+
+    The resolver is a command line, `berks vendor {target}` by default, so a
+    stand-in resolver can be plugged in through the [vendor] section.
+    """
+    _recipe_dir = None
+    _command = DEFAULT_VENDOR_COMMAND
+    _cache_directory = DEFAULT_VENDOR_DIRECTORY
+
+    def __init__(self, recipe_dir, **kwargs):
+        """
+        BerkshelfVendor init method.
+
+        Args:
+            recipe_dir - the directory holding the Berksfile
+            command - resolver command line, {target} is replaced with the
+                      directory to vendor into
+            cache_directory - where vendored trees are kept, defaults to
+                              ~/.opsworkstool/berks
+
+        Returns:
+           not a damn thing
+        """
+        self._recipe_dir = recipe_dir
+        self._command = kwargs.get('command', DEFAULT_VENDOR_COMMAND)
+        self._cache_directory = os.path.expanduser(
+            kwargs.get('cache_directory', DEFAULT_VENDOR_DIRECTORY)
+        )
+        self.cache_hit = False
+        self.key = None
+
+    def has_dependencies(self):
+        return os.path.isfile(os.path.join(self._recipe_dir, 'Berksfile'))
+
+    def path_cookbooks(self):
+        """
+        Returns:
+            the path: cookbooks of the Berksfile, relative to the recipe
+            directory, as a tuple of (cookbooks right under recipe/, every
+            other path cookbook)
+        """
+        try:
+            with open(os.path.join(self._recipe_dir, 'Berksfile'), 'r') as f:
+                berksfile = f.read()
+        except (IOError, OSError):
+            return [], []
+
+        inside = []
+        outside = []
+        for cookbook_path in sorted(set(PATH_COOKBOOK.findall(berksfile))):
+            # only a cookbook right under recipe/ is bundled in place of its
+            # vendored copy, see merge_vendored()
+            cookbook_path = os.path.normpath(cookbook_path)
+            if os.path.isabs(cookbook_path) or os.sep in cookbook_path or cookbook_path == os.pardir:
+                outside.append(cookbook_path)
+            else:
+                inside.append(cookbook_path)
+
+        return inside, outside
+
+    def dependency_files(self):
+        """
+        Returns:
+            the files, relative to the recipe directory, that decide what
+            gets vendored: Berksfile, Berksfile.lock and the metadata of each
+            path cookbook under recipe/, where its depends lines live
+        """
+        names = list(DEPENDENCY_FILES)
+        inside, outside = self.path_cookbooks()
+        for cookbook_path in inside:
+            for metadata in METADATA_FILES:
+                names.append(os.path.join(cookbook_path, metadata))
+
+        return names
+
+    def digest(self):
+        """
+        Returns:
+            sha256 of the dependency files, the cache key
+        """
+        digest = hashlib.sha256()
+        digest.update(self._command.encode('utf-8'))
+        digest.update(b'\0')
+        for name in self.dependency_files():
+            path = os.path.join(self._recipe_dir, name)
+            digest.update(name.encode('utf-8'))
+            digest.update(b'\0')
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+            digest.update(b'\0')
+
+        inside, outside = self.path_cookbooks()
+        for cookbook_path in outside:
+            tree = os.path.join(self._recipe_dir, cookbook_path)
+            digest.update(cookbook_path.encode('utf-8'))
+            digest.update(b'\0')
+            digest.update(FileIndex(tree).refresh().digest().encode('ascii'))
+            digest.update(b'\0')
+
+        return digest.hexdigest()
+
+    def vendor(self):
+        """
+        Make sure the dependencies are vendored. The cache key the tree ends
+        up under is left in self.key.
+
+        Args:
+            None
+
+        Returns:
+            the directory holding the vendored cookbooks or None if things
+            went sideways
+        """
+        try:
+            key = self.digest()
+            target = os.path.join(self._cache_directory, key)
+            if os.path.isfile(os.path.join(target, COMPLETE_MARKER)):
+                logging.info('reusing vendored cookbooks in {}'.format(target))
+                self.cache_hit = True
+                self.key = key
+                return target
+
+            if not os.path.isdir(self._cache_directory):
+                os.makedirs(self._cache_directory)
+
+            # the resolver works in a scratch directory that is renamed into
+            # place when it is done so a half vendored tree is never reused
+            scratch = '{}.{}.tmp'.format(target, str(uuid.uuid4())[:8])
+            command = [
+                part.replace('{target}', scratch)
+                for part in shlex.split(self._command)
+            ]
+            logging.info('vendoring cookbooks: {}'.format(' '.join(command)))
+            result = subprocess.run(
+                command,
+                cwd=self._recipe_dir,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT
+            )
+            if result.returncode != 0:
+                logging.error('vendoring failed with exit code {}:\n{}'.format(
+                    result.returncode,
+                    result.stdout.decode('utf-8', 'replace')
+                ))
+                shutil.rmtree(scratch, ignore_errors=True)
+                return None
+
+            if not os.path.isdir(scratch):
+                os.makedirs(scratch)
+            with open(os.path.join(scratch, COMPLETE_MARKER), 'w') as f:
+                f.write(self._command)
+
+            # the resolver writes Berksfile.lock the first time round, so the
+            # tree is kept under the key the next deploy will look for
+            key = self.digest()
+            target = os.path.join(self._cache_directory, key)
+
+            try:
+                os.rename(scratch, target)
+            except OSError:
+                # someone else vendored the same dependencies meanwhile
+                shutil.rmtree(scratch, ignore_errors=True)
+                if not os.path.isfile(os.path.join(target, COMPLETE_MARKER)):
+                    raise
+
+            self.key = key
+            return target
+        except Exception as wtf:
+            logging.error('Exception caught in vendor(): {}'.format(wtf))
+            traceback.print_exc(file=sys.stdout)
+            return None
+
+
+def merge_vendored(recipe_files, vendored_files):
+    """
+    Add the vendored cookbooks to the recipe files. A cookbook that is also
+    in recipe/ is taken from recipe/ and its vendored copy left out.
+
+    Args:
+        recipe_files - (path, arcname) tuples from recipe/
+        vendored_files - (path, arcname) tuples from the vendor directory
+
+    Returns:
+        the combined list of (path, arcname) tuples
+    """
+    local = set(arcname.split('/', 1)[0] for path, arcname in recipe_files)
+    answer = list(recipe_files)
+    for path, arcname in vendored_files:
+        if arcname == COMPLETE_MARKER:
+            continue
+        if arcname.split('/', 1)[0] in local:
+            continue
+        answer.append((path, arcname))
+
+    return answer
@@ -38,12 +38,13 @@ setup(
     author='Will Rubel',
     author_email='willrubel@gmail.com',
     include_package_data=True,
+    python_requires='>=3.7',
     package_data={'opsworkstool': find_data('opsworkstool', 'template')},
     install_requires=[
         'boto3>=1.4.3',
         'GitPython>=2.1.7',
         'Click>=6.7',
-        'PyYAML>=3.12',
+        'PyYAML>=5.1',
         'pymongo>=3.4.0',
         'stackility>=0.3',
         'Mako>=1.0.6'
@@ -0,0 +1,11 @@
+import os
+import sys
+
+TESTS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(TESTS_DIRECTORY)
+BENCHMARKS_DIRECTORY = os.path.join(PROJECT_ROOT, 'benchmarks')
+
+# the stand-ins and the fake resolver live with the benchmarks
+for directory in (PROJECT_ROOT, BENCHMARKS_DIRECTORY):
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
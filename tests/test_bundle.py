@@ -0,0 +1,59 @@
+import hashlib
+import os
+import random
+import zipfile
+
+import pytest
+
+from opsworkstool import bundle
+from opsworkstool.bundle import BundleBuilder
+
+WORDS = ('package', 'service', 'template', 'node', 'default', 'attribute')
+
+
+@pytest.fixture
+def source(tmp_path):
+    rng = random.Random(7)
+    root = tmp_path / 'recipe'
+    for i in range(60):
+        folder = root / 'cookbook{}'.format(i % 4) / ('recipes' if i % 2 else 'files')
+        folder.mkdir(parents=True, exist_ok=True)
+        words = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 4000)))
+        (folder / 'file{:02d}.rb'.format(i)).write_text(words)
+    (root / 'cookbook0' / 'files' / 'asset.png').write_bytes(os.urandom(4096))
+    (root / 'cookbook0' / 'files' / 'empty.rb').write_bytes(b'')
+    return root
+
+
+def build(source, package, **kwargs):
+    BundleBuilder(reproducible=True, **kwargs).build(str(source), str(package))
+    with open(str(package), 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def test_parallel_bundle_is_byte_identical_to_serial(source, tmp_path):
+    serial = build(source, tmp_path / 'serial.zip', workers=1)
+    parallel = build(source, tmp_path / 'parallel.zip', workers=4)
+    assert serial == parallel
+
+    with zipfile.ZipFile(str(tmp_path / 'parallel.zip')) as zf:
+        assert zf.testzip() is None
+        assert zf.getinfo('cookbook0/files/asset.png').compress_type == zipfile.ZIP_STORED
+
+
+def test_byte_window_still_produces_the_same_bundle(source, tmp_path, monkeypatch):
+    serial = build(source, tmp_path / 'serial.zip', workers=1)
+    monkeypatch.setattr(bundle, 'MAX_IN_FLIGHT_BYTES', 1024)
+    assert build(source, tmp_path / 'parallel.zip', workers=4) == serial
+
+
+def test_large_members_are_streamed_in_order(source, tmp_path, monkeypatch):
+    serial = build(source, tmp_path / 'serial.zip', workers=1)
+    monkeypatch.setattr(bundle, 'LARGE_MEMBER_SIZE', 2048)
+    assert build(source, tmp_path / 'parallel.zip', workers=4) == serial
+
+
+def test_unsupported_python_falls_back_to_the_serial_build(source, tmp_path, monkeypatch):
+    serial = build(source, tmp_path / 'serial.zip', workers=1)
+    monkeypatch.setattr(bundle, 'PRECOMPRESSED_PYTHON_VERSIONS', ((2, 0), (2, 7)))
+    assert build(source, tmp_path / 'fallback.zip', workers=4) == serial
@@ -0,0 +1,150 @@
+import os
+import threading
+
+import pytest
+
+from conftest import PROJECT_ROOT
+from deploy_benchmark import make_project
+from deploy_benchmark import use_stand_ins_for_stackility
+from stand_ins import CloudFormationStandIn
+from stand_ins import S3StandIn
+from stand_ins import SSMStandIn
+
+from opsworkstool import stack_poller
+from opsworkstool import utility
+from opsworkstool.opsworks_deployer import OpsworksDeployer
+
+REGION = 'us-east-1'
+STAGES = ['dev', 'qa']
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setattr(stack_poller, 'MINIMUM_DELAY', 0.0)
+    s3 = S3StandIn(region_name=REGION)
+    clients = {
+        's3': s3,
+        'cloudformation': CloudFormationStandIn(s3=s3, region_name=REGION),
+        'ssm': SSMStandIn(region_name=REGION)
+    }
+    for service, client in clients.items():
+        utility.register_client(None, REGION, service, client)
+    use_stand_ins_for_stackility(clients)
+    yield clients
+    utility.clear_clients()
+
+
+@pytest.fixture
+def project(tmp_path):
+    root = tmp_path / 'project'
+    make_project(str(root), files=40, file_size=1, cookbooks=4, stages=STAGES, seed=1)
+    return root
+
+
+def deploy(project, tmp_path, **options):
+    work_directory = tmp_path / 'work'
+    work_directory.mkdir(exist_ok=True)
+    config_block = {
+        'work_directory': str(work_directory),
+        'profile': None,
+        'region': REGION,
+        'template_directory': os.path.join(PROJECT_ROOT, 'opsworkstool', 'template'),
+        'debug': False,
+        'stage': STAGES[0],
+        'stages': STAGES,
+        'cwd': str(project)
+    }
+    config_block.update(options)
+    return OpsworksDeployer(config_block).deploy_opsworks()
+
+
+def calls(clients):
+    return dict(
+        ('{}.{}'.format(service, operation), count)
+        for service, client in clients.items()
+        for operation, count in client.calls.items()
+        if count
+    )
+
+
+def test_stages_are_deployed_in_parallel(clients, project, tmp_path, monkeypatch):
+    seen = set()
+    original = OpsworksDeployer.create_stack
+
+    def create_stack(self):
+        seen.add(threading.current_thread().name)
+        return original(self)
+
+    monkeypatch.setattr(OpsworksDeployer, 'create_stack', create_stack)
+    assert deploy(project, tmp_path)
+    assert len(seen) == len(STAGES)
+    stacks = clients['cloudformation'].stacks
+    assert sorted(stacks) == ['dev-opsworks-project', 'qa-opsworks-project']
+    assert all(stack['status'] == 'CREATE_COMPLETE' for stack in stacks.values())
+
+
+def test_default_pipeline_updates_through_stackility(clients, project, tmp_path):
+    assert deploy(project, tmp_path)
+    assert deploy(project, tmp_path)
+
+    made = calls(clients)
+    assert made['cloudformation.CreateStack'] == len(STAGES)
+    assert made['cloudformation.UpdateStack'] == len(STAGES)
+    for stack in clients['cloudformation'].stacks.values():
+        assert stack['status'] == 'UPDATE_COMPLETE'
+        assert stack['tags']['tool'] == 'opsworkstool'
+        # stackility's tags are reset for every upsert
+        assert list(stack['tags']) == ['tool', 'CODE_VERSION_SD', 'ANSWER']
+
+
+def test_unchanged_change_set_deploy_leaves_the_stacks_alone(clients, project, tmp_path):
+    assert deploy(project, tmp_path, change_set=True)
+    before = calls(clients)
+    assert deploy(project, tmp_path, change_set=True)
+
+    made = calls(clients)
+    assert dict((k, made[k] - before.get(k, 0)) for k in made if made[k] != before.get(k, 0)) == {
+        's3.HeadObject': len(STAGES),
+        'cloudformation.DescribeStacks': len(STAGES)
+    }
+
+
+def test_unchanged_incremental_deploy_makes_no_aws_calls(clients, project, tmp_path):
+    assert deploy(project, tmp_path, incremental=True, change_set=True)
+    before = calls(clients)
+    assert deploy(project, tmp_path, incremental=True, change_set=True)
+    assert calls(clients) == before
+
+
+def test_incremental_deploy_picks_up_a_changed_recipe(clients, project, tmp_path):
+    assert deploy(project, tmp_path, incremental=True, change_set=True)
+    before = calls(clients)
+    recipe = project / 'recipe' / 'cookbook000' / 'recipes' / 'file00000.rb'
+    recipe.write_text(recipe.read_text() + "log 'changed'\n")
+
+    assert deploy(project, tmp_path, incremental=True, change_set=True)
+    made = calls(clients)
+    assert made['cloudformation.ExecuteChangeSet'] - before['cloudformation.ExecuteChangeSet'] == len(STAGES)
+
+
+def test_stages_with_different_buckets_upload_at_the_same_time(clients, project, tmp_path, monkeypatch):
+    both_uploading = threading.Barrier(len(STAGES), timeout=10)
+    original = OpsworksDeployer.upload_package
+
+    def upload_package(self):
+        # breaks with BrokenBarrierError if the uploads run one at a time
+        both_uploading.wait()
+        return original(self)
+
+    monkeypatch.setattr(OpsworksDeployer, 'upload_package', upload_package)
+    assert deploy(project, tmp_path)
+    buckets = set(bucket for bucket, key in clients['s3'].objects if key.endswith('.zip'))
+    assert buckets == set('bench-{}'.format(stage) for stage in STAGES)
+
+
+def test_index_is_only_kept_for_content_digest_deploys(clients, project, tmp_path):
+    assert deploy(project, tmp_path)
+    assert not (project / '.opsworkstool-index.json').exists()
+
+    assert deploy(project, tmp_path, content_digest=True)
+    assert (project / '.opsworkstool-index.json').exists()
@@ -0,0 +1,95 @@
+import os
+import time
+
+from opsworkstool import file_index
+from opsworkstool.file_index import FileIndex
+
+
+def make_tree(root):
+    (root / 'cookbook' / 'recipes').mkdir(parents=True)
+    (root / 'cookbook' / 'recipes' / 'default.rb').write_text("log 'one'\n")
+    (root / 'cookbook' / 'metadata.rb').write_text("name 'cookbook'\n")
+
+
+def age(root, seconds):
+    """
+    Push every mtime in the tree back so it is out of the racy window.
+    """
+    then = time.time() - seconds
+    for folder, subs, files in os.walk(str(root)):
+        for name in files + subs:
+            os.utime(os.path.join(folder, name), (then, then))
+    os.utime(str(root), (then, then))
+
+
+def test_unchanged_tree_is_not_hashed_again(tmp_path):
+    source = tmp_path / 'recipe'
+    make_tree(source)
+    age(source, 60)
+    index_file = str(tmp_path / 'index.json')
+
+    first = FileIndex(str(source), index_file)
+    digest = first.refresh().digest()
+    assert first.files_hashed == 2
+    first.save()
+
+    second = FileIndex(str(source), index_file)
+    assert second.refresh().digest() == digest
+    assert second.files_hashed == 0
+    assert second.directories_listed == 0
+
+
+def test_files_in_the_racy_window_are_hashed_again(tmp_path):
+    source = tmp_path / 'recipe'
+    make_tree(source)
+    index_file = str(tmp_path / 'index.json')
+
+    first = FileIndex(str(source), index_file)
+    digest = first.refresh().digest()
+    first.save()
+
+    # same size, and the mtime can land on the same tick: only the racy
+    # window catches this change
+    recipe = source / 'cookbook' / 'recipes' / 'default.rb'
+    info = os.stat(str(recipe))
+    recipe.write_text("log 'two'\n")
+    os.utime(str(recipe), ns=(info.st_atime_ns, info.st_mtime_ns))
+
+    second = FileIndex(str(source), index_file)
+    assert second.refresh().digest() != digest
+    assert second.files_hashed == 2
+
+
+def test_files_outside_the_racy_window_trust_their_stat(tmp_path, monkeypatch):
+    monkeypatch.setattr(file_index, 'RACY_SECONDS', 0.0)
+    source = tmp_path / 'recipe'
+    make_tree(source)
+    age(source, 60)
+    index_file = str(tmp_path / 'index.json')
+
+    first = FileIndex(str(source), index_file)
+    first.refresh().digest()
+    first.save()
+
+    recipe = source / 'cookbook' / 'recipes' / 'default.rb'
+    recipe.write_text("log 'changed'\n")
+
+    second = FileIndex(str(source), index_file)
+    second.refresh().digest()
+    assert second.files_hashed == 1
+    assert [arcname for arcname, sha in second.hashes()] == [
+        'cookbook/metadata.rb',
+        'cookbook/recipes/default.rb'
+    ]
+
+
+def test_parallel_hashing_matches_serial(tmp_path):
+    source = tmp_path / 'recipe'
+    for i in range(20):
+        folder = source / 'cookbook{}'.format(i % 3)
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / 'file{}.rb'.format(i)).write_text('x' * (i * 100))
+
+    serial = FileIndex(str(source)).refresh().hashes()
+    parallel = FileIndex(str(source), workers=4).refresh().hashes()
+    assert serial == parallel
@@ -0,0 +1,87 @@
+import os
+
+from stand_ins import S3StandIn
+
+from opsworkstool import transfer
+from opsworkstool.transfer import MEGABYTE
+from opsworkstool.transfer import PackageUploader
+
+
+class FlakyS3(S3StandIn):
+    """
+    Fails the first attempt of the given parts.
+    """
+    def __init__(self, failing_parts=(), **kwargs):
+        S3StandIn.__init__(self, **kwargs)
+        self._failing = set(failing_parts)
+
+    def upload_part(self, **kwargs):
+        if kwargs['PartNumber'] in self._failing:
+            self._failing.discard(kwargs['PartNumber'])
+            raise IOError('connection reset')
+        return S3StandIn.upload_part(self, **kwargs)
+
+
+class DeadS3(S3StandIn):
+    def upload_part(self, **kwargs):
+        self._call('UploadPart')
+        raise IOError('connection reset')
+
+
+def make_package(tmp_path, size):
+    package = tmp_path / 'package.zip'
+    package.write_bytes(os.urandom(size))
+    return str(package)
+
+
+def uploader(s3, **kwargs):
+    settings = {'part_size': 5 * MEGABYTE, 'multipart_threshold': 5 * MEGABYTE, 'max_concurrency': 4}
+    settings.update(kwargs)
+    return PackageUploader(s3, **settings)
+
+
+def test_small_package_is_sent_whole(tmp_path):
+    package = make_package(tmp_path, 1024)
+    s3 = S3StandIn()
+
+    assert uploader(s3).upload(package, 'bucket', 'key')
+    assert s3.calls['PutObject'] == 1
+    assert s3.calls['CreateMultipartUpload'] == 0
+    with open(package, 'rb') as f:
+        assert s3.objects[('bucket', 'key')] == f.read()
+
+
+def test_parts_are_reassembled_in_order(tmp_path):
+    package = make_package(tmp_path, 12 * MEGABYTE + 17)
+    s3 = S3StandIn()
+
+    assert uploader(s3).upload(package, 'bucket', 'key')
+    assert s3.calls['UploadPart'] == 3
+    assert s3.calls['CompleteMultipartUpload'] == 1
+    with open(package, 'rb') as f:
+        assert s3.objects[('bucket', 'key')] == f.read()
+
+
+def test_failed_part_is_retried_on_its_own(tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer, 'RETRY_DELAY', 0.0)
+    package = make_package(tmp_path, 12 * MEGABYTE)
+    s3 = FlakyS3(failing_parts=[2])
+
+    engine = uploader(s3)
+    assert engine.upload(package, 'bucket', 'key')
+    assert s3.calls['UploadPart'] == 3
+    assert dict((p['part'], p['attempts']) for p in engine.parts) == {1: 1, 2: 2, 3: 1}
+    with open(package, 'rb') as f:
+        assert s3.objects[('bucket', 'key')] == f.read()
+
+
+def test_upload_is_aborted_when_a_part_runs_out_of_attempts(tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer, 'RETRY_DELAY', 0.0)
+    package = make_package(tmp_path, 12 * MEGABYTE)
+    s3 = DeadS3()
+
+    assert not uploader(s3, max_attempts=2).upload(package, 'bucket', 'key')
+    assert s3.calls['UploadPart'] == 6
+    assert s3.calls['AbortMultipartUpload'] == 1
+    assert s3.calls['CompleteMultipartUpload'] == 0
+    assert ('bucket', 'key') not in s3.objects
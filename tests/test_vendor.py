@@ -0,0 +1,119 @@
+import os
+import sys
+
+import pytest
+
+from conftest import BENCHMARKS_DIRECTORY
+from opsworkstool.vendor import BerkshelfVendor
+from opsworkstool.vendor import COMPLETE_MARKER
+from opsworkstool.vendor import merge_vendored
+
+FAKE_BERKS = os.path.join(BENCHMARKS_DIRECTORY, 'fake_berks.py')
+
+
+@pytest.fixture
+def project(tmp_path):
+    recipe = tmp_path / 'recipe'
+    (recipe / 'proj').mkdir(parents=True)
+    (recipe / 'proj' / 'metadata.rb').write_text("name 'proj'\ndepends 'apt'\n")
+    (tmp_path / 'shared' / 'recipes').mkdir(parents=True)
+    (tmp_path / 'shared' / 'recipes' / 'default.rb').write_text("log 'shared'\n")
+    (recipe / 'Berksfile').write_text(
+        'source "https://supermarket.getchef.com"\n\n'
+        "cookbook 'proj', path: './proj'\n"
+        "cookbook 'shared', path: '../shared'\n"
+        "cookbook 'apt'\n"
+    )
+    return tmp_path
+
+
+def vendor(project, command=None):
+    """
+    Vendor with the fake resolver and report whether it had to run.
+    """
+    command = command or '"{}" "{}" {{target}} --files 2'.format(sys.executable, FAKE_BERKS)
+    tool = BerkshelfVendor(
+        str(project / 'recipe'),
+        command=command,
+        cache_directory=str(project / 'cache')
+    )
+    target = tool.vendor()
+    assert target is not None
+    return tool, target
+
+
+def test_second_vendor_is_a_cache_hit(project):
+    first, target = vendor(project)
+    assert not first.cache_hit
+    assert os.path.isfile(os.path.join(target, COMPLETE_MARKER))
+    assert os.path.isfile(os.path.join(target, 'apt', 'metadata.rb'))
+    # the resolver wrote Berksfile.lock; the tree is kept under the key
+    # that takes it into account
+    assert (project / 'recipe' / 'Berksfile.lock').exists()
+    assert first.key == first.digest()
+
+    second, second_target = vendor(project)
+    assert second.cache_hit
+    assert second.key == first.key
+    assert second_target == target
+
+
+@pytest.mark.parametrize('change', [
+    lambda p: (p / 'recipe' / 'Berksfile').write_text(
+        (p / 'recipe' / 'Berksfile').read_text() + "cookbook 'git'\n"
+    ),
+    lambda p: (p / 'recipe' / 'Berksfile.lock').write_text('DEPENDENCIES\n  apt (2.0.0)\n'),
+    lambda p: (p / 'recipe' / 'proj' / 'metadata.rb').write_text("name 'proj'\ndepends 'apt'\ndepends 'git'\n"),
+    lambda p: (p / 'shared' / 'recipes' / 'default.rb').write_text("log 'changed'\n"),
+], ids=['berksfile', 'lock', 'path-cookbook-metadata', 'external-path-cookbook-tree'])
+def test_dependency_changes_invalidate_the_cache(project, change):
+    first, target = vendor(project)
+    change(project)
+
+    second, second_target = vendor(project)
+    assert not second.cache_hit
+    assert second.key != first.key
+    assert second_target != target
+
+
+def test_recipe_change_in_local_path_cookbook_keeps_the_cache(project):
+    first, target = vendor(project)
+    (project / 'recipe' / 'proj' / 'recipes').mkdir()
+    (project / 'recipe' / 'proj' / 'recipes' / 'default.rb').write_text("log 'local'\n")
+
+    second, second_target = vendor(project)
+    assert second.cache_hit
+    assert second_target == target
+
+
+def test_resolver_command_is_part_of_the_key(project):
+    first, target = vendor(project)
+    second, second_target = vendor(
+        project,
+        command='"{}" "{}" {{target}} --files 3'.format(sys.executable, FAKE_BERKS)
+    )
+    assert not second.cache_hit
+    assert second.key != first.key
+
+
+def test_failed_resolver_leaves_nothing_behind(project):
+    tool = BerkshelfVendor(
+        str(project / 'recipe'),
+        command='"{}" -c "import sys; sys.exit(3)"'.format(sys.executable),
+        cache_directory=str(project / 'cache')
+    )
+    assert tool.vendor() is None
+    assert os.listdir(str(project / 'cache')) == []
+
+
+def test_local_cookbooks_win_over_vendored_copies():
+    recipe_files = [('/r/proj/recipes/default.rb', 'proj/recipes/default.rb')]
+    vendored_files = [
+        ('/v/proj/recipes/default.rb', 'proj/recipes/default.rb'),
+        ('/v/apt/metadata.rb', 'apt/metadata.rb'),
+        ('/v/' + COMPLETE_MARKER, COMPLETE_MARKER)
+    ]
+    assert merge_vendored(recipe_files, vendored_files) == [
+        ('/r/proj/recipes/default.rb', 'proj/recipes/default.rb'),
+        ('/v/apt/metadata.rb', 'apt/metadata.rb')
+    ]